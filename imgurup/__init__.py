@@ -9,12 +9,15 @@ import logging
 import subprocess
 
 import random
-import mimetypes
 import json
 from abc import ABCMeta
 from abc import abstractmethod
 import time
 import shutil
+import socket
+import threading
+import uuid
+import contextlib
 
 if sys.version_info >= (3,):
     import http.client as httplib
@@ -29,6 +32,51 @@ else:
     from ConfigParser import NoOptionError, NoSectionError
     from string import letters as ascii_letters
 
+from .preflight import get_content_type
+from .preflight import preflight
+from .engine import UploadEngine
+from .engine import run_concurrently
+from .engine import get_size
+from .breaker import CircuitBreaker
+from .breaker import ConnectionError
+from .breaker import TRANSPORT_ERRORS
+from .journal import Journal
+from .progress import PipeProgressDialog
+from .progress import DBusProgressDialog
+from .progress import ProgressBar
+from .trace import TimingReport
+from .transfer import MultipartBody
+from .transfer import TransferProgress
+from .profiling import Profiler
+from .profiling import MemoryReport
+from .profiling import dump_on_signal
+from .metrics import Metrics
+from .metrics import MetricsExporter
+from .metrics import StatsdClient
+from .metrics import serve_metrics
+from .schedule import POLICIES
+from .schedule import DEFAULT_LARGE_SIZE
+from .schedule import schedule_jobs
+from .manifest import read_manifest
+from .manifest import resolve_albums
+from .manifest import check_jobs
+from .manifest import ManifestError
+from .watch import DirectoryWatcher
+from .sync import sync_directory
+from .backup import backup_account
+from .backup import iter_pages
+from .manage import read_targets
+from .manage import delete_images
+from .manage import update_images
+from .spool import Spool
+from .spool import DEFAULT_SPOOL_DIR
+from .spool import DEFAULT_STALE_TIMEOUT
+from .spool import get_owner
+from .spool import get_source
+from .spool import is_retryable
+from .spool import run_worker
+from .spool import start_heartbeat
+
 # To flake8, raw_input is a undefined name in python3
 # So we need to use the try except method to make compatibility
 try:
@@ -75,9 +123,35 @@ class ImgurError(Exception):
     pass
 
 
+class ImgurUnconfirmedError(ImgurError):
+    """The request was sent, but its response was lost, so it may have
+    succeeded
+    """
+
+
+class ImgurConnectionError(ImgurError, ConnectionError):
+    """The tries of a request failed by connection errors, so the
+    circuit breaker tells it apart from the errors of Imgur
+    """
+
+
+# Tag added to the description of authenticated uploads if asked
+# (--fingerprint), so a upload can be found again after its response is lost
+FINGERPRINT_FORMAT = '[imgurup:{fingerprint}]'
+
+# Tag of the rate_limit event -> header of the responses
+RATE_LIMIT_HEADERS = (
+    ('client', 'X-RateLimit-ClientRemaining'),
+    ('user', 'X-RateLimit-UserRemaining'),
+    ('post', 'X-Post-Rate-Limit-Remaining'),
+)
+
+
 class Imgur:
     __metaclass__ = ABCMeta
     CONFIG_PATH = os.path.expanduser("~/.imgurup.conf")
+    # A batch shows one summary dialog at the end, not a dialog per file
+    batch_summary = True
 
     def __init__(self,
                  client_id='55080e3fd8d0644',
@@ -94,8 +168,33 @@ class Imgur:
         self._access_token = None
         self._refresh_token = None
         self._api_url = None
-        self._connect = None
-        self._request = None
+        self._api_scheme = 'https'
+        self._ssl_context = None
+        # Each thread has its own connection, so an instance can be shared
+        # by the workers of an upload engine
+        self._local = threading.local()
+        # Reentrant: a refresh writes the config while holding it
+        self._token_lock = threading.RLock()
+        # Number of token refreshes, so the workers failing together
+        # refresh the tokens once
+        self._token_generation = 0
+        # If False, errors raise ImgurError instead of exiting the program
+        self.exit_on_error = True
+        # Tag the description of authenticated uploads to avoid duplicates
+        # when retrying, off by default: the description is public
+        self.fingerprint_uploads = False
+        # Journal of the result records, see `show_result()`
+        self.journal = None
+        # If True, the links are not shown (they are written to the journal)
+        self.quiet = False
+        # If False, asking the user exits with an error instead, ex: stdout
+        # is kept for the records of --output ndjson
+        self.interactive = True
+        # Told the timed phases of the requests, see `trace.Tracer`
+        self.tracers = []
+        # Seconds before a connection or a response fails,
+        # None to wait forever
+        self.timeout = None
 
         self._auth_url = (
             'https://api.imgur.com/oauth2/authorize?'
@@ -110,18 +209,115 @@ class Imgur:
         self._enter_token_msg = 'Enter PIN code displayed in the browser: '
         self._no_album_msg = 'Do not move to any album'
 
-    def connect(self, url='api.imgur.com'):
+    def connect(self, url='api.imgur.com', context=None):
         """Connect to the api host, call this before calling upload()
-        :param url: url of API server
+        :param url: url of API server, `host[:port]` for HTTPS, or
+         `http://host:port` / `https://host:port`, ex: a local
+         `testing.FakeImgur`
         :type url: str
+        :param context: SSL context of the HTTPS connections,
+         ex: to trust a self-signed certificate
+        :type context: ssl.SSLContext
+        """
+        scheme, _, host = url.rpartition('://')
+        self._api_scheme = scheme or 'https'
+        self._api_url = host.rstrip('/')
+        self._ssl_context = context
+        self._local.connect = self._new_connection()
+
+    def _new_connection(self):
+        """Create a connection to the api host, not connected yet"""
+        kwargs = {}
+        if self.timeout is not None:
+            kwargs['timeout'] = self.timeout
+        if self._api_scheme == 'http':
+            return httplib.HTTPConnection(self._api_url, **kwargs)
+        if self._ssl_context is not None:
+            kwargs['context'] = self._ssl_context
+        return httplib.HTTPSConnection(self._api_url, **kwargs)
+
+    @property
+    def _connect(self):
+        """The connection of the current thread, created on first use
         """
-        self._api_url = url
-        self._connect = httplib.HTTPSConnection(url)
-        self._request = self._connect.request
+        connect = getattr(self._local, 'connect', None)
+        if connect is None and self._api_url is not None:
+            connect = self._local.connect = self._new_connection()
+        return connect
+
+    @property
+    def _request(self):
+        """Send a request with the connection of the current thread,
+        the connect and send phases are traced
+        """
+        connect = self._connect
+
+        def request(method, url, body=None, headers=None):
+            if connect.sock is None:
+                with self._phase('connect'):
+                    connect.connect()
+            with self._phase('send'):
+                connect.request(method, url, body, headers or {})
+        return request
+
+    def _emit(self, event, **tags):
+        """Tell the tracers an event, see `trace.EVENTS`"""
+        for tracer in self.tracers:
+            tracer.on_event(event, tags)
+
+    def _emit_rate_limit(self, response):
+        """Tell the tracers the remaining requests given by a response"""
+        tags = {}
+        for tag, header in RATE_LIMIT_HEADERS:
+            try:
+                tags[tag] = int(response.getheader(header))
+            except (TypeError, ValueError):
+                continue
+        if tags:
+            self._emit('rate_limit', **tags)
+
+    def add_tracer(self, tracer):
+        """Add a tracer told the timed phases of the requests
+
+        :param tracer: Tracer
+        :type tracer: trace.Tracer
+        """
+        self.tracers.append(tracer)
+
+    def is_reachable(self, timeout=3):
+        """Check if the API server can be connected
 
-    def retry(errors=(ImgurError, httplib.BadStatusLine)):
+        :param timeout: Seconds to wait for the connection
+        :type timeout: float
+        :rtype: bool
+        """
+        connect = self._new_connection()
+        try:
+            socket.create_connection(
+                (connect.host, connect.port), timeout
+            ).close()
+        except socket.error:
+            return False
+        return True
+
+    def reset_connection(self):
+        """Close the connection of the current thread after a error,
+        it will reconnect with the next request
+        """
+        connect = getattr(self._local, 'connect', None)
+        if connect is not None:
+            connect.close()
+
+    def retry(errors=(ImgurError, httplib.BadStatusLine), confirm=None):
         """Retry calling the decorated function using an exponential backoff.
 
+        An error of the connection reconnects before retrying, a 401 or 403
+        response reauthorizes, other responses (ex: 429 or 5xx) only wait.
+        Nothing is done after the last try. If the response of a
+        request is lost (ImgurUnconfirmedError), the method named `confirm`
+        is called with the same arguments, and its result is returned
+        instead of sending the request again if it's not None.
+
         http://www.saltycrane.com/blog/2009/11/trying-out-retry-decorator-python/
         original from: http://wiki.python.org/moin/PythonDecoratorLibrary#Retry
         """
@@ -131,21 +327,69 @@ class Imgur:
         def deco_retry(f):
             def f_retry(self, *args, **kwargs):
                 for attempt in range(tries):
+                    generation = self._token_generation
                     try:
                         result = f(self, *args, **kwargs)
                         return result['data']
-                    except errors:
-                        logger.info('reauthorize...')
-                        self.request_new_tokens_and_update()
-                        self.write_tokens_to_config()
-                        time.sleep(delay)
+                    except errors as e:
+                        connection_failed = isinstance(
+                            e, (ImgurUnconfirmedError,) + TRANSPORT_ERRORS
+                        )
+                        self._emit(
+                            'retry',
+                            function=f.__name__,
+                            error=e.__class__.__name__
+                        )
+                        last = attempt == tries - 1
+                        if isinstance(e, ImgurUnconfirmedError):
+                            self.reset_connection()
+                            if confirm is not None:
+                                result = getattr(self, confirm)(
+                                    *args, **kwargs
+                                )
+                                if result is not None:
+                                    logger.info('Request already succeeded')
+                                    return result
+                        elif not isinstance(e, ImgurError):
+                            logger.info('reconnect...')
+                            self.reset_connection()
+                        elif self.last_status in (401, 403):
+                            if not last:
+                                logger.info('reauthorize...')
+                                self.refresh_tokens(generation)
+                        else:
+                            # The tokens are fine, ex: rate limited or a
+                            # server error
+                            logger.info('retry...')
+                        if not last:
+                            time.sleep(delay)
                 else:
-                    self.show_error_and_exit(
-                        'Error in {function}'.format(function=f.__name__)
-                    )
+                    msg = 'Error in {function}'.format(function=f.__name__)
+                    if connection_failed and self._raises_errors():
+                        raise ImgurConnectionError(msg)
+                    self.show_error_and_exit(msg)
             return f_retry  # true decorator
         return deco_retry
 
+    def _raises_errors(self):
+        """Check if the errors of the current thread raise ImgurError
+        instead of exiting the program
+        """
+        return (not self.exit_on_error or
+                getattr(self._local, 'checking', False))
+
+    @contextlib.contextmanager
+    def _checking(self):
+        """Raise the errors of the current thread instead of exiting,
+        the other threads sharing the instance are not changed
+        """
+        checking = getattr(self._local, 'checking', False)
+        self._local.checking = True
+        try:
+            yield
+        finally:
+            self._local.checking = checking
+
     @abstractmethod
     def get_error_dialog_args(self, msg='Error'):
         """Return the subprocess args of display error dialog
@@ -162,7 +406,11 @@ class Imgur:
 
         :param msg: Error message
         :type msg: str
+        :raise ImgurError: If `exit_on_error` is False, or while the
+         current thread only checks something (see `_checking()`)
         """
+        if self._raises_errors():
+            raise ImgurError(msg)
         args = self.get_error_dialog_args(msg)
         if args:
             p = subprocess.Popen(
@@ -204,19 +452,79 @@ class Imgur:
         :return: Json response
         :rtype: dict
         """
-        response = self._connect.getresponse().read()
-        return json.loads(response.decode('utf-8'))
+        with self._phase('ttfb'):
+            response = self._connect.getresponse()
+        self._local.status = response.status
+        if self.tracers:
+            self._emit_rate_limit(response)
+        with self._phase('read'):
+            content = response.read()
+        with self._phase('parse'):
+            return json.loads(content.decode('utf-8'))
+
+    @property
+    def last_upload_stats(self):
+        """Stats of the last upload of the current thread: `attempts` and
+        `timings` (phase -> seconds, summed over the attempts, see
+        `trace.PHASES`). None if no upload was started
+        """
+        return getattr(self._local, 'upload_stats', None)
+
+    @contextlib.contextmanager
+    def _phase(self, phase):
+        """Time a phase of a request: tell the tracers, and add it to the
+        timings of the upload running in the current thread if any
+        """
+        tags = getattr(self._local, 'upload_tags', None) or {}
+        for tracer in self.tracers:
+            tracer.on_phase_start(phase, tags)
+        started = time.time()
+        try:
+            yield
+        finally:
+            seconds = time.time() - started
+            if tags:
+                timings = self._local.upload_stats['timings']
+                timings[phase] = timings.get(phase, 0) + seconds
+            for tracer in self.tracers:
+                tracer.on_phase_end(phase, seconds, tags)
+
+    @property
+    def last_status(self):
+        """HTTP status of the last response read by the current thread,
+        None if no response was read
+        """
+        return getattr(self._local, 'status', None)
+
+    @last_status.setter
+    def last_status(self, value):
+        self._local.status = value
+
+    @contextlib.contextmanager
+    def _keep_status(self):
+        """Keep `last_status` of the failed request through the requests
+        made to recover it, ex: a token refresh
+        """
+        status = self.last_status
+        try:
+            yield
+        finally:
+            self.last_status = status
 
     @retry()
-    def request_album_list(self, account='me'):
+    def request_album_list(self, account='me', page=None):
         """Request album list with the account
 
         :param account: The account name, 'me' means yourself
         :type account: str
+        :param page: Page number (start from 0), None means the first page
+        :type page: int
         :return: Response of requesting albums list (json)
         :rtype: list of dict
         """
         url = '/3/account/{account}/albums'.format(account=account)
+        if page is not None:
+            url += '/{page}'.format(page=page)
 
         if account == 'me':
             if self._access_token is None:
@@ -264,27 +572,78 @@ class Imgur:
                 'grant_type': 'refresh_token'
             }
         )
-        self._request('POST', url, params, headers)
-        return self._get_json_response()
+        with self._keep_status():
+            self._request('POST', url, params, headers)
+            return self._get_json_response()
 
     def request_new_tokens_and_update(self):
         """Request and update the access token and refresh token
         """
 
-        if self._refresh_token is None:
-            self.set_tokens_using_config()
-        if self._refresh_token is None:
-            self.show_error_and_exit(
-                'Can\'t read the value of refresh_token, '
-                'you may have to authorize again'
-            )
+        with self._token_lock:
+            if self._refresh_token is None:
+                self.set_tokens_using_config()
+            if self._refresh_token is None:
+                self.show_error_and_exit(
+                    'Can\'t read the value of refresh_token, '
+                    'you may have to authorize again'
+                )
+
+            response = self.request_new_tokens()
+            if self.is_success(response):
+                self._access_token = response['access_token']
+                self._refresh_token = response['refresh_token']
+                self._token_generation += 1
+                self._emit('token_refresh')
+            else:
+                self.show_error_and_exit('Update tokens fail')
 
-        response = self.request_new_tokens()
-        if self.is_success(response):
-            self._access_token = response['access_token']
-            self._refresh_token = response['refresh_token']
+    def refresh_tokens(self, generation=None):
+        """Request new tokens and write them to the config, unless
+        another thread already did it
+
+        :param generation: `_token_generation` when the failed request was
+         sent, None to always refresh
+        :type generation: int
+        """
+        with self._token_lock:
+            if (generation is not None and
+                    generation != self._token_generation):
+                logger.info('Tokens already refreshed')
+                return
+            self.request_new_tokens_and_update()
+            self.write_tokens_to_config()
+
+    def ensure_tokens(self):
+        """Make sure the tokens are set, read them from the config or
+        ask the user to authorize if they are not
+        """
+        if self._access_token is None or self._refresh_token is None:
+            self._emit('token_cache', hit=False)
+            with self._phase('token_load'):
+                self.set_tokens_using_config()
         else:
-            self.show_error_and_exit('Update tokens fail')
+            self._emit('token_cache', hit=True)
+        if self._access_token is None or self._refresh_token is None:
+            # If the tokens are empty, means this is the first time
+            # using this tool, so call auth() to get tokens
+            self.auth()
+            self.write_tokens_to_config()
+
+    def get_auth_header(self, anonymous=False):
+        """Get the value of the Authorization header
+
+        :param anonymous: Use the client id instead of the access token
+        :type anonymous: bool
+        :return: Authorization header value
+        :rtype: str
+        """
+        if anonymous:
+            return 'Client-ID {client_id}'.format(client_id=self._client_id)
+        self.ensure_tokens()
+        return 'Bearer {access_token}'.format(
+            access_token=self._access_token
+        )
 
     @abstractmethod
     def get_auth_msg_dialog_args(self, auth_msg, auth_url):
@@ -394,14 +753,16 @@ class Imgur:
         logger.debug('Access token: %s', self._access_token)
         logger.debug('Refresh token: %s', self._refresh_token)
 
-        parser = SafeConfigParser()
-        parser.read(self.CONFIG_PATH)
-        if not parser.has_section('Token'):
-            parser.add_section('Token')
-        parser.set('Token', 'access_token', self._access_token)
-        parser.set('Token', 'refresh_token', self._refresh_token)
-        with open(self.CONFIG_PATH, 'w') as f:
-            parser.write(f)
+        # The workers of a upload engine must not write the file together
+        with self._token_lock:
+            parser = SafeConfigParser()
+            parser.read(self.CONFIG_PATH)
+            if not parser.has_section('Token'):
+                parser.add_section('Token')
+            parser.set('Token', 'access_token', self._access_token)
+            parser.set('Token', 'refresh_token', self._refresh_token)
+            with open(self.CONFIG_PATH, 'w') as f:
+                parser.write(f)
 
     @abstractmethod
     def get_ask_image_path_dialog_args(self):
@@ -507,8 +868,70 @@ class Imgur:
         )
         show_link_dialog.communicate()
 
-    def _encode_multipart_data(self, data, files):
+    def open_progress_dialog(self, total):
+        """Open one dialog showing the progress of a batch
+
+        :param total: Number of files of the batch
+        :type total: int
+        :return: Dialog with `update(done, text)` and `close()`,
+         None if there is no progress dialog
+        """
+        return None
+
+    def get_summary(self, records, album_links=()):
+        """Get the text of the summary of a batch
+
+        :param records: Result records of the batch
+        :type records: list of dict
+        :param album_links: Links of the albums of the batch
+        :type album_links: list of str
+        :return: Links of the images and the albums, and the failures
+        :rtype: str
+        """
+        lines = []
+        for record in records:
+            if record['error'] is None:
+                lines.append('Link: {link}'.format(
+                    link=record['link'].replace('\\', '')
+                ))
+                lines.append(
+                    'Delete link: http://imgur.com/delete/{delete}'.format(
+                        delete=record['deletehash']
+                    )
+                )
+        for album_link in album_links:
+            lines.append('Album link: {link}'.format(link=album_link))
+        for record in records:
+            if record['error'] is not None:
+                lines.append('Failed: {path}: {error}'.format(
+                    path=record['path'], error=record['error']
+                ))
+        return '\n'.join(lines)
+
+    def show_summary(self, records, album_links=()):
+        """Show the links of a batch with one dialog
+
+        :param records: Result records of the batch
+        :type records: list of dict
+        :param album_links: Links of the albums of the batch
+        :type album_links: list of str
+        """
+        args = self.get_show_link_dialog_args(
+            self.get_summary(records, album_links)
+        )
+        show_summary_dialog = subprocess.Popen(
+            args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        show_summary_dialog.communicate()
+
+    def _encode_multipart_data(self, data, files, content_types=None):
         """From http://stackoverflow.com/questions/68477
+
+        :param content_types: Field name -> content type of the files
+         already sniffed, the other files are sniffed here
+        :type content_types: dict
         """
 
         def random_string(length):
@@ -516,12 +939,6 @@ class Imgur:
                 random.choice(ascii_letters) for ii in range(length + 1)
             )
 
-        def get_content_type(filename):
-            return (
-                mimetypes.guess_type(filename)[0] or
-                'application/octet-stream'
-            )
-
         def encode_field(field_name):
             return (
                 ('--' + boundary).encode('utf-8'),
@@ -539,11 +956,12 @@ class Imgur:
                     field_name, filename
                 )).encode('utf-8'),
                 ('Content-Type: %s' % (
-                    get_content_type(filename)
+                    content_types.get(field_name) or get_content_type(filename)
                 )).encode('utf-8'),
-                b'', open(filename, 'rb').read()
+                b'', ('file', filename)
             )
 
+        content_types = content_types or {}
         boundary = random_string(30)
         lines = []
         for name in data:
@@ -551,7 +969,13 @@ class Imgur:
         for name in files:
             lines.extend(encode_file(name))
         lines.extend((('--%s--' % boundary).encode('utf-8'), b''))
-        body = '\r\n'.encode('utf-8').join(lines)
+        # The image is read from the disk while the body is sent
+        parts = []
+        for i, line in enumerate(lines):
+            if i:
+                parts.append(b'\r\n')
+            parts.append(line)
+        body = MultipartBody(parts)
 
         headers = {
             'content-type': 'multipart/form-data; boundary=' + boundary,
@@ -560,25 +984,313 @@ class Imgur:
 
         return body, headers
 
-    @retry()
-    def request_upload_image(self, url, body, headers):
+    def _get_progress_callback(self, total):
+        """Get the callback of a body telling the tracers the progress of
+        its transfer, None if no tracer
+        """
+        if not self.tracers:
+            return None
+        progress = TransferProgress(total)
+        tags = getattr(self._local, 'upload_tags', None) or {}
+
+        def callback(sent):
+            if progress.update(sent):
+                for tracer in self.tracers:
+                    tracer.on_progress(progress, tags)
+        return callback
+
+    def find_uploaded_image(self, url, body, headers, fingerprint=None):
+        """Look for a upload in the recent images of the account
+
+        :param fingerprint: The fingerprint in the description of the image
+        :type fingerprint: str
+        :return: Data of the uploaded image, None if not found
+        :rtype: dict
+        """
+        if fingerprint is None:
+            return None
+        tag = FINGERPRINT_FORMAT.format(fingerprint=fingerprint)
+        # Only a check: if it fails, the upload is sent again
+        try:
+            with self._checking(), self._keep_status():
+                images = self.request_account_images()
+        except (ImgurError,) + TRANSPORT_ERRORS:
+            logger.info('Can\'t check the recent images, upload again')
+            return None
+        for image in images:
+            if tag in (image.get('description') or ''):
+                return image
+        return None
+
+    @retry(
+        errors=(ImgurError,) + TRANSPORT_ERRORS,
+        confirm='find_uploaded_image'
+    )
+    def request_upload_image(self, url, body, headers, fingerprint=None):
         """Request upload image
 
         :param url: Upload url
         :type url: str
-        :param body: The content string of the request
-        :type body: str
+        :param body: The content of the request
+        :type body: str or transfer.MultipartBody
         :param headers: The headers of the request
         :type headers: dict
+        :param fingerprint: The fingerprint tagged in the description,
+         used to check if the upload succeeded when its response is lost
+        :type fingerprint: str
         :return: Response of upload image
         :rtype: dict
         """
+        tags = getattr(self._local, 'upload_tags', None)
+        if tags:
+            self._local.upload_stats['attempts'] += 1
+            tags['attempt'] = self._local.upload_stats['attempts']
+        if isinstance(body, MultipartBody):
+            body.rewind(self._get_progress_callback(len(body)))
         self._request('POST', url, body, headers)
+        try:
+            json_response = self._get_json_response()
+        except TRANSPORT_ERRORS as e:
+            # The body is sent, so Imgur may have got the image
+            raise ImgurUnconfirmedError(e)
+        if not self.is_success(json_response):
+            raise ImgurError
+        return json_response
+
+    def _album_ids_params(self, ids, anonymous):
+        """Encode a list of image ids (or deletehashes if anonymous)
+        as form fields, the order of the list is kept
+        """
+        field = 'deletehashes[]' if anonymous else 'ids[]'
+        return [(field, _id) for _id in ids]
+
+    @retry()
+    def request_album_create(self, ids, title=None, cover=None,
+                             anonymous=False):
+        """Create a album with images
+
+        :param ids: Image ids in the album order,
+         or deletehashes if anonymous
+        :type ids: list of str
+        :param title: Album title
+        :type title: str
+        :param cover: Image id of the cover
+        :type cover: str
+        :param anonymous: Create a anonymous album
+        :type anonymous: bool
+        :return: Response of creating the album, data has id and deletehash
+        :rtype: dict
+        """
+        url = '/3/album'
+        params = self._album_ids_params(ids, anonymous)
+        if title is not None:
+            params.append(('title', title))
+        if cover is not None:
+            params.append(('cover', cover))
+        headers = {
+            'Content-type': 'application/x-www-form-urlencoded',
+            'Authorization': self.get_auth_header(anonymous)
+        }
+        self._request('POST', url, urlencode(params), headers)
+        json_response = self._get_json_response()
+        if not self.is_success(json_response):
+            raise ImgurError
+        return json_response
+
+    @retry()
+    def request_album_add_images(self, album_id, ids, anonymous=False):
+        """Add images to the end of a album with one request
+
+        :param album_id: Album id, or album deletehash if anonymous
+        :type album_id: str
+        :param ids: Image ids in the album order,
+         or deletehashes if anonymous
+        :type ids: list of str
+        :param anonymous: The album is anonymous
+        :type anonymous: bool
+        :return: Response of adding images
+        :rtype: dict
+        """
+        url = '/3/album/{album_id}/add'.format(album_id=album_id)
+        headers = {
+            'Content-type': 'application/x-www-form-urlencoded',
+            'Authorization': self.get_auth_header(anonymous)
+        }
+        self._request(
+            'POST',
+            url,
+            urlencode(self._album_ids_params(ids, anonymous)),
+            headers
+        )
+        json_response = self._get_json_response()
+        if not self.is_success(json_response):
+            raise ImgurError
+        return json_response
+
+    @retry()
+    def request_album_set_images(self, album_id, ids, anonymous=False):
+        """Replace the images of a album with one request
+
+        :param album_id: Album id, or album deletehash if anonymous
+        :type album_id: str
+        :param ids: Image ids in the album order,
+         or deletehashes if anonymous
+        :type ids: list of str
+        :param anonymous: The album is anonymous
+        :type anonymous: bool
+        :return: Response of updating the album
+        :rtype: dict
+        """
+        url = '/3/album/{album_id}'.format(album_id=album_id)
+        headers = {
+            'Content-type': 'application/x-www-form-urlencoded',
+            'Authorization': self.get_auth_header(anonymous)
+        }
+        self._request(
+            'POST',
+            url,
+            urlencode(self._album_ids_params(ids, anonymous)),
+            headers
+        )
+        json_response = self._get_json_response()
+        if not self.is_success(json_response):
+            raise ImgurError
+        return json_response
+
+    @retry()
+    def request_account_images(self, page=0):
+        """Request a page of the images of your account
+
+        :param page: Page number, start from 0
+        :type page: int
+        :return: Response of requesting images
+        :rtype: list of dict
+        """
+        url = '/3/account/me/images/{page}'.format(page=page)
+        headers = {'Authorization': self.get_auth_header()}
+        self._request('GET', url, None, headers)
+        json_response = self._get_json_response()
+        if not self.is_success(json_response):
+            raise ImgurError
+        return json_response
+
+    @retry()
+    def request_album_images(self, album_id):
+        """Request the images of a album
+
+        :param album_id: Album id
+        :type album_id: str
+        :return: Response of requesting images
+        :rtype: list of dict
+        """
+        url = '/3/album/{album_id}/images'.format(album_id=album_id)
+        headers = {'Authorization': self.get_auth_header()}
+        self._request('GET', url, None, headers)
+        json_response = self._get_json_response()
+        if not self.is_success(json_response):
+            raise ImgurError
+        return json_response
+
+    @retry()
+    def request_image_delete(self, image_id, anonymous=False):
+        """Delete a image
+
+        :param image_id: Image id, or image deletehash if anonymous
+        :type image_id: str
+        :param anonymous: The image is anonymous
+        :type anonymous: bool
+        :return: Response of deleting the image
+        :rtype: dict
+        """
+        url = '/3/image/{image_id}'.format(image_id=image_id)
+        headers = {'Authorization': self.get_auth_header(anonymous)}
+        self._request('DELETE', url, None, headers)
+        json_response = self._get_json_response()
+        if not self.is_success(json_response):
+            raise ImgurError
+        return json_response
+
+    @retry()
+    def request_image_update(self, image_id, title=None, description=None,
+                             anonymous=False):
+        """Update the title and description of a image
+
+        :param image_id: Image id, or image deletehash if anonymous
+        :type image_id: str
+        :param title: New title, None to keep it
+        :type title: str
+        :param description: New description, None to keep it
+        :type description: str
+        :param anonymous: The image is anonymous
+        :type anonymous: bool
+        :return: Response of updating the image
+        :rtype: dict
+        """
+        url = '/3/image/{image_id}'.format(image_id=image_id)
+        params = {}
+        if title is not None:
+            params['title'] = title
+        if description is not None:
+            params['description'] = description
+        headers = {
+            'Content-type': 'application/x-www-form-urlencoded',
+            'Authorization': self.get_auth_header(anonymous)
+        }
+        self._request('POST', url, urlencode(params), headers)
         json_response = self._get_json_response()
         if not self.is_success(json_response):
             raise ImgurError
         return json_response
 
+    def upload_image(self, image_path, post_data=None, anonymous=False,
+                     content_type=None):
+        """Upload a image without any dialog
+
+        :param image_path: The path or the URL of the image
+        :type image_path: str
+        :param post_data: Other fields like title, description and album id
+        :type post_data: dict
+        :param anonymous: Upload the image anonymously
+        :type anonymous: bool
+        :param content_type: Content type of the file if already sniffed,
+         see `preflight.check_file()`
+        :type content_type: str
+        :return: Data of the uploaded image (id, link, deletehash...)
+        :rtype: dict
+        """
+        url = '/3/image'
+        post_data = dict(post_data or {})
+        if image_path.startswith(('http://', 'https://')):
+            post_data['image'] = image_path
+            post_data['type'] = 'url'
+            files = {}
+        else:
+            files = {'image': image_path}
+        content_types = {'image': content_type} if content_type else None
+        fingerprint = None
+        if not anonymous and self.fingerprint_uploads:
+            fingerprint = uuid.uuid4().hex[:16]
+            tag = FINGERPRINT_FORMAT.format(fingerprint=fingerprint)
+            if post_data.get('description'):
+                tag = post_data['description'] + '\n\n' + tag
+            post_data['description'] = tag
+        # The phases of the upload are tagged until it returns
+        self._local.upload_stats = {'attempts': 0, 'timings': {}}
+        self._local.upload_tags = {
+            'path': image_path, 'size': get_size(image_path), 'attempt': 0
+        }
+        try:
+            with self._phase('encode'):
+                body, headers = self._encode_multipart_data(
+                    post_data, files, content_types
+                )
+            headers['Authorization'] = self.get_auth_header(anonymous)
+            return self.request_upload_image(
+                url, body, headers, fingerprint=fingerprint
+            )
+        finally:
+            self._local.upload_tags = None
+
     def upload(self, image_path=None, meta=None):
         """Upload a image
 
@@ -588,28 +1300,16 @@ class Imgur:
         :type meta: dict
         :return:
         """
-        url = '/3/image'
         post_data = {}
-        headers = {}
-        files = {'image': image_path}
 
         if image_path is None:
             image_path = self.ask_image_path()
         if meta['image_name_as_title']:
             post_data['title'] = image_path.split(os.sep)[-1]
         if meta['anonymous']:  # Anonymous account
-            print('Upload the image anonymously...')
-            body, headers = self._encode_multipart_data(post_data, files)
-            headers['Authorization'] = 'Client-ID {client_id}'.format(
-                client_id=self._client_id
-            )
+            logger.info('Upload the image anonymously...')
         else:
-            self.set_tokens_using_config()
-            if self._access_token is None or self._refresh_token is None:
-                # If the tokens are empty, means this is the first time
-                # using this tool, so call auth() to get tokens
-                self.auth()
-                self.write_tokens_to_config()
+            self.ensure_tokens()
             if (meta['album_id'] is None) or meta['ask']:
                 # Means user doesn't specify the album
                 albums = self.request_album_list()
@@ -625,17 +1325,15 @@ class Imgur:
                 logger.info('Upload the image to the album...')
                 post_data['album_id'] = meta['album_id']
 
-            body, headers = self._encode_multipart_data(post_data, files)
-            headers['Authorization'] = 'Bearer {access_token}'.format(
-                access_token=self._access_token
-            )
-
-        result = self.request_upload_image(url, body, headers)
+        result = self.upload_image(image_path, post_data, meta['anonymous'])
         self.show_link(result['link'], result['deletehash'])
 
 
 class CLIImgur(Imgur):
 
+    # The links are printed as soon as each upload finishes
+    batch_summary = False
+
     def get_error_dialog_args(self, msg='Error'):
         return None
 
@@ -645,7 +1343,14 @@ class CLIImgur(Imgur):
     def get_enter_pin_dialog_args(self, token_msg):
         raise NotImplementedError()
 
+    def _ensure_interactive(self, hint):
+        if not self.interactive:
+            self.show_error_and_exit(
+                'Can\'t ask with --output ndjson, {hint}'.format(hint=hint)
+            )
+
     def ask_pin(self, auth_msg, auth_url, enter_token_msg):
+        self._ensure_interactive('authorize once without it')
         print(auth_msg + auth_url)
         pin = input(enter_token_msg)
         return pin
@@ -654,6 +1359,7 @@ class CLIImgur(Imgur):
         raise NotImplementedError()
 
     def ask_image_path(self):
+        self._ensure_interactive('give the images with -f')
         image_path = input('Enter your image location: ')
         return image_path
 
@@ -663,6 +1369,7 @@ class CLIImgur(Imgur):
     def ask_album_id(self, albums):
         i = 1
         data_map = []
+        self._ensure_interactive('give the album with -d or upload with -n')
         print('Enter the number of the album you want to upload: ')
         for album in albums:
             print(
@@ -746,6 +1453,15 @@ class KDEImgur(Imgur):
         ]
         return args
 
+    def open_progress_dialog(self, total):
+        args = [
+            'kdialog',
+            '--progressbar',
+            'Uploading {total} images'.format(total=total),
+            str(total),
+        ]
+        return DBusProgressDialog(args, total)
+
 
 class MacImgur(Imgur):
 
@@ -879,6 +1595,23 @@ class MacImgur(Imgur):
             )
             show_delete_link_dialog.communicate()
 
+    def show_summary(self, records, album_links=()):
+        text = self.get_summary(records, album_links)
+        args = [
+            'osascript',
+            '-e',
+            (
+                'tell app "Finder" to display dialog "{text}" '
+                'buttons {{"OK"}}'.format(text=text.replace('"', '\\"'))
+            ),
+        ]
+        show_summary_dialog = subprocess.Popen(
+            args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        show_summary_dialog.communicate()
+
 
 class ZenityImgur(Imgur):
 
@@ -942,6 +1675,666 @@ class ZenityImgur(Imgur):
         ]
         return args
 
+    def open_progress_dialog(self, total):
+        args = [
+            'zenity',
+            '--progress',
+            '--auto-close',
+            '--text=Uploading {total} images'.format(total=total),
+        ]
+        return PipeProgressDialog(args, total)
+
+
+def show_result(imgur, record):
+    """Show the result record of an upload engine, and write it to the
+    journal of the instance if any
+
+    :param imgur: Imgur instance
+    :type imgur: Imgur
+    :param record: Result record
+    :type record: dict
+    """
+    if imgur.journal is not None:
+        imgur.journal.write(record)
+    for tracer in imgur.tracers:
+        tracer.on_result(record)
+    if record['error'] is None:
+        if not imgur.quiet:
+            imgur.show_link(record['link'], record['deletehash'])
+    else:
+        logger.error('%s: %s', record['path'], record['error'])
+
+
+def get_text_stream(args):
+    """Get the stream of the messages about the results
+
+    :param args: Parsed command line arguments
+    :type args: argparse.Namespace
+    :return: stderr with --output ndjson (stdout is kept for the records),
+     otherwise stdout
+    :rtype: file
+    """
+    return sys.stderr if args.output == 'ndjson' else sys.stdout
+
+
+def get_album_ids(value):
+    """Split the value of the -d option
+
+    :param value: Album ids separated by commas
+    :type value: str
+    :return: Album ids
+    :rtype: list of str
+    """
+    if not value:
+        return []
+    return [_id.strip() for _id in value.split(',') if _id.strip()]
+
+
+def get_album_link(album_id):
+    return 'http://imgur.com/a/{album_id}'.format(album_id=album_id)
+
+
+def get_large_size(args):
+    """Get the size from which a file is uploaded in the large lane
+
+    :param args: Parsed command line arguments
+    :type args: argparse.Namespace
+    :return: Bytes, 0 for no large lane
+    :rtype: int
+    """
+    return int(args.large_size * 1024 * 1024)
+
+
+def set_checked(job, args):
+    """Set the content type and the size found by the preflight of the
+    -f files, so the file is not sniffed again
+
+    :param job: Upload job of a -f file
+    :type job: dict
+    :param args: Parsed command line arguments
+    :type args: argparse.Namespace
+    """
+    checked = getattr(args, 'checked', None) or {}
+    if job['path'] in checked:
+        job['content_type'], job['size'] = checked[job['path']]
+
+
+def get_upload_engine(imgur, args, give_up=True):
+    """Get a upload engine configured by the command line
+
+    :param imgur: Connected Imgur instance
+    :type imgur: Imgur
+    :param args: Parsed command line arguments
+    :type args: argparse.Namespace
+    :param give_up: The circuit breaker fails the remaining uploads after
+     a failed probe, False for a long running session
+    :type give_up: bool
+    :rtype: UploadEngine
+    """
+    engine = UploadEngine(
+        imgur,
+        args.workers,
+        args.min_workers,
+        breaker=CircuitBreaker(
+            args.breaker_threshold, args.breaker_cooldown, give_up
+        ),
+        hash_files=imgur.journal is not None
+    )
+    for tracer in imgur.tracers:
+        tracer.on_engine(engine)
+    return engine
+
+
+def upload_batch(imgur, args):
+    """Upload the files concurrently, then put them into the album with one
+    request, so the album keeps the order of the files.
+    A GUI instance shows one progress dialog during the batch and one
+    summary dialog at the end.
+
+    :param imgur: Connected Imgur instance
+    :type imgur: Imgur
+    :param args: Parsed command line arguments
+    :type args: argparse.Namespace
+    """
+    album_ids = get_album_ids(args.d)
+    cover = None
+    if args.new_album is not None and args.cover:
+        # The cover may be given relative and the files absolute
+        cover = os.path.abspath(args.cover)
+        if cover not in [os.path.abspath(path) for path in args.f]:
+            imgur.show_error_and_exit(
+                'The cover is not one of the uploaded images: {path}'.format(
+                    path=args.cover
+                )
+            )
+    if not args.n:
+        imgur.ensure_tokens()
+        if not album_ids and args.new_album is None:
+            # Choose the album once for the whole batch
+            album_id = imgur.ask_album_id(imgur.request_album_list())
+            if album_id is not None:
+                album_ids = [album_id]
+
+    jobs = []
+    for path in args.f:
+        job = {'path': path, 'anonymous': args.n}
+        if args.t:
+            job['title'] = os.path.basename(path)
+        set_checked(job, args)
+        jobs.append(job)
+
+    records = [None] * len(jobs)
+    summary = imgur.batch_summary and not imgur.quiet
+    progress = imgur.open_progress_dialog(len(jobs)) if summary else None
+    counts = {'done': 0}
+
+    def on_result(record):
+        # Keep only what the album and the summary need,
+        # a batch can be very large
+        records[record['index']] = dict(
+            (key, record[key])
+            for key in ('path', 'id', 'link', 'deletehash', 'error')
+        )
+        counts['done'] += 1
+        if not summary:
+            show_result(imgur, record)
+            return
+        if imgur.journal is not None:
+            imgur.journal.write(record)
+        for tracer in imgur.tracers:
+            tracer.on_result(record)
+        if record['error'] is not None:
+            logger.error('%s: %s', record['path'], record['error'])
+        if progress is not None:
+            progress.update(counts['done'], os.path.basename(record['path']))
+
+    engine = get_upload_engine(imgur, args)
+    try:
+        succeeded, failed = engine.run(
+            schedule_jobs(jobs, args.order, get_large_size(args)),
+            on_result
+        )
+    finally:
+        if progress is not None:
+            progress.close()
+
+    # Anonymous albums are managed with the deletehashes of the images
+    key = 'deletehash' if args.n else 'id'
+    ids = [record[key] for record in records if record['error'] is None]
+    album_links = []
+    if ids and args.new_album is not None:
+        cover_id = None
+        if cover is not None:
+            for record in records:
+                if (os.path.abspath(record['path']) == cover and
+                        record['error'] is None):
+                    cover_id = record['id']
+            if cover_id is None:
+                logger.error(
+                    'The cover %s is not uploaded, the album has no cover',
+                    args.cover
+                )
+        album = imgur.request_album_create(
+            ids, args.new_album, cover_id, args.n
+        )
+        album_links.append(get_album_link(album['id']))
+        logger.info('Album link: %s', album_links[-1])
+        if args.n:
+            logger.info('Album deletehash: %s', album['deletehash'])
+    elif ids and album_ids:
+        # The images are uploaded once, then added to each album
+        results = run_concurrently(
+            lambda album_id: imgur.request_album_add_images(
+                album_id, ids, args.n
+            ),
+            album_ids,
+            args.workers
+        )
+        for album_id, (_, error) in zip(album_ids, results):
+            if error is None:
+                album_links.append(get_album_link(album_id))
+                logger.info('Album link: %s', album_links[-1])
+            else:
+                logger.error('Add to album %s fail: %s', album_id, error)
+                failed += 1
+    if summary:
+        imgur.show_summary(records, album_links)
+    if failed:
+        sys.exit(1)
+
+
+def upload_manifest(imgur, args):
+    """Upload all the records of a manifest with one upload engine
+
+    :param imgur: Connected Imgur instance
+    :type imgur: Imgur
+    :param args: Parsed command line arguments
+    :type args: argparse.Namespace
+    """
+    def get_jobs():
+        for job in read_manifest(args.manifest):
+            job['anonymous'] = args.n
+            if args.n and job.get('album'):
+                # The albums are looked up in the account
+                job['error'] = 'Album needs a authenticated upload, not -n'
+            if args.t and 'title' not in job:
+                job['title'] = os.path.basename(job['path'])
+            yield job
+
+    jobs = check_jobs(get_jobs())
+    if not args.n:
+        imgur.ensure_tokens()
+        # Every page of the albums, not only the first 50
+        jobs = resolve_albums(jobs, lambda: iter_pages(
+            lambda page: imgur.request_album_list(page=page)
+        ))
+    engine = get_upload_engine(imgur, args)
+    try:
+        succeeded, failed = engine.run(
+            schedule_jobs(jobs, args.order, get_large_size(args)),
+            lambda record: show_result(imgur, record)
+        )
+    except (ManifestError, ImgurError, IOError) as e:
+        imgur.show_error_and_exit('Manifest error: {e}'.format(e=e))
+    logger.info('%d uploaded, %d failed', succeeded, failed)
+    if failed:
+        sys.exit(1)
+
+
+def watch_directory(imgur, args):
+    """Upload the files dropped into a directory until interrupted.
+    One upload engine is kept for the whole session, so the connections
+    stay warm between the files.
+
+    :param imgur: Connected Imgur instance
+    :type imgur: Imgur
+    :param args: Parsed command line arguments
+    :type args: argparse.Namespace
+    """
+    if not os.path.isdir(args.watch):
+        imgur.show_error_and_exit(
+            'Not a directory: {path}'.format(path=args.watch)
+        )
+    album_ids = get_album_ids(args.d)
+    if not args.n:
+        imgur.ensure_tokens()
+    watcher = DirectoryWatcher(args.watch, args.debounce)
+
+    def get_jobs():
+        for path in watcher:
+            job = {'path': path, 'anonymous': args.n}
+            if album_ids:
+                job['album_ids'] = album_ids
+            if args.t:
+                job['title'] = os.path.basename(path)
+            yield job
+
+    # An outage must not fail the files dropped after it
+    engine = get_upload_engine(imgur, args, give_up=False)
+    try:
+        engine.run(
+            check_jobs(get_jobs()),
+            lambda record: show_result(imgur, record)
+        )
+    except KeyboardInterrupt:
+        logger.info('Stop watching %s', args.watch)
+    finally:
+        watcher.close()
+
+
+def sync_album(imgur, args):
+    """Mirror a directory to a album
+
+    :param imgur: Connected Imgur instance
+    :type imgur: Imgur
+    :param args: Parsed command line arguments
+    :type args: argparse.Namespace
+    """
+    album_ids = get_album_ids(args.d)
+    if len(album_ids) != 1 or args.n:
+        imgur.show_error_and_exit(
+            'Sync needs one album of your account, use --album'
+        )
+    if not os.path.isdir(args.sync):
+        imgur.show_error_and_exit(
+            'Not a directory: {path}'.format(path=args.sync)
+        )
+    try:
+        uploaded, removed, failed = sync_directory(
+            imgur,
+            args.sync,
+            album_ids[0],
+            args.delete_remote,
+            args.workers,
+            lambda record: show_result(imgur, record),
+            get_upload_engine(imgur, args)
+        )
+    except (ImgurError, IOError, OSError) as e:
+        imgur.show_error_and_exit('Sync error: {e}'.format(e=e))
+    logger.info(
+        '%d uploaded, %d removed, %d failed', uploaded, removed, failed
+    )
+    if failed:
+        sys.exit(1)
+
+
+def backup_to_directory(imgur, args):
+    """Download all the albums and images of the account
+
+    :param imgur: Connected Imgur instance
+    :type imgur: Imgur
+    :param args: Parsed command line arguments
+    :type args: argparse.Namespace
+    """
+    def on_result(image, error):
+        if error is None:
+            logger.info('Downloaded %s', image['link'])
+        else:
+            logger.error('%s: %s', image['link'], error)
+
+    downloaded, skipped, failed = backup_account(
+        imgur, args.backup, args.workers, on_result
+    )
+    logger.info(
+        '%d downloaded, %d already present, %d failed',
+        downloaded, skipped, failed
+    )
+    if failed:
+        sys.exit(1)
+
+
+def manage_images(imgur, args):
+    """Delete or update the images read from a file or stdin
+
+    :param imgur: Connected Imgur instance
+    :type imgur: Imgur
+    :param args: Parsed command line arguments
+    :type args: argparse.Namespace
+    """
+    if args.delete:
+        path, run, done_msg = args.delete, delete_images, 'Deleted'
+    else:
+        path, run, done_msg = args.update_meta, update_images, 'Updated'
+    if not args.n:
+        imgur.ensure_tokens()
+    failed = []
+    stream = get_text_stream(args)
+
+    def on_result(target, error):
+        name = target.get('deletehash') or target.get('id')
+        if error is None:
+            print('{msg}: {name}'.format(msg=done_msg, name=name), file=stream)
+        else:
+            failed.append(name)
+            logger.error('%s: %s', name, error)
+        stream.flush()
+
+    try:
+        run(imgur, read_targets(path), on_result, args.workers)
+    except (ValueError, IOError) as e:
+        imgur.show_error_and_exit('Input error: {e}'.format(e=e))
+    if failed:
+        sys.exit(1)
+
+
+def get_batch_jobs(args):
+    """Get the upload jobs of the -f files
+
+    :param args: Parsed command line arguments
+    :type args: argparse.Namespace
+    :return: Upload jobs
+    :rtype: list of dict
+    """
+    album_ids = get_album_ids(args.d)
+    jobs = []
+    for path in args.f:
+        job = {'path': path, 'anonymous': args.n}
+        if album_ids:
+            job['album_ids'] = album_ids
+        if args.t:
+            job['title'] = os.path.basename(path)
+        set_checked(job, args)
+        jobs.append(job)
+    return jobs
+
+
+def queue_uploads(args):
+    """Record the -f uploads into the spool, without any network traffic
+
+    :param args: Parsed command line arguments
+    :type args: argparse.Namespace
+    """
+    spool = Spool(args.spool)
+    stream = get_text_stream(args)
+    for job in get_batch_jobs(args):
+        spool.put(job, args.copy)
+        print('Queued: {path}'.format(path=job['path']), file=stream)
+
+
+def flush_spool(imgur, args):
+    """Upload the jobs of the spool if the network is reachable.
+    The jobs failed by the network or the server are kept in the spool for
+    the next flush, the others (ex: a missing file) are put aside.
+
+    :param imgur: Connected Imgur instance
+    :type imgur: Imgur
+    :param args: Parsed command line arguments
+    :type args: argparse.Namespace
+    """
+    spool = Spool(args.spool)
+    # The claims of a flush or a worker which died
+    spool.recover_stale(args.stale_timeout)
+    pending = len(spool.pending())
+    if not pending:
+        logger.info('Nothing to flush')
+        return
+    if not imgur.is_reachable():
+        logger.error('Network unreachable, %d uploads kept', pending)
+        sys.exit(1)
+    if not args.n:
+        imgur.ensure_tokens()
+    owner = get_owner()
+    claimed = {}
+    lock = threading.Lock()
+    stop = threading.Event()
+    put_aside = []
+
+    def get_jobs():
+        for index, job in enumerate(spool.claim_all(owner)):
+            with lock:
+                claimed[index] = job
+            yield job
+
+    def on_result(record):
+        with lock:
+            job = claimed.pop(record['index'])
+        record['path'] = get_source(job)
+        if record['error'] is None:
+            spool.done(job)
+        elif job.get('error') is not None or not is_retryable(record):
+            # Never succeeds, ex: a missing file, or rejected by Imgur
+            spool.fail(job, record)
+            put_aside.append(job['spool_name'])
+        else:
+            spool.release(job)
+        show_result(imgur, record)
+
+    engine = get_upload_engine(imgur, args)
+    start_heartbeat(spool, claimed, lock, stop, args.stale_timeout / 3.0)
+    try:
+        succeeded, failed = engine.run(check_jobs(get_jobs()), on_result)
+    finally:
+        stop.set()
+    logger.info(
+        '%d uploaded, %d failed and kept, %d failed and put aside',
+        succeeded, failed - len(put_aside), len(put_aside)
+    )
+    if failed:
+        sys.exit(1)
+
+
+def work_on_spool(imgur, args):
+    """Upload the jobs of a spool shared with other workers,
+    until interrupted
+
+    :param imgur: Connected Imgur instance
+    :type imgur: Imgur
+    :param args: Parsed command line arguments
+    :type args: argparse.Namespace
+    """
+    if not args.n:
+        imgur.ensure_tokens()
+    stop = threading.Event()
+    try:
+        run_worker(
+            imgur,
+            Spool(args.worker),
+            args.workers,
+            args.stale_timeout,
+            on_result=lambda record: show_result(imgur, record),
+            stop=stop,
+            engine=get_upload_engine(imgur, args, give_up=False),
+            policy=args.order,
+            large_size=get_large_size(args)
+        )
+    except KeyboardInterrupt:
+        stop.set()
+        logger.info('Stop the worker')
+
+
+def start_metrics(imgur, args):
+    """Collect the metrics of the instance and export them as asked by the
+    command line
+
+    :param imgur: Imgur instance
+    :type imgur: Imgur
+    :param args: Parsed command line arguments
+    :type args: argparse.Namespace
+    :return: The exporter to close at the end, None if no metrics
+    :rtype: metrics.MetricsExporter
+    """
+    if not (args.metrics_textfile or args.metrics_port or args.statsd):
+        return None
+    metrics = Metrics(keep_samples=bool(args.statsd))
+    imgur.add_tracer(metrics)
+    if args.metrics_port:
+        server = serve_metrics(metrics, args.metrics_port)
+        logger.info(
+            'Metrics on http://%s:%d/metrics', *server.server_address[:2]
+        )
+    statsd = StatsdClient(metrics, args.statsd) if args.statsd else None
+    return MetricsExporter(
+        metrics, args.metrics_textfile, statsd, args.metrics_interval
+    )
+
+
+def start_profiling(args):
+    """Start the profiling asked by the command line
+
+    :param args: Parsed command line arguments
+    :type args: argparse.Namespace
+    :return: (profiler, memory report), None if not asked
+    :rtype: tuple
+    """
+    profiler = None
+    memory = None
+    if args.profile:
+        profiler = Profiler()
+        profiler.start()
+    if args.trace_malloc:
+        try:
+            memory = MemoryReport(args.trace_malloc)
+        except RuntimeError as e:
+            logger.error('%s', e)
+        else:
+            memory.start()
+    if (profiler or memory) and (args.watch or args.worker):
+        # Long running: take a snapshot with `kill -USR1 <pid>`
+        if dump_on_signal(profiler, args.profile, memory):
+            logger.info('Send SIGUSR1 to %d for a snapshot', os.getpid())
+    return profiler, memory
+
+
+def stop_profiling(profiler, memory, args):
+    """Write the profile and report the memory at the end of the run"""
+    if profiler is not None:
+        profiler.stop()
+    # Before writing the profile, which allocates a lot
+    if memory is not None:
+        memory.log_report()
+        memory.stop()
+    if profiler is not None:
+        profiler.dump(args.profile)
+
+
+def run_command(imgur, args):
+    """Run the command given by the command line
+
+    :param imgur: Imgur instance
+    :type imgur: Imgur
+    :param args: Parsed command line arguments
+    :type args: argparse.Namespace
+    """
+    if args.manifest:
+        imgur.connect()
+        upload_manifest(imgur, args)
+        return
+    if args.watch:
+        imgur.connect()
+        watch_directory(imgur, args)
+        return
+    if args.sync:
+        imgur.connect()
+        sync_album(imgur, args)
+        return
+    if args.backup:
+        imgur.connect()
+        backup_to_directory(imgur, args)
+        return
+    if args.delete or args.update_meta:
+        imgur.connect()
+        manage_images(imgur, args)
+        return
+    if args.flush:
+        imgur.connect()
+        flush_spool(imgur, args)
+        return
+    if args.worker:
+        imgur.connect()
+        work_on_spool(imgur, args)
+        return
+    if not args.q:
+        args.f = [
+            f if f is not None else imgur.ask_image_path() for f in args.f
+        ]
+    if args.f and None not in args.f:
+        # Check the whole batch before any network traffic
+        valid, problems = preflight(args.f)
+        for path, msg in problems:
+            logger.error('%s: %s', path, msg)
+        if not valid:
+            imgur.show_error_and_exit('No valid image to upload')
+        args.f = [path for path, content_type, size in valid]
+        args.checked = dict(
+            (path, (content_type, size)) for path, content_type, size in valid
+        )
+    if args.queue:
+        queue_uploads(args)
+        return
+    imgur.connect()
+    if args.f and None not in args.f and (not args.q or args.g):
+        # In GUI mode the album is chosen once for the batch even with -q
+        upload_batch(imgur, args)
+        return
+    meta = {
+        'album_id': args.d,
+        'ask': args.q,
+        'anonymous': args.n,
+        'image_name_as_title': args.t,
+    }
+    for f in args.f:
+        imgur.upload(f, meta)
+
 
 def main():
     formatter = logging.Formatter('%(levelname)s: %(message)s')
@@ -959,11 +2352,15 @@ def main():
         help='The images you want to upload',
         metavar='<image path>'
     )
-    parser.add_argument(
+    album_group = parser.add_mutually_exclusive_group()
+    album_group.add_argument(
         '-d',
+        '--album',
+        dest='d',
         nargs='?',
         default=None,
-        help='The album id you want your image to be uploaded to',
+        help='The album id you want your image to be uploaded to, '
+        'several albums can be separated by commas',
         metavar='<album id>'
     )
     parser.add_argument(
@@ -992,6 +2389,241 @@ def main():
         action='store_true',
         help='Use image name as the title'
     )
+    parser.add_argument(
+        '-v',
+        action='store_true',
+        help='Show the time of each phase of every upload, and the '
+        'percentiles of the batch'
+    )
+    parser.add_argument(
+        '--manifest',
+        default=None,
+        help='Upload the records of a JSON lines or CSV file '
+        '(path or url, title, description, album), - for stdin',
+        metavar='<manifest>'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=4,
+        help='Highest number of concurrent uploads (default: 4)',
+        metavar='<number>'
+    )
+    parser.add_argument(
+        '--min-workers',
+        type=int,
+        default=1,
+        help='Lowest number of concurrent uploads, the number is adjusted '
+        'between it and --workers by the latency and errors (default: 1)',
+        metavar='<number>'
+    )
+    parser.add_argument(
+        '--order',
+        choices=POLICIES,
+        default='fifo',
+        help='Order of the uploads: as given, smallest files first, or by '
+        'the priority of the manifest records (default: fifo)'
+    )
+    parser.add_argument(
+        '--large-size',
+        type=float,
+        default=DEFAULT_LARGE_SIZE / 1024 / 1024,
+        help='Files from this size are uploaded one at a time beside the '
+        'other files, 0 to disable (default: 10)',
+        metavar='<MB>'
+    )
+    parser.add_argument(
+        '--breaker-threshold',
+        type=int,
+        default=5,
+        help='Stop sending uploads after this number of connection or '
+        'server errors in a row, 0 to never stop (default: 5)',
+        metavar='<number>'
+    )
+    parser.add_argument(
+        '--breaker-cooldown',
+        type=float,
+        default=30,
+        help='Seconds before trying again after stopping, the remaining '
+        'uploads fail if this try fails, with --watch the cooldown doubles '
+        'instead (default: 30)',
+        metavar='<seconds>'
+    )
+    parser.add_argument(
+        '--output',
+        choices=('text', 'ndjson'),
+        default='text',
+        help='ndjson: write the result of each upload as a JSON line to '
+        'stdout instead of --journal, without any dialog or prompt (not '
+        'with -q), messages go to stderr (default: text)'
+    )
+    parser.add_argument(
+        '--profile',
+        default=None,
+        help='Profile the run with cProfile and write the stats to the '
+        'file, read it with python -m pstats',
+        metavar='<file>'
+    )
+    parser.add_argument(
+        '--trace-malloc',
+        nargs='?',
+        type=int,
+        const=10,
+        default=0,
+        help='Trace the memory allocations, report the peak and the top '
+        'allocation sites at the end (default: 10 sites)',
+        metavar='<number>'
+    )
+    parser.add_argument(
+        '--no-progress',
+        action='store_true',
+        help='Do not show the progress bar of the uploads in the terminal'
+    )
+    parser.add_argument(
+        '--metrics-textfile',
+        default=None,
+        help='Write the metrics to a Prometheus textfile periodically',
+        metavar='<file>'
+    )
+    parser.add_argument(
+        '--metrics-port',
+        type=int,
+        default=None,
+        help='Serve the metrics on http://127.0.0.1:<port>/metrics',
+        metavar='<port>'
+    )
+    parser.add_argument(
+        '--statsd',
+        default=None,
+        help='Send the metrics to StatsD over UDP',
+        metavar='<host:port>'
+    )
+    parser.add_argument(
+        '--metrics-interval',
+        type=float,
+        default=10,
+        help='Seconds between two exports of the metrics (default: 10)',
+        metavar='<seconds>'
+    )
+    parser.add_argument(
+        '--journal',
+        default=None,
+        help='Append the result of each upload to a JSON lines file',
+        metavar='<file>'
+    )
+    album_group.add_argument(
+        '--new-album',
+        default=None,
+        help='Create a album with the uploaded images in the given order, '
+        'not with -d',
+        metavar='<title>'
+    )
+    parser.add_argument(
+        '--cover',
+        default=None,
+        help='The image used as the cover of the new album',
+        metavar='<image path>'
+    )
+    parser.add_argument(
+        '--watch',
+        default=None,
+        help='Upload the images dropped into the directory',
+        metavar='<directory>'
+    )
+    parser.add_argument(
+        '--debounce',
+        type=float,
+        default=1.0,
+        help='Seconds a watched file must stay unchanged '
+        'before uploading (default: 1)',
+        metavar='<seconds>'
+    )
+    parser.add_argument(
+        '--sync',
+        default=None,
+        help='Upload the new and changed images of the directory '
+        'to the album given by --album',
+        metavar='<directory>'
+    )
+    parser.add_argument(
+        '--delete-remote',
+        action='store_true',
+        help='With --sync, delete the remote images of the removed '
+        'or replaced files'
+    )
+    parser.add_argument(
+        '--backup',
+        default=None,
+        help='Download all the albums and images of your account',
+        metavar='<directory>'
+    )
+    parser.add_argument(
+        '--delete',
+        nargs='?',
+        const='-',
+        default=None,
+        help='Delete the images (ids, deletehashes or JSON lines) '
+        'listed in the file, stdin by default',
+        metavar='<file>'
+    )
+    parser.add_argument(
+        '--update-meta',
+        nargs='?',
+        const='-',
+        default=None,
+        help='Update title and description of the images listed in the '
+        'JSON lines file, stdin by default',
+        metavar='<file>'
+    )
+    parser.add_argument(
+        '--queue',
+        action='store_true',
+        help='Record the uploads into the spool and return, '
+        'upload them later with --flush'
+    )
+    parser.add_argument(
+        '--copy',
+        action='store_true',
+        help='With --queue, copy the images into the spool'
+    )
+    parser.add_argument(
+        '--flush',
+        action='store_true',
+        help='Upload the jobs of the spool if the network is reachable, '
+        'the jobs which can\'t succeed are put aside as <name>.failed'
+    )
+    parser.add_argument(
+        '--spool',
+        default=DEFAULT_SPOOL_DIR,
+        help='Spool directory (default: {path})'.format(
+            path=DEFAULT_SPOOL_DIR
+        ),
+        metavar='<directory>'
+    )
+    parser.add_argument(
+        '--worker',
+        default=None,
+        help='Upload the jobs of a spool shared with other workers '
+        '(ex: over NFS), the result of each uploaded job is written next '
+        'to it, the jobs failed by the network or the server are tried '
+        'again',
+        metavar='<directory>'
+    )
+    parser.add_argument(
+        '--stale-timeout',
+        type=float,
+        default=DEFAULT_STALE_TIMEOUT,
+        help='Seconds before the jobs claimed by a dead worker are put '
+        'back (default: {t})'.format(t=DEFAULT_STALE_TIMEOUT),
+        metavar='<seconds>'
+    )
+    parser.add_argument(
+        '--fingerprint',
+        action='store_true',
+        help='Tag the public description of the authenticated uploads, so a '
+        'upload whose response is lost is found instead of being sent twice '
+        '(without it, it\'s sent again)'
+    )
     args = parser.parse_args()
 
     if args.s:
@@ -999,16 +2631,50 @@ def main():
                      os.path.expanduser('~/.local/share/applications/'))
         return
 
-    imgur = ImgurFactory.get_instance(args.g)
-    imgur.connect()
-    meta = {
-        'album_id': args.d,
-        'ask': args.q,
-        'anonymous': args.n,
-        'image_name_as_title': args.t,
-    }
-    for f in args.f:
-        imgur.upload(f, meta)
+    if args.output == 'ndjson':
+        # Keep stdout for the records
+        console.stream = sys.stderr
+    profiler, memory = start_profiling(args)
+    try:
+        run_main(args)
+    finally:
+        stop_profiling(profiler, memory, args)
+
+
+def run_main(args):
+    """Create the instance and run the command given by the command line
+
+    :param args: Parsed command line arguments
+    :type args: argparse.Namespace
+    """
+    imgur = ImgurFactory.get_instance(args.g and args.output != 'ndjson')
+    imgur.fingerprint_uploads = args.fingerprint
+    if args.output == 'ndjson':
+        if args.q:
+            imgur.show_error_and_exit(
+                'Can\'t ask the album of each file (-q) with --output ndjson'
+            )
+        imgur.journal = Journal('-')
+        imgur.quiet = True
+        imgur.interactive = False
+    elif args.journal:
+        imgur.journal = Journal(args.journal)
+    report = None
+    if args.v:
+        report = TimingReport()
+        imgur.add_tracer(report)
+    if (not args.g and args.output == 'text' and not args.no_progress and
+            sys.stderr.isatty()):
+        imgur.add_tracer(ProgressBar())
+    exporter = start_metrics(imgur, args)
+    try:
+        run_command(imgur, args)
+    finally:
+        if report is not None:
+            for line in report.format_summary():
+                logger.info(line)
+        if exporter is not None:
+            exporter.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""Back up the albums and images of a account
+
+The originals are downloaded into `<outdir>/images/`, and `index.json`
+keeps the metadata of the albums and images. A file already downloaded
+with the right size is skipped, so a interrupted backup can be resumed by
+running it again.
+"""
+
+import os
+import sys
+import json
+import logging
+import threading
+
+if sys.version_info >= (3,):
+    import http.client as httplib
+    from urllib.parse import urlsplit
+else:
+    import httplib
+    from urlparse import urlsplit
+
+from .engine import run_concurrently
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = 'index.json'
+IMAGES_DIR = 'images'
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_pages(request_page):
+    """Iterate over the items of all the pages
+
+    :param request_page: Return the items of a page (start from 0),
+     an empty list after the last page
+    :type request_page: function
+    :rtype: generator
+    """
+    page = 0
+    while True:
+        items = request_page(page)
+        if not items:
+            return
+        for item in items:
+            yield item
+        page += 1
+
+
+def get_file_name(image):
+    """Get the file name of a image from its link
+
+    :param image: Image data from the API
+    :type image: dict
+    :return: File name, ex: `xxxxxxx.jpg`
+    :rtype: str
+    """
+    ext = os.path.splitext(urlsplit(image['link']).path)[1]
+    return image['id'] + ext
+
+
+class Downloader(object):
+    """Download files with one kept-alive connection per host and thread
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _get_connection(self, scheme, host):
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        key = (scheme, host)
+        if key not in connections:
+            if scheme == 'https':
+                connections[key] = httplib.HTTPSConnection(host)
+            else:
+                connections[key] = httplib.HTTPConnection(host)
+        return connections[key]
+
+    def _drop_connection(self, scheme, host):
+        connection = self._local.connections.pop((scheme, host), None)
+        if connection is not None:
+            connection.close()
+
+    def download(self, url, path):
+        """Stream a file to disk, it's written to `<path>.part` and renamed
+        when complete
+
+        :param url: File URL
+        :type url: str
+        :param path: Destination path
+        :type path: str
+        :return: Number of bytes
+        :rtype: int
+        """
+        parts = urlsplit(url)
+        connection = self._get_connection(parts.scheme, parts.netloc)
+        request_path = parts.path + ('?' + parts.query if parts.query else '')
+        try:
+            connection.request('GET', request_path)
+            response = connection.getresponse()
+            if response.status != 200:
+                response.read()
+                raise IOError('HTTP {status} for {url}'.format(
+                    status=response.status, url=url
+                ))
+            tmp_path = path + '.part'
+            size = 0
+            with open(tmp_path, 'wb') as f:
+                for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                    f.write(chunk)
+                    size += len(chunk)
+        except (httplib.HTTPException, IOError, OSError):
+            self._drop_connection(parts.scheme, parts.netloc)
+            raise
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp_path, path)
+        return size
+
+
+def is_downloaded(image, path):
+    """Check if the image is already downloaded
+
+    :rtype: bool
+    """
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return False
+    return image.get('size') is None or size == image['size']
+
+
+def backup_account(imgur, outdir, workers=4, on_result=None):
+    """Download all the images of the account and write the index
+
+    :param imgur: Connected Imgur instance
+    :type imgur: Imgur
+    :param outdir: Output directory
+    :type outdir: str
+    :param workers: Number of concurrent downloads
+    :type workers: int
+    :param on_result: Called with (image, error) after each download,
+     error is None if success
+    :type on_result: function
+    :return: Number of (downloaded, skipped, failed) images
+    :rtype: tuple
+    """
+    imgur.ensure_tokens()
+    images_dir = os.path.join(outdir, IMAGES_DIR)
+    if not os.path.isdir(images_dir):
+        os.makedirs(images_dir)
+
+    images = {}
+    for image in iter_pages(imgur.request_account_images):
+        images[image['id']] = image
+    albums = []
+    for album in iter_pages(
+            lambda page: imgur.request_album_list(page=page)):
+        album_images = imgur.request_album_images(album['id'])
+        for image in album_images:
+            images.setdefault(image['id'], image)
+        albums.append(dict(album, images=[i['id'] for i in album_images]))
+
+    for image in images.values():
+        image['file'] = '/'.join((IMAGES_DIR, get_file_name(image)))
+    index = {'albums': albums, 'images': images}
+    index_path = os.path.join(outdir, INDEX_NAME)
+    with open(index_path + '.tmp', 'w') as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+    if os.name == 'nt' and os.path.exists(index_path):
+        os.remove(index_path)
+    os.rename(index_path + '.tmp', index_path)
+
+    todo = []
+    skipped = 0
+    for image_id in sorted(images):
+        image = images[image_id]
+        if is_downloaded(image, os.path.join(outdir, image['file'])):
+            skipped += 1
+        else:
+            todo.append(image)
+
+    downloader = Downloader()
+    lock = threading.Lock()
+    counts = {'failed': 0}
+
+    def download(image):
+        error = None
+        try:
+            downloader.download(
+                image['link'], os.path.join(outdir, image['file'])
+            )
+        except Exception as e:
+            error = e
+        with lock:
+            if error is not None:
+                counts['failed'] += 1
+            if on_result is not None:
+                on_result(image, error)
+
+    run_concurrently(download, todo, workers)
+    return len(todo) - counts['failed'], skipped, counts['failed']
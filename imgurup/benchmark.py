@@ -0,0 +1,402 @@
+# -*- coding: utf-8 -*-
+"""Microbenchmarks of the hot paths of a upload
+
+- `encode[<size>]`: build the multipart body of a image and read it like
+  the connection does, from 1 KB to 200 MB
+- `parse[<response>]`: read and parse the JSON of a response
+- `load_tokens`: read the tokens from the config file
+- `sniff`, `content_type`: detect the type of a image
+- `import`: start a interpreter and import imgurup
+
+Run `python -m imgurup.benchmark -o results.json`, and compare with a
+previous run with `--baseline baseline.json`: the exit status is 1 if a
+benchmark is slower than its baseline by more than `--threshold`.
+"""
+
+from __future__ import print_function
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+
+from .preflight import SNIFF_LENGTH
+from .preflight import get_content_type
+from .preflight import sniff_content_type
+
+logger = logging.getLogger(__name__)
+
+KB = 1024
+MB = 1024 * KB
+SIZES = (KB, MB, 10 * MB, 200 * MB)
+QUICK_SIZES = (KB, MB)
+# A benchmark is repeated until a run of it lasts this many seconds
+MIN_TIME = 0.05
+REPEAT = 5
+# Allowed slowdown from the baseline, 0.2 means 20 %
+DEFAULT_THRESHOLD = 0.2
+# Bytes read at once by httplib when it sends a body
+SEND_BLOCK_SIZE = 8192
+
+JPEG_HEADER = b'\xff\xd8\xff\xe0\x00\x10JFIF\x00'
+
+RESPONSES = {
+    'upload': {
+        'data': {
+            'id': 'xxxxxxx', 'deletehash': 'x' * 15, 'title': None,
+            'description': '[imgurup:0000000000000000]',
+            'datetime': 1400000000, 'type': 'image/jpeg',
+            'animated': False, 'width': 1920, 'height': 1080,
+            'size': 1048576, 'views': 0, 'bandwidth': 0,
+            'link': 'https://i.imgur.com/xxxxxxx.jpg',
+        },
+        'success': True,
+        'status': 200,
+    },
+    'albums': {
+        'data': [
+            {
+                'id': 'x{i:04d}'.format(i=i), 'title': 'Album {i}'.format(i=i),
+                'description': None, 'datetime': 1400000000 + i,
+                'cover': 'xxxxxxx', 'privacy': 'hidden', 'layout': 'blog',
+                'views': i, 'link': 'https://imgur.com/a/x{i:04d}'.format(
+                    i=i
+                ),
+                'deletehash': 'x' * 15, 'images_count': i,
+            } for i in range(50)
+        ],
+        'success': True,
+        'status': 200,
+    },
+}
+
+
+def format_size(size):
+    """Format a size of the benchmark names, ex: `1KB`, `200MB`"""
+    if size >= MB:
+        return '{n}MB'.format(n=size // MB)
+    return '{n}KB'.format(n=size // KB)
+
+
+def measure(func, repeat=REPEAT, min_time=MIN_TIME):
+    """Time a function
+
+    :param func: Function without argument
+    :type func: function
+    :param repeat: Number of timed runs
+    :type repeat: int
+    :param min_time: Calls of a run are added until it lasts this long
+    :type min_time: float
+    :return: Seconds of a call, for each run
+    :rtype: list of float
+    """
+    number = 1
+    while True:
+        started = time.time()
+        for i in range(number):
+            func()
+        seconds = time.time() - started
+        if seconds >= min_time:
+            break
+        number *= 2
+    times = [seconds / number]
+    for run in range(repeat - 1):
+        started = time.time()
+        for i in range(number):
+            func()
+        times.append((time.time() - started) / number)
+    return times
+
+
+class _Response(object):
+
+    status = 200
+
+    def __init__(self, content):
+        self._content = content
+
+    def getheader(self, name, default=None):
+        return default
+
+    def read(self):
+        return self._content
+
+
+class _Connection(object):
+    """A connection answering the same content, without network"""
+
+    sock = None
+
+    def __init__(self, content):
+        self._content = content
+
+    def getresponse(self):
+        return _Response(self._content)
+
+
+def write_image(path, size):
+    """Write a JPEG-looking file of `size` bytes"""
+    with open(path, 'wb') as f:
+        f.write(JPEG_HEADER)
+        block = b'\x00' * MB
+        left = size - len(JPEG_HEADER)
+        while left > 0:
+            f.write(block[:left])
+            left -= len(block)
+
+
+def get_benchmarks(directory, sizes=SIZES, pattern=None):
+    """Get the benchmarks
+
+    :param directory: Directory of the files of the benchmarks
+    :type directory: str
+    :param sizes: Image sizes of the encode benchmarks
+    :type sizes: list of int
+    :param pattern: Regex of the names of the benchmarks, None for all
+    :type pattern: str
+    :return: (name, function, bytes processed by a call or None)
+    :rtype: list of tuple
+    """
+    from . import CLIImgur
+    imgur = CLIImgur()
+    benchmarks = []
+
+    for size in sizes:
+        name = 'encode[{s}]'.format(s=format_size(size))
+        if pattern is not None and not re.search(pattern, name):
+            # Do not write a large file for nothing
+            continue
+        path = os.path.join(directory, format_size(size) + '.jpg')
+        write_image(path, size)
+
+        def encode(path=path):
+            body, headers = imgur._encode_multipart_data(
+                {'title': 'Title', 'description': 'Description'},
+                {'image': path}
+            )
+            while body.read(SEND_BLOCK_SIZE):
+                pass
+        benchmarks.append((name, encode, size))
+
+    for name in sorted(RESPONSES):
+        content = json.dumps(RESPONSES[name]).encode('utf-8')
+
+        def parse(content=content):
+            imgur._local.connect = _Connection(content)
+            imgur._get_json_response()
+        benchmarks.append(
+            ('parse[{name}]'.format(name=name), parse, len(content))
+        )
+
+    config_path = os.path.join(directory, 'imgurup.conf')
+    with open(config_path, 'w') as f:
+        f.write(
+            '[Token]\naccess_token = {a}\nrefresh_token = {r}\n'.format(
+                a='a' * 40, r='r' * 40
+            )
+        )
+    token_imgur = CLIImgur()
+    token_imgur.CONFIG_PATH = config_path
+    benchmarks.append(
+        ('load_tokens', token_imgur.set_tokens_using_config, None)
+    )
+
+    image_path = os.path.join(directory, 'image.jpg')
+    write_image(image_path, KB)
+    benchmarks.append((
+        'sniff',
+        lambda: sniff_content_type(JPEG_HEADER[:SNIFF_LENGTH]),
+        None
+    ))
+    benchmarks.append((
+        'content_type', lambda: get_content_type(image_path), None
+    ))
+
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [package_dir] + [p for p in [env.get('PYTHONPATH')] if p]
+    )
+
+    def import_imgurup():
+        subprocess.check_call(
+            [sys.executable, '-c', 'import imgurup'], env=env
+        )
+    benchmarks.append(('import', import_imgurup, None))
+    return [
+        benchmark for benchmark in benchmarks
+        if pattern is None or re.search(pattern, benchmark[0])
+    ]
+
+
+def run_benchmarks(sizes=SIZES, repeat=REPEAT, pattern=None):
+    """Run the benchmarks
+
+    :param sizes: Image sizes of the encode benchmarks
+    :type sizes: list of int
+    :param repeat: Number of timed runs of each benchmark
+    :type repeat: int
+    :param pattern: Regex of the names of the benchmarks to run,
+     None for all
+    :type pattern: str
+    :return: `results`: name -> `min` and `median` seconds of a call,
+     `repeat`, and `bytes` and `mb_per_s` if it processes bytes. And the
+     `python` version, the `platform` and the `time` of the run
+    :rtype: dict
+    """
+    directory = tempfile.mkdtemp(prefix='imgurup-benchmark-')
+    results = {}
+    try:
+        for name, func, size in get_benchmarks(directory, sizes, pattern):
+            times = sorted(measure(func, repeat))
+            result = {
+                'min': times[0],
+                'median': times[len(times) // 2],
+                'repeat': repeat,
+            }
+            if size:
+                result['bytes'] = size
+                result['mb_per_s'] = size / MB / times[0]
+            results[name] = result
+            logger.info('%s: %s', name, format_result(result))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': int(time.time()),
+        'results': results,
+    }
+
+
+def format_seconds(seconds):
+    """Format a duration with a readable unit, ex: `12.3us`"""
+    for unit, factor in (('s', 1), ('ms', 1e3), ('us', 1e6)):
+        if seconds * factor >= 1:
+            break
+    else:
+        unit, factor = 'ns', 1e9
+    return '{n:.1f}{unit}'.format(n=seconds * factor, unit=unit)
+
+
+def format_result(result):
+    line = 'min {min} median {median}'.format(
+        min=format_seconds(result['min']),
+        median=format_seconds(result['median'])
+    )
+    if 'mb_per_s' in result:
+        line += ' ({rate:.1f} MB/s)'.format(rate=result['mb_per_s'])
+    return line
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """Compare results with a baseline, on the fastest run
+
+    :param results: Results of `run_benchmarks()`
+    :type results: dict
+    :param baseline: Results of a previous run
+    :type baseline: dict
+    :param threshold: Allowed slowdown, 0.2 means 20 %
+    :type threshold: float
+    :return: (name, baseline seconds, seconds, ratio, regressed) of the
+     benchmarks in both
+    :rtype: list of tuple
+    """
+    comparison = []
+    for name in sorted(results['results']):
+        base = baseline.get('results', {}).get(name)
+        if base is None:
+            continue
+        current = results['results'][name]['min']
+        ratio = current / base['min'] if base['min'] else 1.0
+        comparison.append(
+            (name, base['min'], current, ratio, ratio > 1 + threshold)
+        )
+    return comparison
+
+
+def main(argv=None):
+    """Run the benchmarks from the command line
+
+    :return: Exit status, 1 if there is a regression
+    :rtype: int
+    """
+    parser = argparse.ArgumentParser(
+        prog='python -m imgurup.benchmark',
+        description='Microbenchmarks of imgurup'
+    )
+    parser.add_argument(
+        '-o', '--output',
+        default=None,
+        help='Write the results to a JSON file',
+        metavar='<file>'
+    )
+    parser.add_argument(
+        '--baseline',
+        default=None,
+        help='Compare with the results of a previous run',
+        metavar='<file>'
+    )
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help='Allowed slowdown from the baseline (default: 0.2, 20%%)',
+        metavar='<ratio>'
+    )
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=REPEAT,
+        help='Timed runs of each benchmark (default: 5)',
+        metavar='<number>'
+    )
+    parser.add_argument(
+        '-k',
+        dest='pattern',
+        default=None,
+        help='Only run the benchmarks matching the regex',
+        metavar='<regex>'
+    )
+    parser.add_argument(
+        '--quick',
+        action='store_true',
+        help='Encode only small images (1KB and 1MB)'
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format='%(message)s', level=logging.INFO)
+    results = run_benchmarks(
+        QUICK_SIZES if args.quick else SIZES, args.repeat, args.pattern
+    )
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if not args.baseline:
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    status = 0
+    for name, base, current, ratio, regressed in compare(
+            results, baseline, args.threshold):
+        print('{name}: {base} -> {current} ({change:+.1f}%){flag}'.format(
+            name=name,
+            base=format_seconds(base),
+            current=format_seconds(current),
+            change=(ratio - 1) * 100,
+            flag=' REGRESSION' if regressed else ''
+        ))
+        if regressed:
+            status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
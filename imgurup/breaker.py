@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""Circuit breaker shared by the workers of a upload engine
+
+After `threshold` uploads in a row fail with a connection error or a 5xx
+response, the circuit opens: no upload is sent during `cooldown` seconds.
+Then one upload is sent as a probe. If it succeeds the circuit closes and
+the waiting uploads go on, otherwise the circuit stays open for good and
+the remaining uploads fail right away. A long running session (`--watch`)
+does not give up: the circuit opens again after a failed probe, with a
+cooldown doubled up to `MAX_COOLDOWN`.
+"""
+
+import ssl
+import time
+import socket
+import logging
+import threading
+try:
+    import http.client as httplib
+except ImportError:
+    import httplib
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+PROBING = 'probing'
+BROKEN = 'broken'
+# Longest cooldown between the probes of a breaker which does not give up
+MAX_COOLDOWN = 600
+
+try:
+    ConnectionError = ConnectionError
+except NameError:
+    # Python 2
+    ConnectionError = socket.error
+
+# Errors of the connection, the request can be sent again
+TRANSPORT_ERRORS = (httplib.HTTPException, socket.error)
+# Errors showing the network or Imgur is down. On Python 3 `socket.error`
+# is `OSError`, also raised by the files, so it's not one of them
+CONNECTION_ERRORS = (
+    httplib.HTTPException, ConnectionError, socket.timeout, socket.gaierror,
+    socket.herror, ssl.SSLError
+)
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+def is_outage(status, error):
+    """Check if a failed upload shows Imgur or the network is down: a 5xx
+    response, or a connection error. The local errors (ex: a unreadable
+    file) and the other responses don't count.
+
+    :param status: HTTP status of the last response, None if no response
+    :type status: int
+    :param error: Error of the upload, None if success
+    :type error: Exception
+    :rtype: bool
+    """
+    if error is None:
+        return False
+    if isinstance(status, int):
+        return status >= 500
+    return isinstance(error, CONNECTION_ERRORS)
+
+
+class CircuitBreaker(object):
+    """Stop sending uploads during an outage
+    """
+
+    def __init__(self, threshold=5, cooldown=30, give_up=True):
+        """
+        :param threshold: Failures in a row opening the circuit,
+         0 to never open it
+        :type threshold: int
+        :param cooldown: Seconds before sending a probe
+        :type cooldown: float
+        :param give_up: Fail the remaining uploads after a failed probe,
+         otherwise open the circuit again with a longer cooldown
+        :type give_up: bool
+        """
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.give_up = give_up
+        # Cooldown of the current opening
+        self._cooldown = cooldown
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._condition = threading.Condition()
+
+    def before(self):
+        """Wait until a upload can be sent
+
+        :return: True if the upload is the probe
+        :rtype: bool
+        :raise CircuitOpenError: If the probe failed
+        """
+        with self._condition:
+            while True:
+                if self.state == CLOSED:
+                    return False
+                if self.state == BROKEN:
+                    raise CircuitOpenError(
+                        'Not sent, Imgur is unreachable: circuit open after '
+                        '{n} failures'.format(n=self._failures)
+                    )
+                if self.state == OPEN:
+                    wait = self._opened_at + self._cooldown - time.time()
+                    if wait <= 0:
+                        logger.info('Circuit half open, send a probe')
+                        self.state = PROBING
+                        return True
+                    self._condition.wait(wait)
+                else:
+                    self._condition.wait()
+
+    def record(self, outage, probe=False):
+        """Count the outcome of a upload
+
+        :param outage: The upload failed because of an outage,
+         see `is_outage()`
+        :type outage: bool
+        :param probe: The upload is the probe, the return value of `before()`
+        :type probe: bool
+        """
+        with self._condition:
+            if probe:
+                if outage and self.give_up:
+                    logger.error('Probe failed, give up the remaining uploads')
+                    self.state = BROKEN
+                elif outage:
+                    self._cooldown = min(self._cooldown * 2, MAX_COOLDOWN)
+                    logger.error(
+                        'Probe failed, next probe in %ds', self._cooldown
+                    )
+                    self.state = OPEN
+                    self._opened_at = time.time()
+                else:
+                    logger.info('Probe succeeded, circuit closed')
+                    self.state = CLOSED
+                    self._failures = 0
+                    self._cooldown = self.cooldown
+                self._condition.notify_all()
+            elif not outage:
+                self._failures = 0
+            else:
+                self._failures += 1
+                if (self.state == CLOSED and self.threshold and
+                        self._failures >= self.threshold):
+                    logger.error(
+                        'Circuit open after %d failures, probe in %ds',
+                        self._failures, self.cooldown
+                    )
+                    self.state = OPEN
+                    self._opened_at = time.time()
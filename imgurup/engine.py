@@ -0,0 +1,559 @@
+# -*- coding: utf-8 -*-
+"""Upload a stream of jobs concurrently with one shared Imgur instance
+"""
+
+import os
+import sys
+import math
+import time
+import hashlib
+import logging
+import threading
+
+if sys.version_info >= (3,):
+    import queue
+else:
+    import Queue as queue
+
+from .breaker import CircuitBreaker
+from .breaker import CircuitOpenError
+from .breaker import CONNECTION_ERRORS
+from .breaker import is_outage
+
+logger = logging.getLogger(__name__)
+
+# Latency samples kept to compute the p95
+LATENCY_WINDOW = 20
+# Decrease when the p95 grows above this factor of the best p95
+LATENCY_FACTOR = 2.0
+# The latency of a upload is divided by its size in MB, at least 1 MB
+LATENCY_UNIT = 1024 * 1024
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def get_post_data(job):
+    """Get the post fields of a job
+
+    :param job: Upload job
+    :type job: dict
+    :return: Post fields
+    :rtype: dict
+    """
+    post_data = {}
+    for field in ('title', 'description'):
+        if job.get(field):
+            post_data[field] = job[field]
+    if job.get('album_ids'):
+        # The image is uploaded into the first album,
+        # and added to the others afterwards
+        post_data['album_id'] = job['album_ids'][0]
+    return post_data
+
+
+def get_size(path):
+    """Get the size of a file, 0 for a URL or a missing file
+
+    :rtype: int
+    """
+    if path.startswith(('http://', 'https://')):
+        return 0
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def get_file_hash(path):
+    """Get the SHA-1 of a file, read by chunks
+
+    :param path: File path
+    :type path: str
+    :return: Hex digest
+    :rtype: str
+    """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def get_percentile(samples, percent):
+    """Get a percentile by the nearest rank
+
+    :param samples: Values
+    :type samples: list
+    :param percent: 0-100
+    :type percent: float
+    :rtype: float
+    """
+    ordered = sorted(samples)
+    rank = int(math.ceil(percent / 100.0 * len(ordered))) - 1
+    return ordered[min(max(rank, 0), len(ordered) - 1)]
+
+
+class AdaptiveLimit(object):
+    """Limit of concurrent uploads adjusted by AIMD.
+
+    The limit grows by one after `limit` healthy uploads, and is
+    halved when a upload is overloaded (429, 5xx or connection error) or when
+    the p95 of the recent latencies (per MB) grows above `LATENCY_FACTOR`
+    times the best p95 seen. The uploads started before a decrease don't
+    decrease the limit again, they were sent at the old limit.
+    """
+
+    def __init__(self, minimum=1, maximum=4, initial=None):
+        """
+        :param minimum: Lowest limit
+        :type minimum: int
+        :param maximum: Highest limit
+        :type maximum: int
+        :param initial: Start limit, `minimum` by default
+        :type initial: int
+        """
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        if initial is None:
+            initial = self.minimum
+        self.limit = min(max(initial, self.minimum), self.maximum)
+        self._active = 0
+        self._healthy = 0
+        self._latencies = []
+        self._best_p95 = None
+        self._decreased_at = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Wait for a free slot
+
+        :return: Start time of the upload
+        :rtype: float
+        """
+        with self._condition:
+            while self._active >= self.limit:
+                self._condition.wait()
+            self._active += 1
+        return time.time()
+
+    def release(self):
+        """Free a slot"""
+        with self._condition:
+            self._active -= 1
+            self._condition.notify()
+
+    def _set_limit(self, limit, reason):
+        limit = min(max(limit, self.minimum), self.maximum)
+        if limit == self.limit:
+            return
+        logger.info('Concurrency %d -> %d (%s)', self.limit, limit, reason)
+        self.limit = limit
+        self._healthy = 0
+        self._condition.notify_all()
+
+    def _decrease(self, reason):
+        self._set_limit(self.limit // 2, reason)
+        self._decreased_at = time.time()
+        # The latencies at the old limit are not comparable any more
+        self._latencies = []
+
+    def record(self, started, size=0, overloaded=False):
+        """Adjust the limit with the outcome of a upload
+
+        :param started: Return value of `acquire()`
+        :type started: float
+        :param size: Bytes sent
+        :type size: int
+        :param overloaded: The server refused or dropped the upload
+        :type overloaded: bool
+        """
+        megabytes = max(1.0, size / float(LATENCY_UNIT))
+        latency = (time.time() - started) / megabytes
+        with self._condition:
+            if started < self._decreased_at:
+                return
+            if overloaded:
+                self._decrease('server overloaded')
+                return
+            self._latencies.append(latency)
+            if len(self._latencies) > LATENCY_WINDOW:
+                del self._latencies[0]
+            if len(self._latencies) == LATENCY_WINDOW:
+                p95 = get_percentile(self._latencies, 95)
+                if self._best_p95 is None or p95 < self._best_p95:
+                    self._best_p95 = p95
+                elif p95 > self._best_p95 * LATENCY_FACTOR:
+                    self._decrease(
+                        'p95 latency {p95:.2f}s/MB, best {best:.2f}s/MB'
+                        .format(p95=p95, best=self._best_p95)
+                    )
+                    return
+            if self._best_p95 is not None and \
+                    latency > self._best_p95 * LATENCY_FACTOR:
+                # Slow, but not often enough to move the p95 yet
+                return
+            self._healthy += 1
+            if self._healthy >= self.limit:
+                self._set_limit(self.limit + 1, 'healthy')
+
+
+def is_overloaded(status, error):
+    """Check if a upload shows the server or the network is overloaded
+
+    :param status: HTTP status of the last response, None if no response
+    :type status: int
+    :param error: Error of the upload, None if success
+    :type error: Exception
+    :rtype: bool
+    """
+    if not isinstance(status, int):
+        # No response at all: the connection failed, or a local error
+        return isinstance(error, CONNECTION_ERRORS)
+    return status == 429 or status >= 500
+
+
+def run_stream(func, items, on_result, workers=4, lane=None,
+               lane_workers=1):
+    """Call a function with each item using a pool of threads, and report
+    each call as soon as it finishes.
+
+    The items are consumed lazily by a feeder thread with a bounded queue,
+    so `items` can be a generator over a very large stream. The items
+    selected by `lane` are called by their own threads, so slow items never
+    hold all the threads of the pool.
+
+    :param func: Function with one argument
+    :type func: function
+    :param items: Arguments of the calls
+    :type items: iterable
+    :param on_result: Called with (item, return value, exception) of each
+     call in the calling thread, in the order of completion. exception is
+     None if success
+    :type on_result: function
+    :param workers: Number of threads
+    :type workers: int
+    :param lane: Return True for the items called by the lane threads,
+     None for no lane
+    :type lane: function
+    :param lane_workers: Number of lane threads
+    :type lane_workers: int
+    :return: Number of items
+    :rtype: int
+    :raise: The exception raised by iterating `items`
+    """
+    workers = max(1, workers)
+    lane_workers = max(1, lane_workers) if lane is not None else 0
+    item_queue = queue.Queue(workers * 2)
+    # Unbounded, the small items behind a lane item must not wait for it
+    lane_queue = queue.Queue()
+    result_queue = queue.Queue()
+    feed_state = {'total': 0, 'exc_info': None}
+    done = object()
+
+    def feed():
+        try:
+            for item in items:
+                if lane is not None and lane(item):
+                    lane_queue.put(item)
+                else:
+                    item_queue.put(item)
+                feed_state['total'] += 1
+        except Exception:
+            feed_state['exc_info'] = sys.exc_info()
+        finally:
+            for _ in range(workers):
+                item_queue.put(done)
+            for _ in range(lane_workers):
+                lane_queue.put(done)
+            result_queue.put(done)
+
+    def work(item_queue):
+        while True:
+            item = item_queue.get()
+            if item is done:
+                return
+            try:
+                result_queue.put((item, func(item), None))
+            except Exception as e:
+                logger.debug('Call with %s fail', item, exc_info=True)
+                result_queue.put((item, None, e))
+
+    threads = [threading.Thread(target=feed)]
+    for _ in range(workers):
+        threads.append(threading.Thread(target=work, args=(item_queue,)))
+    for _ in range(lane_workers):
+        threads.append(threading.Thread(target=work, args=(lane_queue,)))
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    received = 0
+    feeding = True
+    while feeding or received < feed_state['total']:
+        result = result_queue.get()
+        if result is done:
+            feeding = False
+            continue
+        received += 1
+        on_result(*result)
+
+    if feed_state['exc_info'] is not None:
+        raise feed_state['exc_info'][1]
+    return received
+
+
+def run_concurrently(func, items, workers=4):
+    """Call a function with each item using a pool of threads
+
+    :param func: Function with one argument
+    :type func: function
+    :param items: Arguments of the calls
+    :type items: list
+    :param workers: Number of threads
+    :type workers: int
+    :return: (return value, exception) of each call, in the order of items
+    :rtype: list of tuple
+    """
+    results = [None] * len(items)
+    index_queue = queue.Queue()
+    for index in range(len(items)):
+        index_queue.put(index)
+
+    def work():
+        while True:
+            try:
+                index = index_queue.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                results[index] = (func(items[index]), None)
+            except Exception as e:
+                logger.debug('Call with %s fail', items[index], exc_info=True)
+                results[index] = (None, e)
+
+    threads = []
+    for _ in range(min(max(1, workers), len(items))):
+        thread = threading.Thread(target=work)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class UploadEngine(object):
+    """Upload jobs with a pool of worker threads.
+
+    All the workers share the same Imgur instance, so the tokens are loaded
+    once and every worker keeps its own connection alive between uploads.
+
+    A job is a dict with the keys `path` (path or URL of the image) and
+    optionally `title`, `description`, `album_ids`, `anonymous`,
+    `content_type` (sniffed by `manifest.check_jobs()`) and `error`. A job
+    which already has an `error` is reported without being uploaded. A
+    image with several albums is uploaded once, then added to the other
+    albums concurrently.
+
+    With `min_workers`, the number of concurrent uploads is adjusted between
+    `min_workers` and `workers` by a `AdaptiveLimit`. The jobs marked
+    `large` (see `schedule.schedule_jobs()`) are uploaded in their own lane
+    of `large_workers` uploads, outside of this limit.
+
+    All the workers share a `CircuitBreaker`, so a outage stops the batch
+    quickly instead of retrying every job.
+    """
+
+    def __init__(self, imgur, workers=4, min_workers=None, large_workers=1,
+                 breaker=None, hash_files=False):
+        """
+        :param imgur: Connected Imgur instance shared by the workers
+        :type imgur: Imgur
+        :param workers: Number of concurrent uploads, the highest one if
+         `min_workers` is given
+        :type workers: int
+        :param min_workers: Lowest number of concurrent uploads, None to
+         keep `workers` uploads all the time
+        :type min_workers: int
+        :param large_workers: Number of concurrent uploads of large jobs
+        :type large_workers: int
+        :param breaker: Circuit breaker, None to never stop
+        :type breaker: CircuitBreaker
+        :param hash_files: Put the SHA-1 of the files into the records
+        :type hash_files: bool
+        """
+        self._imgur = imgur
+        self._workers = max(1, workers)
+        if min_workers is None:
+            min_workers = self._workers
+        self.limit = AdaptiveLimit(min_workers, self._workers)
+        self._large_workers = max(1, large_workers)
+        self.large_limit = AdaptiveLimit(
+            self._large_workers, self._large_workers
+        )
+        self.breaker = breaker or CircuitBreaker(threshold=0)
+        self._hash_files = hash_files
+        # Counted by the feeder and the calling thread of `run()`
+        self._fed = 0
+        self._reported = 0
+
+    @property
+    def pending(self):
+        """Number of jobs taken from the stream and not reported yet"""
+        return self._fed - self._reported
+
+    def upload(self, job):
+        """Upload a job in the current thread
+
+        :param job: Upload job
+        :type job: dict
+        :return: Result record with the keys `index`, `path`, `id`, `link`,
+         `deletehash`, `error` (None if success), `status` (`uploaded`,
+         `failed`, or `not_sent` if the circuit breaker gave up),
+         `http_status` (of the last response, None if no response), `size`,
+         `sha1` (if `hash_files`), `attempts` and `timings` (phase ->
+         seconds)
+        :rtype: dict
+        """
+        record = {
+            'index': job.get('index'),
+            'path': job['path'],
+            'id': None,
+            'link': None,
+            'deletehash': None,
+            'error': job.get('error'),
+            'status': 'failed',
+            'http_status': None,
+            'size': job.get('size'),
+            'sha1': None,
+            'attempts': 0,
+            'timings': {},
+        }
+        if record['error'] is not None:
+            return record
+        try:
+            probe = self.breaker.before()
+        except CircuitOpenError as e:
+            record['error'] = str(e)
+            record['status'] = 'not_sent'
+            return record
+        if record['size'] is None:
+            record['size'] = get_size(job['path'])
+        size = record['size']
+        if self._hash_files and size:
+            started = time.time()
+            try:
+                record['sha1'] = get_file_hash(job['path'])
+            except (IOError, OSError):
+                pass
+            record['timings']['hash'] = time.time() - started
+        limit = self.large_limit if job.get('large') else self.limit
+        started = limit.acquire()
+        self._imgur.last_status = None
+        error = None
+        try:
+            data = self._imgur.upload_image(
+                job['path'],
+                get_post_data(job),
+                job.get('anonymous', False),
+                content_type=job.get('content_type')
+            )
+        except Exception as e:
+            logger.debug('Upload %s fail', job['path'], exc_info=True)
+            record['error'] = str(e) or e.__class__.__name__
+            error = e
+            data = None
+        finally:
+            limit.release()
+        stats = self._imgur.last_upload_stats
+        if isinstance(stats, dict):
+            record['attempts'] = stats['attempts']
+            record['timings'].update(stats['timings'])
+        status = self._imgur.last_status
+        if isinstance(status, int):
+            record['http_status'] = status
+        limit.record(started, size, is_overloaded(status, error))
+        self.breaker.record(is_outage(status, error), probe)
+        if data is not None:
+            record['id'] = data.get('id')
+            record['link'] = data.get('link')
+            record['deletehash'] = data.get('deletehash')
+            other_albums = (job.get('album_ids') or [])[1:]
+            if other_albums:
+                record['error'] = self._add_to_albums(job, data, other_albums)
+            if record['error'] is None:
+                record['status'] = 'uploaded'
+        return record
+
+    def _add_to_albums(self, job, data, album_ids):
+        """Add a uploaded image to albums
+
+        :return: Error message, None if success
+        :rtype: str
+        """
+        anonymous = job.get('anonymous', False)
+        _id = data.get('deletehash') if anonymous else data.get('id')
+        results = run_concurrently(
+            lambda album_id: self._imgur.request_album_add_images(
+                album_id, [_id], anonymous
+            ),
+            album_ids,
+            len(album_ids)
+        )
+        failed = [
+            album_id for album_id, (_, error) in zip(album_ids, results)
+            if error is not None
+        ]
+        if failed:
+            return 'Add to album fail: {albums}'.format(
+                albums=', '.join(failed)
+            )
+        return None
+
+    def run(self, jobs, on_result=None):
+        """Upload the jobs and report each result as soon as it finishes.
+
+        The jobs are consumed lazily, so `jobs` can be a generator over a
+        very large batch. A job keeps its `index` if it has one. During the
+        run the errors of the Imgur instance raise instead of exiting, see
+        `Imgur.exit_on_error`.
+
+        :param jobs: Upload jobs
+        :type jobs: iterable of dict
+        :param on_result: Called with each result record (see `upload()`)
+         in the calling thread, in the order of completion
+        :type on_result: function
+        :return: (number of successes, number of failures)
+        :rtype: tuple
+        """
+        counts = {'succeeded': 0, 'failed': 0}
+
+        def get_jobs():
+            for index, job in enumerate(jobs):
+                self._fed += 1
+                yield dict(job, index=job.get('index', index))
+
+        def handle(job, record, error):
+            self._reported += 1
+            if error is not None:
+                record = self.upload(dict(job, error=str(error)))
+            if record['error'] is None:
+                counts['succeeded'] += 1
+            else:
+                counts['failed'] += 1
+            if on_result is not None:
+                on_result(record)
+
+        exit_on_error = self._imgur.exit_on_error
+        self._imgur.exit_on_error = False
+        try:
+            run_stream(
+                self.upload,
+                get_jobs(),
+                handle,
+                self._workers,
+                lambda job: job.get('large'),
+                self._large_workers
+            )
+        finally:
+            self._imgur.exit_on_error = exit_on_error
+        return counts['succeeded'], counts['failed']
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""Journal of the results of a run, one JSON record per line
+
+A line is written and flushed as soon as a upload finishes, so the journal
+can be read while the run goes on, and a line can be given back to
+`--delete` or `--update-meta`.
+"""
+
+import sys
+import json
+import threading
+
+
+class Journal(object):
+    """Append result records to a JSON lines file
+    """
+
+    def __init__(self, path):
+        """
+        :param path: File path, `-` for stdout
+        :type path: str
+        """
+        if path == '-':
+            self._fp = sys.stdout
+        else:
+            self._fp = open(path, 'a')
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        """Write a record and flush it
+
+        :param record: Result record
+        :type record: dict
+        """
+        line = json.dumps(record, sort_keys=True) + '\n'
+        with self._lock:
+            self._fp.write(line)
+            self._fp.flush()
+
+    def close(self):
+        if self._fp is not sys.stdout:
+            self._fp.close()
@@ -0,0 +1,412 @@
+# -*- coding: utf-8 -*-
+"""Load test: upload a synthetic batch with the real upload engine
+
+The files are generated from a size distribution, and uploaded to a
+local fake Imgur server (see `testing`) started in its own process, or to
+the endpoint given by `--endpoint`. The report gives the throughput, the
+percentiles of the time to link of the uploads (from the start of the
+upload to its link, retries included), the retries and the peak RSS::
+
+    $ imgurup-loadtest --files 200 --sizes 100KB:80,5MB:20 --latency 0.05
+"""
+
+from __future__ import print_function
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+import subprocess
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2
+    tracemalloc = None
+
+from . import CLIImgur
+from . import get_large_size
+from . import get_upload_engine
+from .engine import get_percentile
+from .schedule import POLICIES
+from .schedule import schedule_jobs
+from .trace import Tracer
+
+logger = logging.getLogger(__name__)
+
+UNITS = {'': 1, 'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3}
+# size:weight of the sizes of the files
+DEFAULT_SIZES = '50KB:50,500KB:35,5MB:14,50MB:1'
+JPEG_HEADER = b'\xff\xd8\xff\xe0\x00\x10JFIF\x00'
+# Bytes kept of a request body by the fake server, so it is a sink
+MAX_BODY = 1024 * 1024
+
+
+def parse_size(value):
+    """Parse a size, ex: `500KB`
+
+    :rtype: int
+    """
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMG]?B?)\s*$', value, re.I)
+    if match is None:
+        raise ValueError('Invalid size: {value}'.format(value=value))
+    return int(float(match.group(1)) * UNITS[match.group(2).upper()])
+
+
+def parse_sizes(value):
+    """Parse a size distribution, ex: `100KB:80,5MB:20` (size:weight)
+
+    :return: (size, weight) of each size
+    :rtype: list of tuple
+    """
+    sizes = []
+    for item in value.split(','):
+        size, _, weight = item.partition(':')
+        try:
+            weight = float(weight or 1)
+        except ValueError:
+            raise ValueError('Invalid weight: {item}'.format(item=item))
+        sizes.append((parse_size(size), weight))
+    if not sizes or sum(weight for size, weight in sizes) <= 0:
+        raise ValueError('No size to draw')
+    return sizes
+
+
+def make_workload(directory, files, sizes, seed=None):
+    """Write the files of a synthetic batch, they are sparse so a large
+    batch does not fill the disk
+
+    :param directory: Directory of the files
+    :type directory: str
+    :param files: Number of files
+    :type files: int
+    :param sizes: Size distribution, see `parse_sizes()`
+    :type sizes: list of tuple
+    :param seed: Seed of the draw of the sizes
+    :type seed: int
+    :return: Paths of the files
+    :rtype: list of str
+    """
+    generator = random.Random(seed)
+    total = sum(weight for size, weight in sizes)
+    paths = []
+    for i in range(files):
+        draw = generator.uniform(0, total)
+        for size, weight in sizes:
+            draw -= weight
+            if draw <= 0:
+                break
+        size = max(size, len(JPEG_HEADER))
+        path = os.path.join(directory, '{i:06d}.jpg'.format(i=i))
+        with open(path, 'wb') as f:
+            f.write(JPEG_HEADER)
+            if size > len(JPEG_HEADER):
+                f.seek(size - 1)
+                f.write(b'\x00')
+        paths.append(path)
+    return paths
+
+
+def get_peak_rss():
+    """Get the peak resident memory of the process
+
+    :return: Bytes, None if unknown
+    :rtype: int
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class LoadTracer(Tracer):
+    """Collect the time to link of the uploads and count the retries
+    """
+
+    def __init__(self):
+        self.times = []
+        self.retries = 0
+        self.statuses = {}
+        self._started = {}
+        self._lock = threading.Lock()
+
+    def on_phase_start(self, phase, tags):
+        # The encode phase is the start of a upload
+        if phase == 'encode' and tags:
+            with self._lock:
+                self._started.setdefault(tags['path'], time.time())
+
+    def on_event(self, event, tags):
+        if event == 'retry':
+            with self._lock:
+                self.retries += 1
+
+    def on_result(self, record):
+        with self._lock:
+            started = self._started.pop(record['path'], None)
+            if started is not None and record['error'] is None:
+                self.times.append(time.time() - started)
+            self.statuses[record['status']] = (
+                self.statuses.get(record['status'], 0) + 1
+            )
+
+
+def start_server(args):
+    """Start a fake Imgur server in its own process
+
+    :return: (process, the JSON line of the server: url and tokens)
+    :rtype: tuple
+    """
+    command = [
+        sys.executable, '-m', 'imgurup.testing',
+        '--latency', str(args.latency),
+        '--post-limit', str(args.post_limit),
+        '--max-body', str(MAX_BODY),
+    ]
+    if args.bandwidth:
+        command.extend(['--bandwidth', str(args.bandwidth)])
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [package_dir] + [p for p in [env.get('PYTHONPATH')] if p]
+    )
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, env=env)
+    line = process.stdout.readline()
+    if not line:
+        process.wait()
+        raise RuntimeError('The fake server did not start')
+    return process, json.loads(line.decode('utf-8'))
+
+
+def run_load_test(imgur, paths, args):
+    """Upload the files with the upload engine
+
+    :param imgur: Connected Imgur instance
+    :type imgur: imgurup.Imgur
+    :param paths: Files
+    :type paths: list of str
+    :param args: Parsed command line arguments
+    :type args: argparse.Namespace
+    :return: Report, see `format_report()`. `baseline_rss` is the peak
+     RSS before the uploads, and `traced_peak` the peak of the memory
+     traced during the uploads with `--trace-malloc`
+    :rtype: dict
+    """
+    tracer = LoadTracer()
+    imgur.add_tracer(tracer)
+    engine = get_upload_engine(imgur, args)
+    jobs = [{'path': path, 'anonymous': args.anonymous} for path in paths]
+    baseline_rss = get_peak_rss()
+    if args.trace_malloc:
+        tracemalloc.start()
+    started = time.time()
+    try:
+        succeeded, failed = engine.run(
+            schedule_jobs(jobs, args.order, get_large_size(args)),
+            tracer.on_result
+        )
+    finally:
+        traced_peak = None
+        if args.trace_malloc:
+            traced_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    seconds = time.time() - started
+    total_bytes = sum(os.path.getsize(path) for path in paths)
+    times = tracer.times
+    return {
+        'files': len(paths),
+        'succeeded': succeeded,
+        'failed': failed,
+        'statuses': tracer.statuses,
+        'bytes': total_bytes,
+        'seconds': seconds,
+        'files_per_s': len(paths) / seconds if seconds else None,
+        'mb_per_s': total_bytes / 1048576.0 / seconds if seconds else None,
+        'time_to_link': dict(
+            (name, get_percentile(times, percent) if times else None)
+            for name, percent in (('p50', 50), ('p95', 95), ('p99', 99))
+        ),
+        'retries': tracer.retries,
+        'concurrency': engine.limit.limit,
+        'peak_rss': get_peak_rss(),
+        'baseline_rss': baseline_rss,
+        'traced_peak': traced_peak,
+    }
+
+
+def format_report(report):
+    """Format a report
+
+    :rtype: list of str
+    """
+    def seconds(value):
+        return '-' if value is None else '{v:.3f}s'.format(v=value)
+
+    lines = [
+        'Files: {files} ({succeeded} succeeded, {failed} failed), '
+        '{mb:.1f} MB in {seconds:.2f}s'.format(
+            mb=report['bytes'] / 1048576.0, **report
+        ),
+        'Throughput: {files_per_s:.2f} files/s, {mb_per_s:.2f} MB/s'.format(
+            **report
+        ),
+        'Time to link: p50 {p50} p95 {p95} p99 {p99}'.format(
+            p50=seconds(report['time_to_link']['p50']),
+            p95=seconds(report['time_to_link']['p95']),
+            p99=seconds(report['time_to_link']['p99'])
+        ),
+        'Retries: {retries}, final concurrency: {concurrency}'.format(
+            **report
+        ),
+    ]
+    if report['peak_rss'] is not None:
+        lines.append('Peak RSS: {mb:.1f} MB ({base:.1f} MB before the '
+                     'uploads)'.format(
+                         mb=report['peak_rss'] / 1048576.0,
+                         base=report['baseline_rss'] / 1048576.0
+                     ))
+    if report['traced_peak'] is not None:
+        lines.append('Traced peak: {mb:.1f} MB'.format(
+            mb=report['traced_peak'] / 1048576.0
+        ))
+    return lines
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog='imgurup-loadtest',
+        description='Upload a synthetic batch to a local fake Imgur server'
+    )
+    parser.add_argument(
+        '--files', type=int, default=100,
+        help='Number of files (default: 100)', metavar='<number>'
+    )
+    parser.add_argument(
+        '--sizes', type=parse_sizes, default=parse_sizes(DEFAULT_SIZES),
+        help='Size distribution as size:weight separated by commas '
+        '(default: {d})'.format(d=DEFAULT_SIZES),
+        metavar='<sizes>'
+    )
+    parser.add_argument(
+        '--seed', type=int, default=0,
+        help='Seed of the sizes (default: 0)', metavar='<number>'
+    )
+    parser.add_argument(
+        '--workers', type=int, default=4,
+        help='Highest number of concurrent uploads (default: 4)',
+        metavar='<number>'
+    )
+    parser.add_argument(
+        '--min-workers', type=int, default=1,
+        help='Lowest number of concurrent uploads (default: 1)',
+        metavar='<number>'
+    )
+    parser.add_argument(
+        '--order', choices=POLICIES, default='fifo',
+        help='Order of the uploads (default: fifo)'
+    )
+    parser.add_argument(
+        '--large-size', type=float, default=10,
+        help='Files from this size (MB) are uploaded in their own lane, '
+        '0 to disable (default: 10)', metavar='<MB>'
+    )
+    parser.add_argument(
+        '--breaker-threshold', type=int, default=5, metavar='<number>',
+        help='Failures in a row stopping the uploads (default: 5)'
+    )
+    parser.add_argument(
+        '--breaker-cooldown', type=float, default=30, metavar='<seconds>',
+        help='Seconds before trying again (default: 30)'
+    )
+    parser.add_argument(
+        '--latency', type=float, default=0,
+        help='Seconds the fake server waits before each response '
+        '(default: 0)', metavar='<seconds>'
+    )
+    parser.add_argument(
+        '--bandwidth', type=float, default=None,
+        help='MB/s of each connection of the fake server (default: no '
+        'limit)', metavar='<MB/s>'
+    )
+    parser.add_argument(
+        '--post-limit', type=int, default=1250,
+        help='Uploads before the fake server answers 429 (default: 1250)',
+        metavar='<number>'
+    )
+    parser.add_argument(
+        '--endpoint', default=None,
+        help='URL of a running endpoint instead of starting a fake server, '
+        'the uploads are anonymous', metavar='<url>'
+    )
+    parser.add_argument(
+        '--trace-malloc', action='store_true',
+        help='Report the peak of the memory traced by tracemalloc during '
+        'the uploads'
+    )
+    parser.add_argument(
+        '-o', '--output', default=None,
+        help='Write the report to a JSON file', metavar='<file>'
+    )
+    return parser
+
+
+def main(argv=None):
+    """Run a load test from the command line
+
+    :return: Exit status, 1 if a upload failed
+    :rtype: int
+    """
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    if args.trace_malloc and tracemalloc is None:
+        parser.error('--trace-malloc needs Python 3.4 or later')
+    logging.basicConfig(format='%(levelname)s: %(message)s')
+
+    directory = tempfile.mkdtemp(prefix='imgurup-loadtest-')
+    process = None
+    try:
+        paths = make_workload(directory, args.files, args.sizes, args.seed)
+        imgur = CLIImgur()
+        imgur.fingerprint_uploads = False
+        if args.endpoint:
+            args.anonymous = True
+            imgur.connect(args.endpoint)
+        else:
+            args.anonymous = False
+            process, server = start_server(args)
+            imgur.connect(server['url'])
+            imgur._access_token = server['access_token']
+            imgur._refresh_token = server['refresh_token']
+            # Keep the tokens of the user
+            imgur.write_tokens_to_config = lambda: None
+        report = run_load_test(imgur, paths, args)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    for line in format_report(report):
+        print(line)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    return 1 if report['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
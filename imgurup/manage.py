@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""Delete and update images in bulk
+
+The targets are read from a file or stdin, one per line: a bare image id
+or deletehash, or a JSON object with `id` or `deletehash` (a result line
+of a upload, ex: a journal) and the new `title` and `description`.
+
+A deletehash is used with the client id, so it works for anonymous images
+too, and an id is used with the access token of the account. The records
+of failed uploads are skipped.
+
+The requests go through a `engine.AdaptiveLimit`: a 429 or 5xx response
+halves the number of concurrent requests, and a request refused with 429
+is sent again after a backoff.
+"""
+
+import sys
+import json
+import time
+import logging
+
+from .engine import AdaptiveLimit
+from .engine import is_overloaded
+from .engine import run_stream
+
+logger = logging.getLogger(__name__)
+
+# Image ids are 7 characters, deletehashes 15
+DELETEHASH_MIN_LENGTH = 15
+# Tries of a request refused with 429, and seconds before the first retry
+RATE_LIMIT_TRIES = 4
+RATE_LIMIT_DELAY = 2
+
+
+def parse_target(line):
+    """Parse a line of a target file
+
+    :param line: A line
+    :type line: str
+    :return: Target with `id` or `deletehash`, and optionally `title` and
+     `description`. None if the line is empty or a comment, or a record
+     without image (ex: a failed upload of a journal)
+    :rtype: dict
+    """
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    if line.startswith('{'):
+        record = json.loads(line)
+        if record.get('error') is not None:
+            logger.warning('Skip a failed upload: %s', line)
+            return None
+        target = {}
+        for field in ('id', 'deletehash', 'title', 'description'):
+            if record.get(field) is not None:
+                target[field] = record[field]
+        if 'id' not in target and 'deletehash' not in target:
+            logger.warning('Skip a record without id or deletehash: %s', line)
+            return None
+        return target
+    if len(line) >= DELETEHASH_MIN_LENGTH:
+        return {'deletehash': line}
+    return {'id': line}
+
+
+def read_targets(path):
+    """Read the targets one by one
+
+    :param path: File path, `-` for stdin
+    :type path: str
+    :rtype: generator of dict
+    """
+    fp = sys.stdin if path == '-' else open(path)
+    try:
+        for line in fp:
+            target = parse_target(line)
+            if target is not None:
+                yield target
+    finally:
+        if fp is not sys.stdin:
+            fp.close()
+
+
+def get_image_id(target):
+    """Get the id used in the API request of a target
+
+    :return: (image id or deletehash, anonymous)
+    :rtype: tuple
+    """
+    if target.get('deletehash'):
+        return target['deletehash'], True
+    return target['id'], False
+
+
+def run_limited(imgur, func, targets, on_result, workers=4):
+    """Call a request function with each target concurrently, under a
+    `AdaptiveLimit` of at most `workers` requests
+
+    :param imgur: Connected Imgur instance
+    :type imgur: Imgur
+    :param func: Send the request of a target
+    :type func: function
+    :param targets: Targets, see `read_targets()`
+    :type targets: iterable of dict
+    :param on_result: Called with (target, exception) as soon as each
+     request finishes, exception is None if success
+    :type on_result: function
+    :param workers: Highest number of concurrent requests
+    :type workers: int
+    :return: Number of targets
+    :rtype: int
+    """
+    limit = AdaptiveLimit(1, workers, workers)
+
+    def call(target):
+        delay = RATE_LIMIT_DELAY
+        for attempt in range(1, RATE_LIMIT_TRIES + 1):
+            started = limit.acquire()
+            imgur.last_status = None
+            error = None
+            try:
+                return func(target)
+            except Exception as e:
+                error = e
+                if imgur.last_status != 429 or attempt == RATE_LIMIT_TRIES:
+                    raise
+            finally:
+                limit.release()
+                limit.record(
+                    started, overloaded=is_overloaded(imgur.last_status, error)
+                )
+            logger.info('Rate limited, retry in %ds', delay)
+            time.sleep(delay)
+            delay *= 2
+
+    exit_on_error = imgur.exit_on_error
+    imgur.exit_on_error = False
+    try:
+        return run_stream(
+            call,
+            targets,
+            lambda target, result, error: on_result(target, error),
+            workers
+        )
+    finally:
+        imgur.exit_on_error = exit_on_error
+
+
+def delete_images(imgur, targets, on_result, workers=4):
+    """Delete images concurrently
+
+    :param imgur: Connected Imgur instance
+    :type imgur: Imgur
+    :param targets: Targets, see `read_targets()`
+    :type targets: iterable of dict
+    :param on_result: Called with (target, exception) as soon as each
+     request finishes, exception is None if success
+    :type on_result: function
+    :param workers: Highest number of concurrent requests
+    :type workers: int
+    :return: Number of targets
+    :rtype: int
+    """
+    def delete(target):
+        image_id, anonymous = get_image_id(target)
+        return imgur.request_image_delete(image_id, anonymous)
+
+    return run_limited(imgur, delete, targets, on_result, workers)
+
+
+def update_images(imgur, targets, on_result, workers=4):
+    """Update the title and description of images concurrently
+
+    :param imgur: Connected Imgur instance
+    :type imgur: Imgur
+    :param targets: Targets with `title` and/or `description`,
+     see `read_targets()`
+    :type targets: iterable of dict
+    :param on_result: Called with (target, exception) as soon as each
+     request finishes, exception is None if success
+    :type on_result: function
+    :param workers: Highest number of concurrent requests
+    :type workers: int
+    :return: Number of targets
+    :rtype: int
+    """
+    def update(target):
+        if 'title' not in target and 'description' not in target:
+            raise ValueError('Nothing to update')
+        image_id, anonymous = get_image_id(target)
+        return imgur.request_image_update(
+            image_id,
+            target.get('title'),
+            target.get('description'),
+            anonymous
+        )
+
+    return run_limited(imgur, update, targets, on_result, workers)
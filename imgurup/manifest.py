@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""Read upload jobs from a manifest file (JSON lines or CSV)
+
+Every record has the path or the URL of the image (`path`, `url` or
+`image`) and optionally a `title`, a `description` and an `album` (name or
+id). A image can be put into several albums with a list of albums in JSON
+lines, or albums separated by `|` in CSV. Relative paths are relative to
+the directory of the manifest. A `priority` number orders the uploads with
+the `priority` policy, see `schedule`.
+"""
+
+import os
+import sys
+import io
+import csv
+import json
+
+from .preflight import check_file
+
+FIELDS = ('title', 'description', 'album')
+
+
+class ManifestError(Exception):
+    pass
+
+
+def _open(path, newline=None):
+    if path == '-':
+        return sys.stdin
+    if sys.version_info >= (3,):
+        return io.open(path, encoding='utf-8', newline=newline)
+    return open(path, 'rb')
+
+
+def _iter_json_lines(fp):
+    for line_number, line in enumerate(fp, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            raise ManifestError(
+                'Line {n}: {e}'.format(n=line_number, e=e)
+            )
+        if not isinstance(record, dict):
+            raise ManifestError(
+                'Line {n}: record should be an object'.format(n=line_number)
+            )
+        yield line_number, record
+
+
+def _iter_csv(fp):
+    # Line 1 is the header
+    for line_number, record in enumerate(csv.DictReader(fp), 2):
+        if record.get('album'):
+            record['album'] = [
+                album.strip() for album in record['album'].split('|')
+                if album.strip()
+            ]
+        yield line_number, record
+
+
+def _to_job(record, line_number, base_dir):
+    path = record.get('path') or record.get('url') or record.get('image')
+    if not path:
+        raise ManifestError(
+            'Line {n}: path or url is required'.format(n=line_number)
+        )
+    if not path.startswith(('http://', 'https://')):
+        path = os.path.join(base_dir, os.path.expanduser(path))
+    job = {'path': path, 'line': line_number}
+    for field in FIELDS:
+        if record.get(field):
+            job[field] = record[field]
+    if record.get('priority') not in (None, ''):
+        try:
+            job['priority'] = float(record['priority'])
+        except (TypeError, ValueError):
+            raise ManifestError(
+                'Line {n}: priority should be a number'.format(n=line_number)
+            )
+    return job
+
+
+def read_manifest(path):
+    """Read the upload jobs of a manifest one by one
+
+    :param path: Manifest path, `-` to read JSON lines from stdin
+    :type path: str
+    :return: Jobs, see `engine.UploadEngine`. `album` is the album
+     name or id, or the list of them, given in the manifest
+    :rtype: generator of dict
+    :raise ManifestError: If a record is malformed
+    """
+    if path == '-':
+        base_dir = os.getcwd()
+    else:
+        base_dir = os.path.dirname(os.path.abspath(path))
+    is_csv = path.lower().endswith('.csv')
+    fp = _open(path, newline='' if is_csv else None)
+    try:
+        records = _iter_csv(fp) if is_csv else _iter_json_lines(fp)
+        for line_number, record in records:
+            yield _to_job(record, line_number, base_dir)
+    finally:
+        if fp is not sys.stdin:
+            fp.close()
+
+
+def resolve_albums(jobs, get_albums):
+    """Set `album_ids` of the jobs from their album names or ids.
+    The album list is requested once, when the first job with an album
+    is met.
+
+    :param jobs: Upload jobs
+    :type jobs: iterable of dict
+    :param get_albums: Return all the albums of the account (every page),
+     ex: `backup.iter_pages` over `imgur.request_album_list`
+    :type get_albums: function
+    :return: Jobs, with an `error` if the album can't be found
+    :rtype: generator of dict
+    """
+    album_ids = None
+    for job in jobs:
+        albums = job.get('album')
+        if albums:
+            if not isinstance(albums, list):
+                albums = [albums]
+            if album_ids is None:
+                album_ids = {}
+                for a in get_albums():
+                    album_ids[a['id']] = a['id']
+                    if a.get('title'):
+                        album_ids.setdefault(a['title'], a['id'])
+            not_found = [a for a in albums if a not in album_ids]
+            if not_found:
+                job['error'] = 'Album not found: {albums}'.format(
+                    albums=', '.join(not_found)
+                )
+            else:
+                job['album_ids'] = [album_ids[a] for a in albums]
+        yield job
+
+
+def check_jobs(jobs):
+    """Check the local files of the jobs with `preflight.check_file`,
+    so invalid files get an `error` and are never sent. The `size` and the
+    sniffed `content_type` of the valid files are set.
+
+    :param jobs: Upload jobs
+    :type jobs: iterable of dict
+    :return: Jobs
+    :rtype: generator of dict
+    """
+    for job in jobs:
+        path = job['path']
+        if (job.get('error') is None and
+                not path.startswith(('http://', 'https://'))):
+            content_type, result = check_file(path)
+            if content_type is None:
+                job['error'] = result
+            else:
+                job['size'] = result
+                job['content_type'] = content_type
+        yield job
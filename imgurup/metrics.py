@@ -0,0 +1,380 @@
+# -*- coding: utf-8 -*-
+"""Metrics of a long running process (watch, worker...)
+
+`Metrics` is a tracer (see `trace`) counting the uploads, the bytes, the
+retries by error class, the token refreshes and the token cache hits,
+keeping a latency histogram per phase, and gauges of the upload queue and
+of the rate limit budget. The hot path only updates numbers in memory,
+they are exported in the background:
+
+- a Prometheus textfile, for the textfile collector of node_exporter
+- a Prometheus HTTP endpoint on `/metrics`
+- StatsD over UDP
+"""
+
+import os
+import sys
+import socket
+import logging
+import threading
+
+if sys.version_info >= (3,):
+    from http.server import BaseHTTPRequestHandler
+    from http.server import HTTPServer
+else:
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from BaseHTTPServer import HTTPServer
+
+from .trace import Tracer
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'imgurup_'
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Latency samples kept for StatsD between two flushes
+MAX_SAMPLES = 10000
+# Bytes of a StatsD packet
+MAX_PACKET_SIZE = 512
+
+HELP = {
+    'uploads_total': 'Uploads by status',
+    'upload_bytes_total': 'Bytes of the uploaded files',
+    'retries_total': 'Retried requests by error class',
+    'token_refreshes_total': 'Refreshes of the access token',
+    'token_cache_total': 'Uses of the tokens by result (hit or miss)',
+    'phase_seconds': 'Duration of the phases of the requests',
+    'queue_depth': 'Upload jobs taken and not finished',
+    'concurrency_limit': 'Current limit of concurrent uploads',
+    'rate_limit_remaining': 'Remaining requests given by Imgur',
+}
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{k}="{v}"'.format(
+            k=k, v=str(v).replace('\\', '\\\\').replace('"', '\\"')
+        ) for k, v in labels
+    ) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metrics(Tracer):
+    """Counters, histograms and gauges, all thread safe
+    """
+
+    def __init__(self, keep_samples=False):
+        """
+        :param keep_samples: Keep the latency samples for `pop_samples()`,
+         needed by StatsD
+        :type keep_samples: bool
+        """
+        self._lock = threading.Lock()
+        # (name, labels) -> value
+        self._counters = {}
+        # (name, labels) -> [count of each bucket..., sum, count]
+        self._histograms = {}
+        # (name, labels) -> value or function
+        self._gauges = {}
+        self._keep_samples = keep_samples
+        self._samples = []
+
+    def inc(self, name, value=1, **labels):
+        """Add to a counter"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Add a value to a histogram"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(BUCKETS) + 2)
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram[i] += 1
+                    break
+            histogram[-2] += value
+            histogram[-1] += 1
+            if self._keep_samples and len(self._samples) < MAX_SAMPLES:
+                self._samples.append((key, value))
+
+    def set_gauge(self, name, value, **labels):
+        """Set a gauge
+
+        :param value: Value, or function returning the value when the
+         metrics are exported
+        :type value: float or function
+        """
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def on_phase_end(self, phase, seconds, tags):
+        self.observe('phase_seconds', seconds, phase=phase)
+
+    def on_event(self, event, tags):
+        if event == 'retry':
+            self.inc('retries_total', error=tags['error'])
+        elif event == 'token_refresh':
+            self.inc('token_refreshes_total')
+        elif event == 'token_cache':
+            result = 'hit' if tags['hit'] else 'miss'
+            self.inc('token_cache_total', result=result)
+        elif event == 'rate_limit':
+            for kind, remaining in tags.items():
+                self.set_gauge('rate_limit_remaining', remaining, kind=kind)
+
+    def on_engine(self, engine):
+        self.set_gauge('queue_depth', lambda: engine.pending)
+        self.set_gauge('concurrency_limit', lambda: engine.limit.limit)
+
+    def on_result(self, record):
+        self.inc('uploads_total', status=record.get('status', 'failed'))
+        if record.get('error') is None and record.get('size'):
+            self.inc('upload_bytes_total', record['size'])
+
+    def get_counters(self):
+        """Get the counters and the gauges
+
+        :return: ((name, labels) -> value of the counters,
+         (name, labels) -> value of the gauges)
+        :rtype: tuple
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+        for key, value in list(gauges.items()):
+            if callable(value):
+                try:
+                    gauges[key] = value()
+                except Exception:
+                    logger.debug('Gauge %s fail', key[0], exc_info=True)
+                    del gauges[key]
+        return counters, gauges
+
+    def pop_samples(self):
+        """Take the latency samples kept since the last call
+
+        :return: ((name, labels), value) of each sample
+        :rtype: list of tuple
+        """
+        with self._lock:
+            samples, self._samples = self._samples, []
+        return samples
+
+    def render(self):
+        """Render the metrics in the Prometheus text format
+
+        :rtype: str
+        """
+        counters, gauges = self.get_counters()
+        with self._lock:
+            histograms = dict(
+                (key, list(value)) for key, value in self._histograms.items()
+            )
+        lines = []
+        typed = set()
+
+        def add_type(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append('# HELP {p}{n} {h}'.format(
+                    p=PREFIX, n=name, h=HELP.get(name, name)
+                ))
+                lines.append('# TYPE {p}{n} {k}'.format(
+                    p=PREFIX, n=name, k=kind
+                ))
+
+        for kind, values in (('counter', counters), ('gauge', gauges)):
+            for (name, labels), value in sorted(values.items()):
+                add_type(name, kind)
+                lines.append('{p}{n}{l} {v}'.format(
+                    p=PREFIX, n=name, l=_format_labels(labels),
+                    v=_format_value(value)
+                ))
+        for (name, labels), histogram in sorted(histograms.items()):
+            add_type(name, 'histogram')
+            cumulative = 0
+            bounds = [str(bound) for bound in BUCKETS] + ['+Inf']
+            counts = histogram[:len(BUCKETS)] + [0]
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                if bound == '+Inf':
+                    cumulative = histogram[-1]
+                lines.append('{p}{n}_bucket{l} {v}'.format(
+                    p=PREFIX, n=name,
+                    l=_format_labels(labels + (('le', bound),)),
+                    v=cumulative
+                ))
+            lines.append('{p}{n}_sum{l} {v}'.format(
+                p=PREFIX, n=name, l=_format_labels(labels),
+                v=_format_value(histogram[-2])
+            ))
+            lines.append('{p}{n}_count{l} {v}'.format(
+                p=PREFIX, n=name, l=_format_labels(labels), v=histogram[-1]
+            ))
+        return '\n'.join(lines) + '\n'
+
+
+def write_textfile(metrics, path):
+    """Write the metrics to a Prometheus textfile atomically
+
+    :param metrics: Metrics
+    :type metrics: Metrics
+    :param path: File path, should end with `.prom`
+    :type path: str
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(metrics.render())
+    if os.name == 'nt' and os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp_path, path)
+
+
+def serve_metrics(metrics, port, host='127.0.0.1'):
+    """Serve the metrics on `http://<host>:<port>/metrics` in a background
+    thread
+
+    :param metrics: Metrics
+    :type metrics: Metrics
+    :param port: Port, 0 for any free port
+    :type port: int
+    :param host: Address to listen on
+    :type host: str
+    :return: The server, `server.server_address` is the bound address and
+     `server.shutdown()` stops it
+    :rtype: HTTPServer
+    """
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer((host, port), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+class StatsdClient(object):
+    """Send the metrics to StatsD over UDP: the increase of the counters,
+    the gauges and the latency samples since the last flush
+    """
+
+    def __init__(self, metrics, address):
+        """
+        :param metrics: Metrics created with `keep_samples=True`
+        :type metrics: Metrics
+        :param address: `host:port`
+        :type address: str
+        """
+        host, _, port = address.rpartition(':')
+        self._address = (host or 'localhost', int(port or 8125))
+        self._metrics = metrics
+        self._sent_counters = {}
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def _get_name(self, name, labels):
+        return '.'.join(
+            [PREFIX.rstrip('_'), name] +
+            [str(v).replace('.', '_') for _, v in labels]
+        )
+
+    def flush(self):
+        """Send what changed since the last flush"""
+        counters, gauges = self._metrics.get_counters()
+        lines = []
+        for key, value in sorted(counters.items()):
+            delta = value - self._sent_counters.get(key, 0)
+            self._sent_counters[key] = value
+            if delta:
+                lines.append('{n}:{v}|c'.format(
+                    n=self._get_name(*key), v=_format_value(delta)
+                ))
+        for key, value in sorted(gauges.items()):
+            lines.append('{n}:{v}|g'.format(
+                n=self._get_name(*key), v=_format_value(value)
+            ))
+        for key, value in self._metrics.pop_samples():
+            lines.append('{n}:{v:.3f}|ms'.format(
+                n=self._get_name(*key), v=value * 1000
+            ))
+        packet = ''
+        for line in lines:
+            if packet and len(packet) + len(line) + 1 > MAX_PACKET_SIZE:
+                self._send(packet)
+                packet = ''
+            packet = packet + '\n' + line if packet else line
+        if packet:
+            self._send(packet)
+
+    def _send(self, packet):
+        try:
+            self._socket.sendto(packet.encode('utf-8'), self._address)
+        except socket.error as e:
+            logger.debug('StatsD send fail: %s', e)
+
+
+class MetricsExporter(object):
+    """Write the textfile and flush StatsD periodically in a background
+    thread
+    """
+
+    def __init__(self, metrics, textfile=None, statsd=None, interval=10):
+        """
+        :param metrics: Metrics
+        :type metrics: Metrics
+        :param textfile: Prometheus textfile path
+        :type textfile: str
+        :param statsd: StatsD client
+        :type statsd: StatsdClient
+        :param interval: Seconds between two exports
+        :type interval: float
+        """
+        self._metrics = metrics
+        self._textfile = textfile
+        self._statsd = statsd
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def export(self):
+        """Export now"""
+        try:
+            if self._textfile is not None:
+                write_textfile(self._metrics, self._textfile)
+            if self._statsd is not None:
+                self._statsd.flush()
+        except (IOError, OSError) as e:
+            logger.warning('Export metrics fail: %s', e)
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            self.export()
+
+    def close(self):
+        """Stop the thread and export the last values"""
+        self._stop.set()
+        self._thread.join()
+        self.export()
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""Check the files of a batch before anything is sent to Imgur
+"""
+
+import os
+import mimetypes
+
+# Limits from https://api.imgur.com/endpoints/image
+MAX_IMAGE_SIZE = 20 * 1024 * 1024
+MAX_ANIMATED_SIZE = 200 * 1024 * 1024
+ANIMATED_TYPES = (
+    'image/gif',
+    'video/mp4',
+    'video/quicktime',
+    'video/webm',
+)
+
+# Number of leading bytes needed by sniff_content_type()
+SNIFF_LENGTH = 16
+
+# Major brands of the ISO base media files (`ftyp` box) Imgur accepts,
+# HEIC, AVIF, M4A... are not accepted
+FTYP_BRANDS = {
+    b'qt  ': 'video/quicktime',
+    b'isom': 'video/mp4',
+    b'iso2': 'video/mp4',
+    b'iso4': 'video/mp4',
+    b'iso5': 'video/mp4',
+    b'iso6': 'video/mp4',
+    b'mp41': 'video/mp4',
+    b'mp42': 'video/mp4',
+    b'avc1': 'video/mp4',
+    b'dash': 'video/mp4',
+    b'M4V ': 'video/mp4',
+    b'M4VP': 'video/mp4',
+    b'MSNV': 'video/mp4',
+    b'f4v ': 'video/mp4',
+    b'mmp4': 'video/mp4',
+    b'3gp4': 'video/mp4',
+    b'3gp5': 'video/mp4',
+    b'3gp6': 'video/mp4',
+}
+
+
+def sniff_content_type(header):
+    """Detect the content type from the leading bytes of a file
+
+    :param header: The first `SNIFF_LENGTH` bytes of the file
+    :type header: bytes
+    :return: Content type, or None if it's not a type Imgur accepts
+    :rtype: str
+    """
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if header[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    if header[:4] in (b'II*\x00', b'MM\x00*'):
+        return 'image/tiff'
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'image/webp'
+    if header[4:8] == b'ftyp':
+        return FTYP_BRANDS.get(header[8:12])
+    if header.startswith(b'\x1a\x45\xdf\xa3'):
+        return 'video/webm'
+    if header.startswith(b'BM'):
+        return 'image/bmp'
+    return None
+
+
+def get_content_type(path):
+    """Get the content type of a file, sniffing its content first and
+    falling back to the file name
+
+    :param path: The file path
+    :type path: str
+    :return: Content type
+    :rtype: str
+    """
+    try:
+        with open(path, 'rb') as f:
+            content_type = sniff_content_type(f.read(SNIFF_LENGTH))
+    except (IOError, OSError):
+        content_type = None
+    return (
+        content_type or
+        mimetypes.guess_type(path)[0] or
+        'application/octet-stream'
+    )
+
+
+def check_file(path):
+    """Stat and sniff a file, and check it against Imgur's limits
+
+    :param path: The file path
+    :type path: str
+    :return: (content type, size), or (None, error message) if the file
+     can't be uploaded
+    :rtype: tuple
+    """
+    try:
+        size = os.stat(path).st_size
+        with open(path, 'rb') as f:
+            header = f.read(SNIFF_LENGTH)
+    except (IOError, OSError) as e:
+        return None, e.strerror or str(e)
+
+    if size == 0:
+        return None, 'File is empty'
+    content_type = sniff_content_type(header)
+    if content_type is None:
+        return None, 'Not a supported image or video type'
+    if content_type in ANIMATED_TYPES:
+        limit = MAX_ANIMATED_SIZE
+    else:
+        limit = MAX_IMAGE_SIZE
+    if size > limit:
+        return None, '{t} larger than {limit} MB ({size} bytes)'.format(
+            t=content_type, limit=limit // (1024 * 1024), size=size
+        )
+    return content_type, size
+
+
+def preflight(paths):
+    """Check every file of a batch and collect all the problems
+
+    :param paths: The file paths
+    :type paths: list of str
+    :return: (valid, problems). `valid` is a list of
+     (path, content type, size) in the input order, `problems` is a list
+     of (path, error message)
+    :rtype: tuple
+    """
+    valid = []
+    problems = []
+    for path in paths:
+        content_type, result = check_file(path)
+        if content_type is None:
+            problems.append((path, result))
+        else:
+            valid.append((path, content_type, result))
+    return valid, problems
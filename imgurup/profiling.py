@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""Profile a run without changing the code
+
+`Profiler` runs cProfile in the main thread and in every thread started
+while it runs (the workers of the upload engines), and writes their merged
+stats to a pstats file. `MemoryReport` traces the memory allocations with
+tracemalloc and reports the peak and the top allocation sites.
+
+Both can take a snapshot while the run goes on, see `dump_on_signal()`.
+"""
+
+import signal
+import logging
+import threading
+import cProfile
+import pstats
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2
+    tracemalloc = None
+
+logger = logging.getLogger(__name__)
+
+# Frames kept for each traced allocation
+TRACE_FRAMES = 1
+
+
+class _Snapshot(object):
+    """Stats of a profile which may still be enabled, for `pstats.Stats`
+    """
+
+    def __init__(self, profile):
+        self._profile = profile
+        self.stats = {}
+
+    def create_stats(self):
+        # Unlike Profile.create_stats(), do not disable the profile
+        self._profile.snapshot_stats()
+        self.stats = self._profile.stats
+
+
+class Profiler(object):
+    """cProfile of the main thread and of the threads it starts
+    """
+
+    def __init__(self):
+        self._profiles = []
+        self._lock = threading.Lock()
+
+    def _add_profile(self):
+        profile = cProfile.Profile()
+        with self._lock:
+            self._profiles.append(profile)
+        return profile
+
+    def _start_thread(self, frame, event, arg):
+        # First call of a new thread, the profile replaces this function
+        try:
+            self._add_profile().enable()
+        except ValueError:
+            # Only one profile can be enabled at once on Python 3.12+
+            threading.setprofile(None)
+
+    def start(self):
+        """Start profiling"""
+        threading.setprofile(self._start_thread)
+        self._add_profile().enable()
+
+    def stop(self):
+        """Stop profiling the main thread and the new threads"""
+        threading.setprofile(None)
+        self._profiles[0].disable()
+
+    def get_stats(self):
+        """Get the merged stats of the threads so far
+
+        :rtype: pstats.Stats
+        """
+        with self._lock:
+            profiles = list(self._profiles)
+        return pstats.Stats(*[_Snapshot(profile) for profile in profiles])
+
+    def dump(self, path):
+        """Write the stats so far to a pstats file
+
+        :param path: File path, read it with `python -m pstats <path>`
+        :type path: str
+        """
+        self.get_stats().dump_stats(path)
+        logger.info('Profile written to %s', path)
+
+
+class MemoryReport(object):
+    """Peak of the traced memory and top allocation sites
+    """
+
+    def __init__(self, limit=10):
+        """
+        :param limit: Number of allocation sites reported
+        :type limit: int
+        """
+        if tracemalloc is None:
+            raise RuntimeError('tracemalloc needs Python 3.4 or later')
+        self.limit = limit
+
+    def start(self):
+        """Start tracing the allocations"""
+        tracemalloc.start(TRACE_FRAMES)
+
+    def stop(self):
+        tracemalloc.stop()
+
+    def format_report(self):
+        """Format the memory traced so far
+
+        :return: One line for the current and peak memory, then one line
+         per allocation site, ex: `imgurup/__init__.py:380: 2048.0 KiB in 3
+         blocks`
+        :rtype: list of str
+        """
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+            tracemalloc.Filter(False, '<unknown>'),
+        ))
+        lines = [
+            'Traced memory: {current:.1f} MiB, peak {peak:.1f} MiB'.format(
+                current=current / 1048576.0, peak=peak / 1048576.0
+            )
+        ]
+        for stat in snapshot.statistics('lineno')[:self.limit]:
+            frame = stat.traceback[0]
+            lines.append(
+                '{file}:{line}: {size:.1f} KiB in {count} blocks'.format(
+                    file=frame.filename,
+                    line=frame.lineno,
+                    size=stat.size / 1024.0,
+                    count=stat.count
+                )
+            )
+        return lines
+
+    def log_report(self):
+        for line in self.format_report():
+            logger.info(line)
+
+
+def dump_on_signal(profiler=None, profile_path=None, memory=None):
+    """Dump the profile and log the memory report when the process gets
+    SIGUSR1, to look into a long running process
+
+    :param profiler: Profiler, written to `profile_path`
+    :type profiler: Profiler
+    :param profile_path: pstats file path
+    :type profile_path: str
+    :param memory: Memory report
+    :type memory: MemoryReport
+    :return: False if the platform has no SIGUSR1
+    :rtype: bool
+    """
+    if not hasattr(signal, 'SIGUSR1'):
+        return False
+
+    def handler(signum, frame):
+        if memory is not None:
+            memory.log_report()
+        if profiler is not None:
+            profiler.dump(profile_path)
+
+    signal.signal(signal.SIGUSR1, handler)
+    return True
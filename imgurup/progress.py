@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""Progress of the uploads
+
+One dialog process is started for the whole batch and updated as the
+uploads finish, instead of one modal dialog per file. In a terminal,
+`ProgressBar` shows the bytes sent of the running uploads.
+"""
+
+import sys
+import logging
+import threading
+import subprocess
+
+from .trace import Tracer
+
+logger = logging.getLogger(__name__)
+
+
+class PipeProgressDialog(object):
+    """A dialog reading its progress from stdin, ex: `zenity --progress`.
+    A line with a number sets the percentage, a line starting with `#` sets
+    the text.
+    """
+
+    def __init__(self, args, total):
+        """
+        :param args: Dialog command
+        :type args: list
+        :param total: Number of files of the batch
+        :type total: int
+        """
+        self._total = max(1, total)
+        self._process = subprocess.Popen(
+            args,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+
+    def update(self, done, text):
+        """Show the progress
+
+        :param done: Number of finished files
+        :type done: int
+        :param text: Message, ex: the name of the last file
+        :type text: str
+        """
+        if self._process.stdin.closed:
+            return
+        percent = done * 100 // self._total
+        line = '{percent}\n# {text}\n'.format(percent=percent, text=text)
+        try:
+            self._process.stdin.write(line.encode('utf-8'))
+            self._process.stdin.flush()
+        except (IOError, OSError):
+            # Closed by the user, the uploads go on without progress
+            logger.info('Progress dialog closed')
+            self._process.stdin.close()
+
+    def close(self):
+        """Close the dialog"""
+        try:
+            self._process.stdin.close()
+        except (IOError, OSError):
+            pass
+        self._process.wait()
+
+
+class DBusProgressDialog(object):
+    """A dialog driven over D-Bus, ex: `kdialog --progressbar`, which prints
+    its D-Bus service and object path when started
+    """
+
+    def __init__(self, args, total, dbus_command='qdbus'):
+        """
+        :param args: Dialog command
+        :type args: list
+        :param total: Number of files of the batch, the maximum of the bar
+        :type total: int
+        :param dbus_command: Command calling a D-Bus method
+        :type dbus_command: str
+        """
+        process = subprocess.Popen(
+            args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        output = process.communicate()[0].decode('utf-8').split()
+        self._target = [dbus_command] + output[:2]
+
+    def _call(self, *method_args):
+        try:
+            subprocess.call(
+                self._target + list(method_args),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE
+            )
+        except OSError as e:
+            logger.info('Progress dialog error: %s', e)
+
+    def update(self, done, text):
+        """Show the progress
+
+        :param done: Number of finished files
+        :type done: int
+        :param text: Message, ex: the name of the last file
+        :type text: str
+        """
+        self._call('Set', '', 'value', str(done))
+        self._call('setLabelText', text)
+
+    def close(self):
+        """Close the dialog"""
+        self._call('close')
+
+
+def format_size(size):
+    """Format a number of bytes
+
+    :rtype: str
+    """
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return '{size:.1f}{unit}'.format(size=size, unit=unit)
+        size /= 1024.0
+    return '{size:.1f}GB'.format(size=size)
+
+
+class ProgressBar(Tracer):
+    """A progress bar of the uploads being sent, redrawn on one line of a
+    terminal. Concurrent uploads are shown together.
+    """
+
+    def __init__(self, stream=None, width=20):
+        """
+        :param stream: Terminal, stderr by default
+        :type stream: file
+        :param width: Characters of the bar
+        :type width: int
+        """
+        self._stream = stream or sys.stderr
+        self._width = width
+        # Path -> progress of the uploads being sent
+        self._transfers = {}
+        self._line_length = 0
+        self._lock = threading.Lock()
+
+    def on_progress(self, progress, tags):
+        with self._lock:
+            key = tags.get('path')
+            if progress.done:
+                self._transfers.pop(key, None)
+            else:
+                self._transfers[key] = progress
+            if self._transfers:
+                self._write(self.format_line())
+            else:
+                self._write('')
+
+    def format_line(self):
+        """Format the progress of the running transfers
+
+        :return: ex: `a.jpg [#####     ] 25% 2.5MB/10.0MB 1.2MB/s ETA 6s`
+        :rtype: str
+        """
+        transfers = list(self._transfers.values())
+        sent = sum(p.sent for p in transfers)
+        total = sum(p.total for p in transfers) or 1
+        rate = sum(p.rate or 0 for p in transfers)
+        if len(transfers) == 1:
+            name = str(list(self._transfers)[0]).split('/')[-1]
+        else:
+            name = '{n} files'.format(n=len(transfers))
+        filled = self._width * sent // total
+        eta = '{s:.0f}s'.format(s=(total - sent) / rate) if rate else '?'
+        line = '{name} [{bar}] {percent}% {sent}/{total} {rate}/s ETA {eta}'
+        return line.format(
+            name=name,
+            bar='#' * filled + ' ' * (self._width - filled),
+            percent=sent * 100 // total,
+            sent=format_size(sent),
+            total=format_size(total),
+            rate=format_size(rate),
+            eta=eta
+        )
+
+    def _write(self, line):
+        if not line and not self._line_length:
+            return
+        padding = ' ' * max(0, self._line_length - len(line))
+        self._stream.write('\r' + line + padding + ('\r' if not line else ''))
+        self._stream.flush()
+        self._line_length = len(line)
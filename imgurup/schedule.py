@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""Order the upload jobs of a batch
+
+- `fifo`: in the given order, the jobs are not read in advance
+- `smallest`: the smallest files first, so most links come early
+- `priority`: by the `priority` of the manifest records, highest first
+
+The size of a job is taken from a `os.stat`, the files are never read.
+Files of `large_size` bytes or more are marked `large`, the upload engine
+sends them in their own lane so they don't hold the slots of small files.
+"""
+
+from .engine import get_size
+
+POLICIES = ('fifo', 'smallest', 'priority')
+DEFAULT_LARGE_SIZE = 10 * 1024 * 1024
+
+
+def _sized(jobs, large_size):
+    for index, job in enumerate(jobs):
+        job.setdefault('index', index)
+        if job.get('size') is None:
+            job['size'] = get_size(job['path'])
+        if large_size:
+            job['large'] = job['size'] >= large_size
+        yield job
+
+
+def get_order_key(policy):
+    """Get the sort key of a policy
+
+    :param policy: One of `POLICIES`
+    :type policy: str
+    :rtype: function
+    """
+    if policy == 'smallest':
+        return lambda job: (job['size'], job['index'])
+    if policy == 'priority':
+        return lambda job: (-job.get('priority', 0), job['index'])
+    raise ValueError('Unknown policy: {policy}'.format(policy=policy))
+
+
+def schedule_jobs(jobs, policy='fifo', large_size=DEFAULT_LARGE_SIZE):
+    """Order the jobs, and mark their `size` and `large`.
+    Each job keeps the `index` of its position in `jobs`, so the results
+    can be put back in the given order.
+
+    :param jobs: Upload jobs
+    :type jobs: iterable of dict
+    :param policy: One of `POLICIES`. With a policy other than `fifo`,
+     all the jobs are read before the first one is returned
+    :type policy: str
+    :param large_size: Bytes from which a file is large, None or 0 to
+     upload all the files in the same lane
+    :type large_size: int
+    :return: Jobs
+    :rtype: iterable of dict
+    """
+    jobs = _sized(jobs, large_size)
+    if policy == 'fifo':
+        return jobs
+    return sorted(jobs, key=get_order_key(policy))
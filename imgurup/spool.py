@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+"""Spool directory of upload jobs waiting for the network
+
+Each job is a JSON file `<name>.job`. A process takes a job by renaming it
+to `<name>.job.claimed-<owner>`, the rename is atomic (also on NFS), so
+several processes on several hosts can drain the same spool without
+uploading a job twice. Workers write the result of a uploaded job to
+`<name>.result`, and put back a job failed by the network or the server
+(see `is_retryable()`) for a later try. A claim whose file isn't touched
+by its owner during a timeout is considered stale (its process died) and
+is put back. A job file which can't be read is put aside as
+`<name>.invalid`, a job which can't succeed is put aside with its result
+as `<name>.failed`.
+"""
+
+import os
+import json
+import time
+import uuid
+import random
+import shutil
+import socket
+import logging
+import threading
+
+from .engine import UploadEngine
+from .engine import get_size
+from .manifest import check_jobs
+from .schedule import get_order_key
+from .schedule import schedule_jobs
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SPOOL_DIR = os.path.expanduser('~/.imgurup/spool')
+JOB_SUFFIX = '.job'
+CLAIMED_SUFFIX = '.claimed'
+RESULT_SUFFIX = '.result'
+INVALID_SUFFIX = '.invalid'
+FAILED_SUFFIX = '.failed'
+DEFAULT_STALE_TIMEOUT = 600
+
+
+class Spool(object):
+    """A directory of upload jobs
+    """
+
+    def __init__(self, directory=DEFAULT_SPOOL_DIR):
+        """
+        :param directory: Spool directory, created if it doesn't exist
+        :type directory: str
+        """
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _write(self, path, data):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.rename(tmp_path, path)
+
+    def put(self, job, copy=False):
+        """Add a upload job
+
+        :param job: Upload job, see `engine.UploadEngine`
+        :type job: dict
+        :param copy: Copy the file into the spool, so it can be removed or
+         changed before the upload
+        :type copy: bool
+        :return: Job name
+        :rtype: str
+        """
+        # The names sort in the order of the queue
+        name = '{t:.6f}-{u}'.format(t=time.time(), u=uuid.uuid4().hex[:8])
+        job = dict(job, queued_at=time.time())
+        if not job['path'].startswith(('http://', 'https://')):
+            job['path'] = os.path.abspath(job['path'])
+            if copy:
+                data_path = os.path.join(self.directory, name + '.data')
+                shutil.copyfile(job['path'], data_path)
+                job['data'] = data_path
+        self._write(os.path.join(self.directory, name + JOB_SUFFIX), job)
+        return name
+
+    def pending(self):
+        """List the jobs which are not claimed
+
+        :return: Job names in the order of the queue
+        :rtype: list of str
+        """
+        return sorted(
+            name[:-len(JOB_SUFFIX)] for name in os.listdir(self.directory)
+            if name.endswith(JOB_SUFFIX)
+        )
+
+    def _get_path(self, name, suffix=JOB_SUFFIX):
+        return os.path.join(self.directory, name + suffix)
+
+    def claim(self, name, owner=''):
+        """Take a job
+
+        :param name: Job name
+        :type name: str
+        :param owner: Appended to the claimed file name
+        :type owner: str
+        :return: The job with its `spool_name` and `spool_claim` (path of
+         the claimed file), and its `source` (queued path) if the copy is
+         uploaded. None if it's already claimed by another process
+        :rtype: dict
+        """
+        claimed_path = self._get_path(name, JOB_SUFFIX + CLAIMED_SUFFIX)
+        if owner:
+            claimed_path += '-' + owner
+        path = self._get_path(name)
+        try:
+            # A rename keeps the mtime, which is the heartbeat of the claim:
+            # touch the job before, or an old job looks stale once claimed
+            os.utime(path, None)
+            os.rename(path, claimed_path)
+        except OSError:
+            return None
+        try:
+            with open(claimed_path) as f:
+                job = json.load(f)
+        except (IOError, OSError):
+            # Put back and claimed again by another process
+            return None
+        except ValueError:
+            job = None
+        if not isinstance(job, dict) or 'path' not in job:
+            self._put_aside(name, claimed_path)
+            return None
+        job['spool_name'] = name
+        job['spool_claim'] = claimed_path
+        if job.get('data'):
+            # Upload the copy, report the file of the user
+            job['source'] = job['path']
+            job['path'] = job['data']
+        return job
+
+    def _put_aside(self, name, claimed_path):
+        logger.error('Invalid job %s, put aside', name)
+        try:
+            os.rename(claimed_path, self._get_path(name, INVALID_SUFFIX))
+        except OSError:
+            pass
+
+    def _get_order_key(self, name, index, policy):
+        try:
+            with open(self._get_path(name)) as f:
+                job = json.load(f)
+            job['index'] = index
+            if job.get('size') is None:
+                job['size'] = get_size(job.get('data') or job['path'])
+            return get_order_key(policy)(job)
+        except (IOError, OSError, ValueError, TypeError, KeyError):
+            # Claimed by another process, or invalid: the claim tells
+            return get_order_key(policy)({'size': 0, 'index': index})
+
+    def release(self, job):
+        """Put back a claimed job, ex: after a failure"""
+        os.rename(job['spool_claim'], self._get_path(job['spool_name']))
+
+    def done(self, job):
+        """Remove a claimed job"""
+        os.remove(job['spool_claim'])
+        if job.get('data') and os.path.exists(job['data']):
+            os.remove(job['data'])
+
+    def claim_all(self, owner='', rotate=False, policy='fifo'):
+        """Claim the pending jobs one by one
+
+        :param owner: Appended to the claimed file names
+        :type owner: str
+        :param rotate: Start from a random job, so the workers sharing the
+         spool don't all try to claim the same jobs
+        :type rotate: bool
+        :param policy: One of `schedule.POLICIES`, with a policy other than
+         `fifo` the pending jobs are read and sorted (not rotated)
+        :type policy: str
+        :rtype: generator of dict
+        """
+        names = self.pending()
+        if policy != 'fifo':
+            keys = dict(
+                (name, self._get_order_key(name, index, policy))
+                for index, name in enumerate(names)
+            )
+            names.sort(key=keys.get)
+        elif rotate and names:
+            start = random.randrange(len(names))
+            names = names[start:] + names[:start]
+        for name in names:
+            job = self.claim(name, owner)
+            if job is not None:
+                yield job
+
+    def touch(self, job):
+        """Show that the owner of a claimed job is alive"""
+        try:
+            os.utime(job['spool_claim'], None)
+        except OSError:
+            logger.warning('Claim lost: %s', job['spool_name'])
+
+    def finish(self, job, record):
+        """Write the result of a claimed job next to it, and remove the job
+
+        :param job: Claimed job
+        :type job: dict
+        :param record: Result record of the upload engine
+        :type record: dict
+        """
+        self._write(self._get_path(job['spool_name'], RESULT_SUFFIX), record)
+        self.done(job)
+
+    def fail(self, job, record):
+        """Put aside a claimed job which can't succeed, with its result in
+        `<name>.failed`, so it's not retried
+
+        :param job: Claimed job
+        :type job: dict
+        :param record: Result record of the upload engine
+        :type record: dict
+        """
+        self._write(self._get_path(job['spool_name'], FAILED_SUFFIX), record)
+        self.done(job)
+
+    def recover_stale(self, timeout=DEFAULT_STALE_TIMEOUT):
+        """Put back the claims not touched during `timeout` seconds
+
+        :param timeout: Seconds
+        :type timeout: float
+        :return: Number of recovered jobs
+        :rtype: int
+        """
+        marker = JOB_SUFFIX + CLAIMED_SUFFIX
+        deadline = time.time() - timeout
+        recovered = 0
+        for file_name in os.listdir(self.directory):
+            if marker not in file_name:
+                continue
+            path = os.path.join(self.directory, file_name)
+            name = file_name[:file_name.index(marker)]
+            try:
+                if os.path.getmtime(path) >= deadline:
+                    continue
+                os.rename(path, self._get_path(name))
+            except OSError:
+                # Finished or recovered by another process
+                continue
+            logger.info('Recover stale job %s', name)
+            recovered += 1
+        return recovered
+
+
+def get_owner():
+    """Get the owner name of the claims of this process
+
+    :return: `<hostname>-<pid>`
+    :rtype: str
+    """
+    return '{host}-{pid}'.format(host=socket.gethostname(), pid=os.getpid())
+
+
+def get_source(job):
+    """Get the path of a claimed job as it was queued, not the path of its
+    copy in the spool
+
+    :rtype: str
+    """
+    return job.get('source', job['path'])
+
+
+def is_retryable(record):
+    """Check if a failed upload may succeed later: it was not sent, or
+    failed by the network, the rate limit, the authentication or the server
+
+    :param record: Result record of the upload engine
+    :type record: dict
+    :rtype: bool
+    """
+    if record['status'] == 'not_sent':
+        return True
+    if record['id'] is not None:
+        # Uploaded, only added to some albums
+        return False
+    status = record.get('http_status')
+    return status is None or status in (401, 403, 408, 429) or status >= 500
+
+
+def start_heartbeat(spool, claimed, lock, stop, interval):
+    """Touch the claimed jobs in a thread until `stop` is set, so other
+    processes don't recover them
+
+    :param spool: Spool of the jobs
+    :type spool: Spool
+    :param claimed: Claimed jobs by index
+    :type claimed: dict
+    :param lock: Lock of `claimed`
+    :type lock: threading.Lock
+    :param stop: Set it to stop the thread
+    :type stop: threading.Event
+    :param interval: Seconds between the touches
+    :type interval: float
+    :rtype: threading.Thread
+    """
+    def heartbeat():
+        while not stop.wait(interval):
+            with lock:
+                jobs = list(claimed.values())
+            for job in jobs:
+                spool.touch(job)
+
+    thread = threading.Thread(target=heartbeat)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def run_worker(imgur, spool, workers=4, stale_timeout=DEFAULT_STALE_TIMEOUT,
+               poll_interval=5, on_result=None, stop=None, engine=None,
+               policy='fifo', large_size=0):
+    """Claim and upload the jobs of a shared spool until `stop` is set
+
+    :param imgur: Connected Imgur instance
+    :type imgur: Imgur
+    :param spool: Spool shared by the workers
+    :type spool: Spool
+    :param workers: Number of concurrent uploads of this process
+    :type workers: int
+    :param stale_timeout: Seconds before a claim of a dead worker is put back
+    :type stale_timeout: float
+    :param poll_interval: Seconds to wait when the spool is empty
+    :type poll_interval: float
+    :param on_result: Called with each result record
+    :type on_result: function
+    :param stop: Set it to stop the worker
+    :type stop: threading.Event
+    :param engine: Upload engine, by default a `UploadEngine` of `workers`
+    :type engine: UploadEngine
+    :param policy: Order of the jobs of the spool, one of
+     `schedule.POLICIES`
+    :type policy: str
+    :param large_size: Bytes from which a file is uploaded in the large
+     lane, 0 for no large lane
+    :type large_size: int
+    :return: (number of successes, number of failures)
+    :rtype: tuple
+    """
+    owner = get_owner()
+    stop = stop or threading.Event()
+    claimed = {}
+    lock = threading.Lock()
+
+    def get_jobs():
+        index = 0
+        while not stop.is_set():
+            spool.recover_stale(stale_timeout)
+            found = False
+            for job in spool.claim_all(owner, True, policy):
+                found = True
+                with lock:
+                    claimed[index] = job
+                index += 1
+                yield job
+                if stop.is_set():
+                    return
+            if not found:
+                stop.wait(poll_interval)
+
+    def handle(record):
+        with lock:
+            job = claimed.pop(record['index'])
+        record['path'] = get_source(job)
+        if record['error'] is None:
+            spool.finish(job, record)
+        elif job.get('error') is not None or not is_retryable(record):
+            # Never succeeds, ex: a missing file, or rejected by Imgur
+            spool.fail(job, record)
+        else:
+            spool.release(job)
+        if on_result is not None:
+            on_result(record)
+
+    if engine is None:
+        engine = UploadEngine(imgur, workers)
+        for tracer in imgur.tracers:
+            tracer.on_engine(engine)
+    start_heartbeat(spool, claimed, lock, stop, stale_timeout / 3.0)
+    try:
+        return engine.run(
+            schedule_jobs(check_jobs(get_jobs()), 'fifo', large_size), handle
+        )
+    finally:
+        stop.set()
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""Mirror a local directory to a album incrementally
+
+The state of the last sync is kept in an index file inside the directory:
+path, size, mtime, content hash and remote id of every file. A file whose
+size and mtime didn't change is not read, so a sync without any change is
+a stat pass without network traffic. The new and changed files are picked
+by their content like the preflight does, see `preflight`.
+"""
+
+import os
+import json
+import logging
+
+from .engine import UploadEngine
+from .engine import get_file_hash
+from .engine import run_concurrently
+from .manifest import check_jobs
+from .preflight import SNIFF_LENGTH
+from .preflight import sniff_content_type
+from .watch import is_ignored
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = '.imgurup-sync.json'
+
+
+def is_media(path):
+    """Check by its content if a file is a image or a video Imgur accepts
+
+    :param path: File path
+    :type path: str
+    :rtype: bool
+    """
+    try:
+        with open(path, 'rb') as f:
+            return sniff_content_type(f.read(SNIFF_LENGTH)) is not None
+    except (IOError, OSError):
+        return False
+
+
+def scan_directory(directory):
+    """Stat the files of a directory and its sub directories
+
+    :param directory: Directory path
+    :type directory: str
+    :return: Relative path -> (size, mtime)
+    :rtype: dict
+    """
+    files = {}
+    for root, dirs, names in os.walk(directory):
+        dirs[:] = [d for d in dirs if not is_ignored(d)]
+        for name in names:
+            if is_ignored(name):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            relpath = os.path.relpath(path, directory).replace(os.sep, '/')
+            files[relpath] = (stat.st_size, stat.st_mtime)
+    return files
+
+
+def load_index(directory):
+    """Load the sync index of a directory
+
+    :param directory: Directory path
+    :type directory: str
+    :return: Index with `album` and `files`
+     (relative path -> dict of size, mtime, hash, id, deletehash)
+    :rtype: dict
+    """
+    path = os.path.join(directory, INDEX_NAME)
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except IOError:
+        return {'album': None, 'files': {}}
+
+
+def save_index(directory, index):
+    """Save the sync index of a directory atomically
+
+    :param directory: Directory path
+    :type directory: str
+    :param index: Index
+    :type index: dict
+    """
+    path = os.path.join(directory, INDEX_NAME)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+    if os.name == 'nt' and os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp_path, path)
+
+
+def plan_sync(directory, index, files):
+    """Compare the local files with the index.
+    Only the files whose size or mtime changed are read to get their type
+    and their hash, the files which are not images or videos are skipped.
+
+    :param directory: Directory path
+    :type directory: str
+    :param index: Sync index, the mtime of touched files is updated
+    :type index: dict
+    :param files: Result of `scan_directory()`
+    :type files: dict
+    :return: (relative paths to upload with their hash, relative paths
+     gone from the directory)
+    :rtype: tuple
+    """
+    entries = index['files']
+    uploads = []
+    media = set()
+    for relpath in sorted(files):
+        size, mtime = files[relpath]
+        entry = entries.get(relpath)
+        if entry and entry['size'] == size and entry['mtime'] == mtime:
+            media.add(relpath)
+            continue
+        path = os.path.join(directory, relpath)
+        if not is_media(path):
+            continue
+        media.add(relpath)
+        file_hash = get_file_hash(path)
+        if entry and entry['hash'] == file_hash:
+            # Touched but not changed
+            entry['size'] = size
+            entry['mtime'] = mtime
+            continue
+        uploads.append((relpath, file_hash))
+    # Also the files replaced by something which is not a image any more
+    removed = sorted(relpath for relpath in entries if relpath not in media)
+    return uploads, removed
+
+
+def sync_directory(imgur, directory, album_id, delete_remote=False,
+                   workers=4, on_result=None, engine=None):
+    """Upload the new and changed files of a directory, and keep the album
+    in the order of the file paths
+
+    :param imgur: Connected Imgur instance
+    :type imgur: Imgur
+    :param directory: Directory path
+    :type directory: str
+    :param album_id: Album id
+    :type album_id: str
+    :param delete_remote: Delete the remote images of the files which are
+     gone or replaced
+    :type delete_remote: bool
+    :param workers: Number of concurrent uploads
+    :type workers: int
+    :param on_result: Called with each upload result record
+    :type on_result: function
+    :param engine: Upload engine, by default a `UploadEngine` of `workers`
+     uploads
+    :type engine: UploadEngine
+    :return: Number of (uploaded, removed, failed) files
+    :rtype: tuple
+    """
+    index = load_index(directory)
+    files = scan_directory(directory)
+    uploads, removed = plan_sync(directory, index, files)
+    entries = index['files']
+    album_changed = index.get('album') != album_id
+    if not uploads and not removed and not album_changed:
+        save_index(directory, index)
+        return 0, 0, 0
+
+    imgur.ensure_tokens()
+    stale_ids = [entries[relpath]['id'] for relpath in removed]
+    for relpath in removed:
+        del entries[relpath]
+
+    jobs = [
+        {'path': os.path.join(directory, relpath)} for relpath, _ in uploads
+    ]
+    failed = []
+
+    def update_entry(record):
+        relpath, file_hash = uploads[record['index']]
+        if record['error'] is None:
+            old_entry = entries.get(relpath)
+            if old_entry:
+                stale_ids.append(old_entry['id'])
+            size, mtime = files[relpath]
+            entries[relpath] = {
+                'size': size,
+                'mtime': mtime,
+                'hash': file_hash,
+                'id': record['id'],
+                'deletehash': record['deletehash'],
+            }
+        else:
+            failed.append(relpath)
+        if on_result is not None:
+            on_result(record)
+
+    if jobs:
+        engine = engine or UploadEngine(imgur, workers)
+        # The files too large or empty fail without being sent
+        engine.run(check_jobs(jobs), update_entry)
+    # Save the uploads before touching the album, so they are never lost
+    save_index(directory, index)
+
+    ids = [entries[relpath]['id'] for relpath in sorted(entries)]
+    if ids:
+        imgur.request_album_set_images(album_id, ids)
+    else:
+        # The album can't be emptied by setting its images
+        logger.warning(
+            'No image left in %s, the album %s is not changed',
+            directory, album_id
+        )
+    index['album'] = album_id
+    save_index(directory, index)
+
+    if delete_remote and stale_ids:
+        results = run_concurrently(imgur.request_image_delete, stale_ids,
+                                   workers)
+        for image_id, (_, error) in zip(stale_ids, results):
+            if error is not None:
+                logger.error('Delete %s fail: %s', image_id, error)
+    return len(uploads) - len(failed), len(removed), len(failed)
@@ -0,0 +1,983 @@
+# -*- coding: utf-8 -*-
+"""A local stand-in of the Imgur API, for the tests and the benchmarks
+
+`FakeImgur` is a HTTP(S) server implementing the part of the API used by
+imgurup, with the JSON of Imgur (`data`, `success` and `status`):
+
+- `POST /3/image`: upload a image (multipart), `POST /3/image/{id}` update
+  it, `DELETE /3/image/{id}` delete it
+- `GET /3/account/{account}/albums[/{page}]`, `GET /3/account/me/images/
+  {page}`
+- `POST /3/album` create a album, `POST /3/album/{id}/add` add images,
+  `POST /3/album/{id}` set its images, `DELETE /3/album/{id}` delete it,
+  `GET /3/album/{id}/images`
+- `POST /oauth2/token`: get tokens with a PIN or a refresh token
+
+The connections are kept alive, the responses can be slowed down by a
+latency and a bandwidth, and they have the rate limit headers of Imgur.
+Point a instance to it with `Imgur.connect(server.url)`::
+
+    with FakeImgur(latency=0.05) as server:
+        imgur = CLIImgur()
+        imgur.connect(server.url)
+        server.set_tokens(imgur)
+        imgur.upload_image('a.jpg')
+
+Failures are scripted per request with `FakeImgur.inject()`, see
+`FAULTS`::
+
+    server.inject('server_error', path='/3/image', times=3, status=502)
+    server.inject('drop_response')
+
+The counters of the server (`connections`, `bytes_received`, `bytes_sent`,
+`fault:<mode>`) give what each failure costs.
+
+`python -m imgurup.testing` runs a server in the foreground, it prints its
+URL and tokens as a JSON line, see `main()`.
+"""
+
+import re
+import sys
+import json
+import argparse
+import time
+import random
+import socket
+import string
+import threading
+from collections import OrderedDict
+
+if sys.version_info >= (3,):
+    from http.server import BaseHTTPRequestHandler
+    from http.server import HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qsl
+else:
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from BaseHTTPServer import HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qsl
+
+# Items of a page of the account albums and images
+PAGE_SIZE = 50
+# Default limits of the rate limit headers
+RATE_LIMITS = {'client': 12500, 'user': 2000, 'post': 1250}
+# Seconds before the rate limits are reset
+RATE_LIMIT_RESET = 3600
+# Bytes read or written at once when the bandwidth is limited
+CHUNK_SIZE = 16 * 1024
+
+# Mode -> its options
+FAULTS = {
+    # Close the connection after reading half of the request body
+    'drop_request': (),
+    # Handle the request, then close the connection in the middle of the
+    # response body: the client does not know if it succeeded
+    'drop_response': (),
+    # Answer a invalid status line (BadStatusLine) and close
+    'garbage': ('data',),
+    # Expire the access tokens and answer 401
+    'unauthorized': (),
+    # Answer 429 with the reset headers, in seconds
+    'rate_limit': ('reset',),
+    # Answer a 5xx status, 503 by default, use `times` for a burst
+    'server_error': ('status',),
+    # Handle the request and send the response one byte every `interval`
+    # seconds (0.1 by default)
+    'trickle': ('interval',),
+    # Read the request and never answer, until the server stops or `hold`
+    # seconds
+    'half_open': ('hold',),
+}
+# Faults sending the real response of the request
+RESPONSE_FAULTS = ('drop_response', 'trickle')
+
+EXTENSIONS = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/gif': '.gif',
+    'image/webp': '.webp',
+    'image/tiff': '.tiff',
+}
+
+
+def random_id(length=7):
+    return ''.join(
+        random.choice(string.ascii_letters + string.digits)
+        for i in range(length)
+    )
+
+
+def parse_multipart(body, content_type):
+    """Parse a multipart/form-data body
+
+    :param body: Request body
+    :type body: bytes
+    :param content_type: Content-Type header with the boundary
+    :type content_type: str
+    :return: name -> (value, filename, content type), value is bytes for a
+     file and str for a field
+    :rtype: dict
+    """
+    match = re.search(r'boundary=("?)([^";]+)\1', content_type or '')
+    if match is None:
+        raise ValueError('No boundary')
+    delimiter = b'--' + match.group(2).encode('ascii')
+    fields = {}
+    for part in body.split(delimiter)[1:]:
+        if part.startswith(b'--'):
+            break
+        head, _, value = part[2:].partition(b'\r\n\r\n')
+        if value.endswith(b'\r\n'):
+            value = value[:-2]
+        headers = head.decode('utf-8')
+        name = re.search(r'name="([^"]*)"', headers)
+        if name is None:
+            continue
+        filename = re.search(r'filename="([^"]*)"', headers)
+        part_type = re.search(r'Content-Type: *(\S+)', headers, re.I)
+        if filename is None:
+            fields[name.group(1)] = (value.decode('utf-8'), None, None)
+        else:
+            fields[name.group(1)] = (
+                value,
+                filename.group(1),
+                part_type.group(1) if part_type else None
+            )
+    return fields
+
+
+class Fault(object):
+    """A failure injected into the next matching requests
+    """
+
+    def __init__(self, mode, method=None, path=None, times=1, **options):
+        """
+        :param mode: One of `FAULTS`
+        :type mode: str
+        :param method: HTTP method of the requests, None for all
+        :type method: str
+        :param path: Regex matching the path of the requests, None for all
+        :type path: str
+        :param times: Number of requests failed, None for all
+        :type times: int
+        :param options: Options of the mode, see `FAULTS`
+        """
+        if mode not in FAULTS:
+            raise ValueError('Unknown fault: {mode}'.format(mode=mode))
+        unknown = set(options) - set(FAULTS[mode])
+        if unknown:
+            raise ValueError('Unknown options of {mode}: {options}'.format(
+                mode=mode, options=', '.join(sorted(unknown))
+            ))
+        self.mode = mode
+        self.method = method
+        self.path = path
+        self.times = times
+        self.options = options
+
+    def matches(self, method, path):
+        return (
+            (self.method is None or self.method == method) and
+            (self.path is None or re.search(self.path, path) is not None)
+        )
+
+
+class APIError(Exception):
+    """An error response of the fake API"""
+
+    def __init__(self, status, message):
+        super(APIError, self).__init__(message)
+        self.status = status
+        self.message = message
+
+
+class FakeImgurHandler(BaseHTTPRequestHandler):
+    """Handle the requests of a `FakeImgur` server
+    """
+    protocol_version = 'HTTP/1.1'
+    # Send the headers and the body without waiting for a ACK
+    disable_nagle_algorithm = True
+    # (method, regex of the path, name of the method)
+    routes = (
+        ('POST', r'^/3/image$', 'upload_image'),
+        ('POST', r'^/3/image/([^/]+)$', 'update_image'),
+        ('DELETE', r'^/3/image/([^/]+)$', 'delete_image'),
+        ('GET', r'^/3/account/([^/]+)/albums(?:/(\d+))?$', 'list_albums'),
+        ('GET', r'^/3/account/me/images(?:/(\d+))?$', 'list_images'),
+        ('POST', r'^/3/album$', 'create_album'),
+        ('POST', r'^/3/album/([^/]+)/add$', 'add_album_images'),
+        ('POST', r'^/3/album/([^/]+)$', 'set_album_images'),
+        ('DELETE', r'^/3/album/([^/]+)$', 'delete_album'),
+        ('GET', r'^/3/album/([^/]+)/images$', 'list_album_images'),
+        ('POST', r'^/oauth2/token$', 'request_tokens'),
+    )
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.fake = self.server.fake
+        self.fake.count('connections')
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_api_request('GET')
+
+    def do_POST(self):
+        self.handle_api_request('POST')
+
+    def do_DELETE(self):
+        self.handle_api_request('DELETE')
+
+    def read_body(self, length=None):
+        """Read the request body
+
+        :param length: Bytes to read, None for the whole body
+        :type length: int
+        :rtype: bytes
+        """
+        if length is None:
+            length = int(self.headers.get('Content-Length') or 0)
+        # The middle of a body larger than `max_body` is dropped
+        limit = self.fake.max_body
+        chunks = []
+        tail = b''
+        kept = 0
+        while length > 0:
+            chunk = self.rfile.read(min(length, CHUNK_SIZE))
+            if not chunk:
+                break
+            self.fake.count('bytes_received', len(chunk))
+            self.fake.throttle(len(chunk))
+            if limit is None or kept < limit // 2:
+                chunks.append(chunk)
+                kept += len(chunk)
+            else:
+                tail = (tail + chunk)[-(limit - limit // 2):]
+            length -= len(chunk)
+        chunks.append(tail)
+        return b''.join(chunks)
+
+    def get_form(self):
+        """Fields of a urlencoded or multipart body"""
+        body = self.body
+        content_type = self.headers.get('Content-Type') or ''
+        if content_type.startswith('multipart/form-data'):
+            try:
+                return parse_multipart(body, content_type)
+            except ValueError as e:
+                raise APIError(400, str(e))
+        return dict(
+            (name, (value, None, None))
+            for name, value in parse_qsl(body.decode('utf-8'))
+        )
+
+    def get_ids(self, form_items):
+        """Image ids of a album request, given as ids or deletehashes"""
+        ids = []
+        for name, value in form_items:
+            if name in ('ids[]', 'ids'):
+                ids.append(value)
+            elif name == 'deletehashes[]':
+                image = self.fake.find_image(value)
+                if image is not None:
+                    ids.append(image['id'])
+        return ids
+
+    def get_form_items(self):
+        return parse_qsl(self.body.decode('utf-8'))
+
+    def check_auth(self):
+        auth = self.headers.get('Authorization') or ''
+        if auth.startswith('Bearer '):
+            if auth[len('Bearer '):] not in self.fake.access_tokens:
+                raise APIError(403, 'The access token provided is invalid.')
+            return 'user'
+        if auth.startswith('Client-ID '):
+            return 'anonymous'
+        raise APIError(401, 'Authentication required')
+
+    def handle_api_request(self, method):
+        path = self.path.split('?')[0]
+        self.fake.record(method, path)
+        fault = self.fake.take_fault(method, path)
+        if fault is not None and fault.mode == 'drop_request':
+            length = int(self.headers.get('Content-Length') or 0)
+            self.read_body(length // 2)
+            self.abort()
+            return
+        self.body = self.read_body()
+        if fault is not None and fault.mode not in RESPONSE_FAULTS:
+            self.inject_fault(fault, method, path)
+            return
+        status, body, content_type, headers = self.get_api_response(
+            method, path
+        )
+        self.fake.wait()
+        if fault is None:
+            self.send_body(status, body, content_type, headers)
+        elif fault.mode == 'drop_response':
+            # The request succeeded, but the client does not know it
+            self.send_body(
+                status, body, content_type, headers, limit=len(body) // 2
+            )
+            self.abort()
+        else:
+            self.send_body(
+                status, body, content_type, headers,
+                trickle=fault.options.get('interval', 0.1)
+            )
+
+    def abort(self):
+        """Close the connection at once"""
+        self.close_connection = True
+        try:
+            self.wfile.flush()
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+    def get_error_body(self, status, message, method, path):
+        return json.dumps({
+            'data': {'error': message, 'request': path, 'method': method},
+            'success': False,
+            'status': status
+        }).encode('utf-8')
+
+    def inject_fault(self, fault, method, path):
+        """Answer with a fault instead of the API response"""
+        options = fault.options
+        if fault.mode == 'garbage':
+            data = options.get('data', b'\x00garbage\r\n\r\n')
+            self.fake.count('bytes_sent', len(data))
+            self.wfile.write(data)
+            self.abort()
+        elif fault.mode == 'half_open':
+            # Never answer, until the server stops or `hold` seconds
+            self.fake.stopping.wait(options.get('hold'))
+            self.abort()
+        else:
+            headers = {}
+            if fault.mode == 'unauthorized':
+                self.fake.expire_tokens()
+                status = 401
+                message = 'The access token provided has expired.'
+            elif fault.mode == 'rate_limit':
+                status = 429
+                message = 'Too Many Requests'
+                reset = options.get('reset', 60)
+                headers.update({
+                    'Retry-After': reset,
+                    'X-RateLimit-UserRemaining': 0,
+                    'X-RateLimit-UserReset': int(time.time()) + reset,
+                    'X-Post-Rate-Limit-Remaining': 0,
+                    'X-Post-Rate-Limit-Reset': reset,
+                })
+            else:
+                status = options.get('status', 503)
+                message = 'Imgur is temporarily over capacity.'
+            self.fake.wait()
+            self.send_body(
+                status,
+                self.get_error_body(status, message, method, path),
+                'application/json',
+                headers
+            )
+
+    def get_api_response(self, method, path):
+        """Handle a request of the API
+
+        :return: (status, body, content type, headers)
+        :rtype: tuple
+        """
+        headers = {}
+        try:
+            self.fake.use_rate_limit(
+                'post' if method == 'POST' and path == '/3/image' else None,
+                headers
+            )
+            for route_method, pattern, name in self.routes:
+                match = re.match(pattern, path)
+                if route_method == method and match:
+                    data = getattr(self, name)(*match.groups())
+                    break
+            else:
+                data = self.fake.get_file(path)
+                if data is not None:
+                    return 200, data[0], data[1], headers
+                raise APIError(404, 'Unable to find the endpoint')
+        except APIError as e:
+            return (
+                e.status,
+                self.get_error_body(e.status, e.message, method, path),
+                'application/json',
+                headers
+            )
+        if not path.startswith('/oauth2/'):
+            data = {'data': data, 'success': True, 'status': 200}
+        return 200, json.dumps(data).encode('utf-8'), 'application/json', \
+            headers
+
+    def send_body(self, status, body, content_type, headers, limit=None,
+                  trickle=None):
+        """Send a response
+
+        :param limit: Bytes of the body sent, None for all
+        :type limit: int
+        :param trickle: Seconds between two bytes, None to send at the
+         bandwidth
+        :type trickle: float
+        """
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in sorted(headers.items()):
+            self.send_header(name, value)
+        self.end_headers()
+        body = body[:limit]
+        chunk_size = 1 if trickle else CHUNK_SIZE
+        for i in range(0, len(body), chunk_size):
+            chunk = body[i:i + chunk_size]
+            self.fake.count('bytes_sent', len(chunk))
+            self.wfile.write(chunk)
+            if trickle:
+                self.wfile.flush()
+                time.sleep(trickle)
+            else:
+                self.fake.throttle(len(chunk))
+
+    def upload_image(self):
+        auth = self.check_auth()
+        form = self.get_form()
+        if 'image' not in form:
+            raise APIError(400, 'No image data was sent to the upload api')
+        value, filename, content_type = form['image']
+
+        def field(name):
+            return form.get(name, (None,))[0]
+        if field('type') == 'url' or filename is None:
+            content = None
+            content_type = 'image/jpeg'
+        else:
+            content = value
+        image = self.fake.add_image(
+            content=content,
+            content_type=content_type or 'image/jpeg',
+            title=field('title'),
+            description=field('description'),
+            anonymous=auth == 'anonymous'
+        )
+        album_id = field('album') or field('album_id')
+        if album_id is not None:
+            album = self.fake.find_album(album_id)
+            if album is None:
+                raise APIError(404, 'Unable to find album ' + album_id)
+            album['images'].append(image['id'])
+        return self.fake.get_image_data(image, deletehash=True)
+
+    def update_image(self, image_id):
+        self.check_auth()
+        image = self.fake.find_image(image_id)
+        if image is None:
+            raise APIError(404, 'Unable to find an image with the id')
+        for name, (value, _, _) in self.get_form().items():
+            if name in ('title', 'description'):
+                image[name] = value
+        return True
+
+    def delete_image(self, image_id):
+        self.check_auth()
+        if not self.fake.remove_image(image_id):
+            raise APIError(404, 'Unable to find an image with the id')
+        return True
+
+    def list_albums(self, account, page=None):
+        self.check_auth()
+        albums = self.fake.get_page(self.fake.albums, page)
+        return [self.fake.get_album_data(album) for album in albums]
+
+    def list_images(self, page=None):
+        if self.check_auth() != 'user':
+            raise APIError(403, 'Permission denied')
+        images = self.fake.get_page(self.fake.images, page)
+        return [self.fake.get_image_data(image) for image in images]
+
+    def create_album(self):
+        auth = self.check_auth()
+        items = self.get_form_items()
+        form = dict(items)
+        album = self.fake.add_album(
+            title=form.get('title'),
+            ids=self.get_ids(items),
+            cover=form.get('cover'),
+            anonymous=auth == 'anonymous'
+        )
+        return {'id': album['id'], 'deletehash': album['deletehash']}
+
+    def _get_album(self, album_id):
+        album = self.fake.find_album(album_id)
+        if album is None:
+            raise APIError(404, 'Unable to find album ' + album_id)
+        return album
+
+    def add_album_images(self, album_id):
+        self.check_auth()
+        album = self._get_album(album_id)
+        album['images'].extend(self.get_ids(self.get_form_items()))
+        return True
+
+    def set_album_images(self, album_id):
+        self.check_auth()
+        album = self._get_album(album_id)
+        album['images'] = self.get_ids(self.get_form_items())
+        return True
+
+    def delete_album(self, album_id):
+        self.check_auth()
+        if not self.fake.remove_album(album_id):
+            raise APIError(404, 'Unable to find album ' + album_id)
+        return True
+
+    def list_album_images(self, album_id):
+        self.check_auth()
+        album = self._get_album(album_id)
+        return [
+            self.fake.get_image_data(self.fake.images[image_id])
+            for image_id in album['images'] if image_id in self.fake.images
+        ]
+
+    def request_tokens(self):
+        form = dict(self.get_form_items())
+        grant_type = form.get('grant_type')
+        if grant_type == 'refresh_token':
+            if form.get('refresh_token') not in self.fake.refresh_tokens:
+                raise APIError(400, 'Invalid refresh token')
+        elif grant_type != 'pin':
+            raise APIError(400, 'Invalid grant_type parameter')
+        return self.fake.new_tokens()
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeImgur(object):
+    """A local fake Imgur API server running in a background thread
+    """
+
+    handler_class = FakeImgurHandler
+
+    def __init__(self, latency=0, bandwidth=None, rate_limits=None,
+                 keep_content=False, max_body=None, certfile=None,
+                 keyfile=None, host='127.0.0.1', port=0):
+        """
+        :param latency: Seconds waited before each response
+        :type latency: float
+        :param bandwidth: Bytes per second of the request and response
+         bodies of each connection, None for no limit
+        :type bandwidth: float
+        :param rate_limits: `client`, `user` and `post` -> number of
+         requests before 429 responses, see `RATE_LIMITS`
+        :type rate_limits: dict
+        :param keep_content: Keep the uploaded files, served at their link
+        :type keep_content: bool
+        :param max_body: Bytes kept of a request body, the middle of a
+         larger body is read and dropped so the memory of the server does
+         not grow with the uploads (the start and the end of the image are
+         kept), None for no limit
+        :type max_body: int
+        :param certfile: Certificate of HTTPS, None for HTTP
+        :type certfile: str
+        :param keyfile: Private key of the certificate
+        :type keyfile: str
+        :param host: Address to listen on
+        :type host: str
+        :param port: Port, 0 for any free port
+        :type port: int
+        """
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.keep_content = keep_content
+        self.max_body = max_body
+        self.rate_limits = dict(RATE_LIMITS, **(rate_limits or {}))
+        self.remaining = dict(self.rate_limits)
+        self.rate_limit_reset = int(time.time()) + RATE_LIMIT_RESET
+        # Id -> image, in the upload order
+        self.images = OrderedDict()
+        # Id -> album, in the creation order
+        self.albums = OrderedDict()
+        # (method, path) of each request
+        self.requests = []
+        # Name -> count, ex: `connections`
+        self.counters = {}
+        # Faults of the next requests, in the injection order
+        self.faults = []
+        # Set when the server stops, releases the half open requests
+        self.stopping = threading.Event()
+        self.access_tokens = set()
+        self.refresh_tokens = set()
+        self.access_token = None
+        self.refresh_token = None
+        self.new_tokens()
+        self._lock = threading.RLock()
+        self._server = _Server((host, port), self.handler_class)
+        self._server.fake = self
+        scheme = 'http'
+        if certfile is not None:
+            import ssl
+            # PROTOCOL_TLS_SERVER is new in Python 3.6
+            context = ssl.SSLContext(
+                getattr(ssl, 'PROTOCOL_TLS_SERVER', ssl.PROTOCOL_SSLv23)
+            )
+            context.load_cert_chain(certfile, keyfile)
+            self._server.socket = context.wrap_socket(
+                self._server.socket, server_side=True
+            )
+            scheme = 'https'
+        self.url = '{scheme}://{host}:{port}'.format(
+            scheme=scheme,
+            host=self._server.server_address[0],
+            port=self._server.server_address[1]
+        )
+        self._thread = None
+
+    def start(self):
+        """Serve in a background thread
+
+        :return: self
+        :rtype: FakeImgur
+        """
+        # Check often for stop()
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, args=(0.05,)
+        )
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and close the socket"""
+        self.stopping.set()
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def set_tokens(self, imgur):
+        """Give the current tokens to a Imgur instance, so it does not ask
+        for a authorization
+
+        :param imgur: Imgur instance
+        :type imgur: imgurup.Imgur
+        """
+        imgur._access_token = self.access_token
+        imgur._refresh_token = self.refresh_token
+
+    def new_tokens(self):
+        """Create new tokens, the previous ones stay valid
+
+        :return: Response of `/oauth2/token`
+        :rtype: dict
+        """
+        self.access_token = random_id(40)
+        self.refresh_token = random_id(40)
+        self.access_tokens.add(self.access_token)
+        self.refresh_tokens.add(self.refresh_token)
+        return {
+            'access_token': self.access_token,
+            'refresh_token': self.refresh_token,
+            'expires_in': 315360000,
+            'token_type': 'bearer',
+            'account_username': 'imgurup',
+            'account_id': 1,
+        }
+
+    def expire_tokens(self):
+        """Make the access tokens invalid, the refresh tokens stay valid"""
+        self.access_tokens.clear()
+
+    def inject(self, mode, method=None, path=None, times=1, **options):
+        """Fail the next requests matching `method` and `path`, the
+        faults are applied in their injection order
+
+        :param mode: One of `FAULTS`
+        :type mode: str
+        :return: The fault, its `times` is decreased by each failed request
+        :rtype: Fault
+        """
+        fault = Fault(mode, method, path, times, **options)
+        with self._lock:
+            self.faults.append(fault)
+        return fault
+
+    def take_fault(self, method, path):
+        """Take the fault of a request
+
+        :return: The fault, None to handle the request normally
+        :rtype: Fault
+        """
+        with self._lock:
+            for fault in self.faults:
+                if fault.matches(method, path):
+                    if fault.times is not None:
+                        fault.times -= 1
+                        if fault.times <= 0:
+                            self.faults.remove(fault)
+                    self.count('fault:' + fault.mode)
+                    return fault
+        return None
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def record(self, method, path):
+        with self._lock:
+            self.requests.append((method, path))
+
+    def wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def throttle(self, size):
+        """Wait for the transfer of `size` bytes at the bandwidth"""
+        if self.bandwidth:
+            time.sleep(float(size) / self.bandwidth)
+
+    def use_rate_limit(self, post, headers):
+        """Count a request and set its rate limit headers
+
+        :param post: `post` for a upload
+        :type post: str
+        :param headers: Response headers
+        :type headers: dict
+        :raise APIError: 429 if a limit is reached
+        """
+        with self._lock:
+            exceeded = False
+            for kind in ('client', 'user', post):
+                if kind is None:
+                    continue
+                if self.remaining[kind] <= 0:
+                    exceeded = True
+                else:
+                    self.remaining[kind] -= 1
+            headers.update({
+                'X-RateLimit-ClientLimit': self.rate_limits['client'],
+                'X-RateLimit-ClientRemaining': self.remaining['client'],
+                'X-RateLimit-UserLimit': self.rate_limits['user'],
+                'X-RateLimit-UserRemaining': self.remaining['user'],
+                'X-RateLimit-UserReset': self.rate_limit_reset,
+            })
+            if post is not None:
+                headers.update({
+                    'X-Post-Rate-Limit-Limit': self.rate_limits['post'],
+                    'X-Post-Rate-Limit-Remaining': self.remaining['post'],
+                    'X-Post-Rate-Limit-Reset': max(
+                        0, self.rate_limit_reset - int(time.time())
+                    ),
+                })
+        if exceeded:
+            raise APIError(429, 'Too Many Requests')
+
+    def add_image(self, content=None, content_type='image/jpeg', title=None,
+                  description=None, anonymous=False, size=None):
+        """Add a image, as if it was uploaded
+
+        :param content: Content of the file, None for a upload by URL
+        :type content: bytes
+        :return: The image
+        :rtype: dict
+        """
+        with self._lock:
+            image_id = random_id()
+            while image_id in self.images:
+                image_id = random_id()
+            extension = EXTENSIONS.get(content_type, '.jpg')
+            image = {
+                'id': image_id,
+                'deletehash': random_id(15),
+                'title': title,
+                'description': description,
+                'datetime': int(time.time()),
+                'type': content_type,
+                'animated': content_type == 'image/gif',
+                'size': len(content) if content is not None else size or 0,
+                'views': 0,
+                'account_id': None if anonymous else 1,
+                'link': '{url}/{id}{ext}'.format(
+                    url=self.url, id=image_id, ext=extension
+                ),
+            }
+            if self.keep_content and content is not None:
+                image['content'] = content
+            self.images[image_id] = image
+            return image
+
+    def find_image(self, key):
+        """Find a image by its id or deletehash"""
+        with self._lock:
+            if key in self.images:
+                return self.images[key]
+            for image in self.images.values():
+                if image['deletehash'] == key:
+                    return image
+        return None
+
+    def remove_image(self, key):
+        with self._lock:
+            image = self.find_image(key)
+            if image is None:
+                return False
+            del self.images[image['id']]
+            for album in self.albums.values():
+                if image['id'] in album['images']:
+                    album['images'].remove(image['id'])
+            return True
+
+    def get_image_data(self, image, deletehash=False):
+        data = dict(
+            (k, v) for k, v in image.items()
+            if k not in ('content', 'deletehash')
+        )
+        if deletehash:
+            data['deletehash'] = image['deletehash']
+        return data
+
+    def get_file(self, path):
+        """Content and type of a kept file served at its link"""
+        image = self.images.get(path.lstrip('/').split('.')[0])
+        if image is None or 'content' not in image:
+            return None
+        return image['content'], image['type']
+
+    def add_album(self, title=None, ids=(), cover=None, anonymous=False):
+        """Add a album
+
+        :return: The album
+        :rtype: dict
+        """
+        with self._lock:
+            album_id = random_id(5)
+            while album_id in self.albums:
+                album_id = random_id(5)
+            album = {
+                'id': album_id,
+                'deletehash': random_id(15),
+                'title': title,
+                'cover': cover,
+                'privacy': 'public' if anonymous else 'hidden',
+                'datetime': int(time.time()),
+                'images': list(ids),
+            }
+            self.albums[album_id] = album
+            return album
+
+    def find_album(self, key):
+        """Find a album by its id or deletehash"""
+        with self._lock:
+            if key in self.albums:
+                return self.albums[key]
+            for album in self.albums.values():
+                if album['deletehash'] == key:
+                    return album
+        return None
+
+    def remove_album(self, key):
+        with self._lock:
+            album = self.find_album(key)
+            if album is None:
+                return False
+            del self.albums[album['id']]
+            return True
+
+    def get_album_data(self, album):
+        data = dict((k, v) for k, v in album.items() if k != 'images')
+        data['images_count'] = len(album['images'])
+        data['link'] = 'https://imgur.com/a/' + album['id']
+        return data
+
+    def get_page(self, items, page):
+        with self._lock:
+            values = list(items.values())
+        start = int(page or 0) * PAGE_SIZE
+        return values[start:start + PAGE_SIZE]
+
+
+def main(argv=None):
+    """Run a fake server until interrupted, its `url`, `access_token` and
+    `refresh_token` are printed as a JSON line when it is ready
+    """
+    parser = argparse.ArgumentParser(
+        prog='python -m imgurup.testing',
+        description='Local fake Imgur API server'
+    )
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument(
+        '--port', type=int, default=0, help='Port (default: any free port)'
+    )
+    parser.add_argument(
+        '--latency', type=float, default=0,
+        help='Seconds waited before each response', metavar='<seconds>'
+    )
+    parser.add_argument(
+        '--bandwidth', type=float, default=None,
+        help='MB/s of each connection', metavar='<MB/s>'
+    )
+    for kind in sorted(RATE_LIMITS):
+        parser.add_argument(
+            '--{kind}-limit'.format(kind=kind),
+            type=int,
+            default=RATE_LIMITS[kind],
+            help='Requests before 429 (default: {n})'.format(
+                n=RATE_LIMITS[kind]
+            ),
+            metavar='<number>'
+        )
+    parser.add_argument(
+        '--max-body', type=int, default=None,
+        help='Bytes kept of a request body (default: no limit)',
+        metavar='<bytes>'
+    )
+    parser.add_argument('--certfile', default=None, metavar='<file>')
+    parser.add_argument('--keyfile', default=None, metavar='<file>')
+    args = parser.parse_args(argv)
+
+    server = FakeImgur(
+        latency=args.latency,
+        bandwidth=args.bandwidth * 1024 * 1024 if args.bandwidth else None,
+        rate_limits=dict(
+            (kind, getattr(args, kind + '_limit')) for kind in RATE_LIMITS
+        ),
+        max_body=args.max_body,
+        certfile=args.certfile,
+        keyfile=args.keyfile,
+        host=args.host,
+        port=args.port
+    )
+    server.start()
+    print(json.dumps({
+        'url': server.url,
+        'access_token': server.access_token,
+        'refresh_token': server.refresh_token,
+    }))
+    sys.stdout.flush()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""Timed phases of the requests
+
+A `Tracer` added to a Imgur instance with `Imgur.add_tracer()` is told the
+start and the end of every phase of the requests:
+
+- `token_load`: read the tokens from the config file
+- `connect`: TCP and TLS connection
+- `encode`: build the multipart body of a upload
+- `send`: send the request and its body
+- `ttfb`: wait for the status line and the headers of the response
+- `read`: read the body of the response
+- `parse`: parse the JSON of the response
+
+The phases of a upload are tagged with its `path`, `size` and `attempt`
+number. The methods are called in the thread of the request, so a tracer
+shared by the workers of a upload engine must be thread safe.
+
+A tracer is also told the events of the instance, see `EVENTS`, and the
+progress of the bodies of the uploads while they are sent.
+"""
+
+import logging
+import threading
+
+from .engine import get_percentile
+
+logger = logging.getLogger(__name__)
+
+PHASES = ('token_load', 'connect', 'encode', 'send', 'ttfb', 'read', 'parse')
+
+# Event -> its tags
+EVENTS = {
+    # A request failed and is retried
+    'retry': ('function', 'error'),
+    # The access token is refreshed
+    'token_refresh': (),
+    # The tokens are needed, `hit` is False if they are read from the config
+    'token_cache': ('hit',),
+    # Remaining requests given by the headers of a response
+    'rate_limit': ('client', 'user', 'post'),
+}
+
+
+class Tracer(object):
+    """Base class of the tracers, all the methods do nothing
+    """
+
+    def on_phase_start(self, phase, tags):
+        """Called when a phase starts
+
+        :param phase: One of `PHASES`
+        :type phase: str
+        :param tags: `path`, `size` and `attempt` of a upload, empty for
+         the other requests
+        :type tags: dict
+        """
+
+    def on_phase_end(self, phase, seconds, tags):
+        """Called when a phase ends, also if it fails
+
+        :param phase: One of `PHASES`
+        :type phase: str
+        :param seconds: Duration of the phase
+        :type seconds: float
+        :param tags: See `on_phase_start()`
+        :type tags: dict
+        """
+
+    def on_event(self, event, tags):
+        """Called when an event happens
+
+        :param event: One of `EVENTS`
+        :type event: str
+        :param tags: Tags of the event
+        :type tags: dict
+        """
+
+    def on_progress(self, progress, tags):
+        """Called while the body of a upload is sent, at most every
+        `transfer.REPORT_INTERVAL` seconds and when it is fully sent
+
+        :param progress: Progress of the transfer: `sent`, `total`,
+         `rate`, `average` and `eta`
+        :type progress: transfer.TransferProgress
+        :param tags: See `on_phase_start()`
+        :type tags: dict
+        """
+
+    def on_engine(self, engine):
+        """Called when a upload engine is created with the instance
+
+        :param engine: Upload engine
+        :type engine: engine.UploadEngine
+        """
+
+    def on_result(self, record):
+        """Called with each result record of a upload engine
+
+        :param record: Result record, see `engine.UploadEngine.upload()`
+        :type record: dict
+        """
+
+
+def format_duration(seconds):
+    """Format a duration in milliseconds
+
+    :rtype: str
+    """
+    return '{ms:.0f}ms'.format(ms=seconds * 1000)
+
+
+class TimingReport(Tracer):
+    """Collect the durations of all the phases, to show the breakdown of
+    each upload and the percentiles of a batch
+    """
+
+    def __init__(self):
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def on_phase_end(self, phase, seconds, tags):
+        with self._lock:
+            self._samples.setdefault(phase, []).append(seconds)
+
+    def on_result(self, record):
+        logger.info(self.format_record(record))
+
+    def format_record(self, record):
+        """Format the breakdown of a upload
+
+        :param record: Result record
+        :type record: dict
+        :return: ex: `a.jpg (2048 bytes, 1 attempt): encode 1ms, ...`
+        :rtype: str
+        """
+        timings = record.get('timings') or {}
+        phases = [p for p in PHASES if p in timings]
+        phases.extend(sorted(p for p in timings if p not in PHASES))
+        line = '{path} ({size} bytes, {attempts} attempt{s}): {timings}'
+        return line.format(
+            path=record['path'],
+            size=record.get('size') or 0,
+            attempts=record.get('attempts', 0),
+            s='' if record.get('attempts') == 1 else 's',
+            timings=', '.join(
+                '{phase} {duration}'.format(
+                    phase=phase, duration=format_duration(timings[phase])
+                ) for phase in phases
+            ) or 'not sent'
+        )
+
+    def format_summary(self):
+        """Format the percentiles of every phase
+
+        :return: One line per phase
+        :rtype: list of str
+        """
+        with self._lock:
+            samples = dict(
+                (phase, list(values))
+                for phase, values in self._samples.items()
+            )
+        lines = []
+        for phase in PHASES:
+            values = samples.get(phase)
+            if not values:
+                continue
+            lines.append(
+                '{phase}: n={n} p50={p50} p95={p95} p99={p99} '
+                'max={max}'.format(
+                    phase=phase,
+                    n=len(values),
+                    p50=format_duration(get_percentile(values, 50)),
+                    p95=format_duration(get_percentile(values, 95)),
+                    p99=format_duration(get_percentile(values, 99)),
+                    max=format_duration(max(values))
+                )
+            )
+        return lines
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""Bodies of the uploads, read from the disk as they are sent
+
+The multipart body of a upload is a list of parts, the image is read by
+blocks while the connection sends the body instead of being loaded in
+memory. The reads tell a callback the number of bytes sent, so the
+progress of a upload is known before its response arrives, see
+`TransferProgress`.
+"""
+
+import os
+import time
+
+# Bytes read at once from the image, the connection asks for smaller blocks
+BLOCK_SIZE = 64 * 1024
+# Seconds between two progress reports of a transfer
+REPORT_INTERVAL = 0.2
+# Weight of the last interval in the instantaneous rate
+RATE_SMOOTHING = 0.3
+
+
+class MultipartBody(object):
+    """A request body made of byte strings and files, with the file
+    interface used by `httplib` to send it
+    """
+
+    def __init__(self, parts):
+        """
+        :param parts: Byte strings, and file paths as `('file', path)`
+        :type parts: list
+        """
+        self._parts = parts
+        self._length = sum(
+            os.path.getsize(part[1]) if isinstance(part, tuple)
+            else len(part)
+            for part in parts
+        )
+        self._callback = None
+        self.rewind()
+
+    def __len__(self):
+        return self._length
+
+    def rewind(self, callback=None):
+        """Go back to the start, to send the body again
+
+        :param callback: Called with the number of bytes read so far after
+         each read
+        :type callback: function
+        """
+        self._close_file()
+        self._callback = callback
+        self._index = 0
+        self._sent = 0
+
+    def _close_file(self):
+        fp = getattr(self, '_fp', None)
+        if fp is not None:
+            fp.close()
+        self._fp = None
+
+    def read(self, size=-1):
+        """Read the next block, at least `size` bytes except at the end
+
+        :param size: Bytes to read, -1 for all the remaining body
+        :type size: int
+        :rtype: bytes
+        """
+        if size is None or size < 0:
+            size = self._length
+        size = max(size, BLOCK_SIZE)
+        chunks = []
+        length = 0
+        while length < size and self._index < len(self._parts):
+            part = self._parts[self._index]
+            if isinstance(part, tuple):
+                if self._fp is None:
+                    self._fp = open(part[1], 'rb')
+                chunk = self._fp.read(size - length)
+                if not chunk:
+                    self._close_file()
+                    self._index += 1
+                    continue
+            else:
+                chunk = part
+                self._index += 1
+            chunks.append(chunk)
+            length += len(chunk)
+        self._sent += length
+        if self._callback is not None and length:
+            self._callback(self._sent)
+        return b''.join(chunks)
+
+    def getvalue(self):
+        """Read the whole body, from the start
+
+        :rtype: bytes
+        """
+        self.rewind()
+        value = self.read()
+        self.rewind()
+        return value
+
+
+class TransferProgress(object):
+    """Bytes sent of a transfer, its rates and its remaining time
+    """
+
+    def __init__(self, total, clock=time.time):
+        """
+        :param total: Bytes to send
+        :type total: int
+        :param clock: Function returning the current time in seconds
+        :type clock: function
+        """
+        self.total = total
+        self.sent = 0
+        # Bytes per second over the last intervals
+        self.rate = None
+        self._clock = clock
+        self.started = self._last_time = clock()
+        self._last_sent = 0
+
+    @property
+    def done(self):
+        return self.sent >= self.total
+
+    @property
+    def average(self):
+        """Bytes per second since the start, None at the start"""
+        seconds = self._last_time - self.started
+        if seconds <= 0:
+            return None
+        return self.sent / seconds
+
+    @property
+    def eta(self):
+        """Seconds before the end at the current rate, None if unknown"""
+        if self.done:
+            return 0
+        if not self.rate:
+            return None
+        return (self.total - self.sent) / self.rate
+
+    def update(self, sent):
+        """Count the bytes sent, the rates are updated at most every
+        `REPORT_INTERVAL` seconds so it is cheap to call after each block
+
+        :param sent: Bytes sent so far
+        :type sent: int
+        :return: True if the progress should be reported
+        :rtype: bool
+        """
+        self.sent = sent
+        now = self._clock()
+        seconds = now - self._last_time
+        if seconds < REPORT_INTERVAL and not self.done:
+            return False
+        if seconds > 0:
+            rate = (sent - self._last_sent) / seconds
+            if self.rate is None:
+                self.rate = rate
+            else:
+                self.rate += RATE_SMOOTHING * (rate - self.rate)
+        self._last_time = now
+        self._last_sent = sent
+        return True
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""Watch a directory and report the files which are completely written
+
+inotify is used on Linux (through ctypes, no dependency needed), the
+directory is polled on the other platforms.
+"""
+
+import os
+import sys
+import time
+import select
+import struct
+import logging
+import threading
+
+if sys.version_info >= (3,):
+    import queue
+else:
+    import Queue as queue
+
+logger = logging.getLogger(__name__)
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_EVENT_HEADER = struct.Struct('iIII')
+
+# Files being written by browsers, editors and copy tools
+IGNORED_SUFFIXES = ('~', '.part', '.crdownload', '.tmp', '.swp')
+
+
+def _load_libc():
+    """Load the libc if it supports inotify
+
+    :return: libc, None if inotify is not available
+    """
+    try:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(
+            ctypes.util.find_library('c') or 'libc.so.6',
+            use_errno=True
+        )
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (ImportError, OSError, AttributeError):
+        return None
+    return libc
+
+
+def is_ignored(name):
+    """Check if the file should not be uploaded
+
+    :param name: File name
+    :type name: str
+    :rtype: bool
+    """
+    return name.startswith('.') or name.endswith(IGNORED_SUFFIXES)
+
+
+class DirectoryWatcher(object):
+    """Iterate over the new files of a directory, forever.
+
+    A file is reported once it stops changing: its size and mtime have not
+    changed during `debounce` seconds after the last write (or close-write
+    event with inotify). The events are read by a background thread into an
+    unbounded queue, so a burst of files is never dropped even if the
+    consumer is slow. The files already in the directory are ignored.
+    """
+
+    def __init__(self, directory, debounce=1.0, interval=1.0,
+                 use_inotify=True):
+        """
+        :param directory: The directory to watch
+        :type directory: str
+        :param debounce: Seconds a file must stay unchanged
+        :type debounce: float
+        :param interval: Seconds between two scans when polling
+        :type interval: float
+        :param use_inotify: Use inotify if it's available
+        :type use_inotify: bool
+        """
+        self._directory = directory
+        self._debounce = debounce
+        self._interval = interval
+        self._ready = queue.Queue()
+        # path -> (deadline, size, mtime)
+        self._pending = {}
+        # path -> (size, mtime) of the files already reported
+        self._seen = {}
+        self._closed = threading.Event()
+        self._fd = None
+
+        for path, stat in self._list():
+            self._seen[path] = stat
+        libc = _load_libc() if use_inotify else None
+        if libc is not None:
+            self._fd = self._init_inotify(libc)
+        if self._fd is None:
+            logger.info('Watch %s by polling', directory)
+            target = self._poll
+        else:
+            logger.info('Watch %s with inotify', directory)
+            target = self._read_events
+        self._thread = threading.Thread(target=target)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _init_inotify(self, libc):
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            return None
+        path = self._directory
+        if not isinstance(path, bytes):
+            path = path.encode(sys.getfilesystemencoding())
+        wd = libc.inotify_add_watch(fd, path, IN_CLOSE_WRITE | IN_MOVED_TO)
+        if wd < 0:
+            os.close(fd)
+            return None
+        return fd
+
+    def _stat(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if not os.path.isfile(path):
+            return None
+        return stat.st_size, stat.st_mtime
+
+    def _list(self):
+        for name in os.listdir(self._directory):
+            if is_ignored(name):
+                continue
+            path = os.path.join(self._directory, name)
+            stat = self._stat(path)
+            if stat is not None:
+                yield path, stat
+
+    def _touch(self, path, stat=None):
+        """Wait for the file to stay unchanged, then report it"""
+        if stat is None:
+            stat = self._stat(path)
+        if stat is None or self._seen.get(path) == stat:
+            return
+        pending = self._pending.get(path)
+        if pending is None or pending[1:] != stat:
+            self._pending[path] = (time.time() + self._debounce,) + stat
+
+    def _check_pending(self):
+        now = time.time()
+        for path, (deadline, size, mtime) in list(self._pending.items()):
+            if deadline > now:
+                continue
+            stat = self._stat(path)
+            if stat is None:
+                del self._pending[path]
+            elif stat != (size, mtime):
+                self._pending[path] = (now + self._debounce,) + stat
+            else:
+                del self._pending[path]
+                self._seen[path] = stat
+                self._ready.put(path)
+
+    def _scan(self):
+        for path, stat in self._list():
+            self._touch(path, stat)
+
+    def _poll(self):
+        while not self._closed.is_set():
+            self._scan()
+            self._check_pending()
+            self._closed.wait(min(self._interval, self._debounce or 0.1))
+
+    def _read_events(self):
+        fsencoding = sys.getfilesystemencoding()
+        timeout = max(0.05, min(self._interval, self._debounce) / 2.0)
+        try:
+            while not self._closed.is_set():
+                readable = select.select([self._fd], [], [], timeout)[0]
+                if readable:
+                    self._handle_events(os.read(self._fd, 65536), fsencoding)
+                self._check_pending()
+        except (OSError, select.error) as e:
+            if not self._closed.is_set():
+                logger.error('inotify error: %s', e)
+        finally:
+            os.close(self._fd)
+
+    def _handle_events(self, buf, fsencoding):
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(buf):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(buf, offset)
+            offset += _EVENT_HEADER.size
+            name = buf[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # Some events were lost by the kernel, so look at everything
+                logger.warning('inotify queue overflow, rescan %s',
+                               self._directory)
+                self._scan()
+                continue
+            if not name:
+                continue
+            if not isinstance(name, str):
+                name = name.decode(fsencoding)
+            if not is_ignored(name):
+                self._touch(os.path.join(self._directory, name))
+
+    def __iter__(self):
+        while not self._closed.is_set():
+            try:
+                yield self._ready.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+    def close(self):
+        """Stop watching, the iteration ends"""
+        self._closed.set()
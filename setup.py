@@ -17,6 +17,7 @@ setup(
     entry_points={
         'console_scripts': [
             'img = imgurup:main',
+            'imgurup-loadtest = imgurup.loadtest:main',
         ]
     },
 
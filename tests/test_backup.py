@@ -0,0 +1,101 @@
+from __future__ import unicode_literals
+
+import os
+import json
+import threading
+
+import mock
+import pytest
+
+try:
+    from http.server import HTTPServer
+    from http.server import BaseHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer
+    from BaseHTTPServer import BaseHTTPRequestHandler
+
+from imgurup.backup import backup_account
+from imgurup.backup import get_file_name
+from imgurup.backup import iter_pages
+
+
+FILES = {
+    '/aaaaaaa.jpg': b'a' * 100000,
+    '/bbbbbbb.png': b'b' * 10,
+}
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        body = FILES.get(self.path)
+        if body is None:
+            self.send_response(404)
+            body = b''
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope='function')
+def server(request):
+    httpd = HTTPServer(('127.0.0.1', 0), FileHandler)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    FileHandler.requests = []
+    request.addfinalizer(httpd.shutdown)
+    return 'http://127.0.0.1:{port}'.format(port=httpd.server_address[1])
+
+
+def test_iter_pages():
+    pages = [[1, 2], [3], []]
+    assert list(iter_pages(lambda page: pages[page])) == [1, 2, 3]
+
+
+def test_get_file_name():
+    image = {'id': 'xxxxxxx', 'link': 'http://i.imgur.com/xxxxxxx.jpg'}
+    assert get_file_name(image) == 'xxxxxxx.jpg'
+
+
+def test_backup_account(tmpdir, server):
+    images = [
+        {'id': 'aaaaaaa', 'link': server + '/aaaaaaa.jpg', 'size': 100000},
+        {'id': 'bbbbbbb', 'link': server + '/bbbbbbb.png', 'size': 10},
+        {'id': 'ccccccc', 'link': server + '/ccccccc.gif', 'size': 1},
+    ]
+    imgur = mock.Mock()
+    imgur.request_account_images.side_effect = (
+        lambda page: images[:2] if page == 0 else []
+    )
+    imgur.request_album_list.side_effect = (
+        lambda page: [{'id': 'XXXXX', 'title': 'temp'}] if page == 0 else []
+    )
+    imgur.request_album_images.return_value = images[1:]
+    results = []
+
+    outdir = str(tmpdir)
+    assert backup_account(
+        imgur, outdir, 2, lambda image, error: results.append(error)
+    ) == (2, 0, 1)
+    assert len(results) == 3
+    with open(os.path.join(outdir, 'images', 'aaaaaaa.jpg'), 'rb') as f:
+        assert f.read() == FILES['/aaaaaaa.jpg']
+    assert not os.path.exists(os.path.join(outdir, 'images', 'ccccccc.gif'))
+    with open(os.path.join(outdir, 'index.json')) as f:
+        index = json.load(f)
+    assert index['albums'][0]['images'] == ['bbbbbbb', 'ccccccc']
+    assert index['images']['aaaaaaa']['file'] == 'images/aaaaaaa.jpg'
+
+    # Resume: only the missing image is downloaded again
+    FileHandler.requests = []
+    assert backup_account(imgur, outdir, 2) == (0, 2, 1)
+    assert FileHandler.requests == ['/ccccccc.gif']
@@ -0,0 +1,65 @@
+from __future__ import unicode_literals
+
+import json
+
+import mock
+
+from imgurup import benchmark
+from imgurup.benchmark import compare
+from imgurup.benchmark import format_seconds
+from imgurup.benchmark import measure
+
+
+def test_measure(monkeypatch):
+    clock = mock.Mock(side_effect=[
+        # Calibration: 1 call is too short, then 2 calls
+        0, 0.01, 0, 0.1,
+        # The other runs
+        0, 0.2, 0, 0.1,
+    ])
+    monkeypatch.setattr(benchmark.time, 'time', clock)
+    func = mock.Mock()
+    assert measure(func, repeat=3, min_time=0.05) == [0.05, 0.1, 0.05]
+    # 1 + 2 calls to calibrate, 2 calls per other run
+    assert func.call_count == 7
+
+
+def test_format_seconds():
+    assert format_seconds(2.5) == '2.5s'
+    assert format_seconds(0.0125) == '12.5ms'
+    assert format_seconds(0.0000123) == '12.3us'
+    assert format_seconds(0.0000000012) == '1.2ns'
+
+
+def test_compare():
+    results = {'results': {
+        'a': {'min': 1.1}, 'b': {'min': 1.3}, 'new': {'min': 1.0},
+    }}
+    baseline = {'results': {
+        'a': {'min': 1.0}, 'b': {'min': 1.0}, 'removed': {'min': 1.0},
+    }}
+    assert [(name, regressed) for name, base, current, ratio, regressed
+            in compare(results, baseline, 0.2)] == [
+        ('a', False), ('b', True)
+    ]
+
+
+def test_main(tmpdir, capsys):
+    output = str(tmpdir.join('results.json'))
+    args = ['--quick', '--repeat', '1', '-k', r'encode\[1KB\]|parse|sniff']
+    assert benchmark.main(args + ['-o', output]) == 0
+    with open(output) as f:
+        results = json.load(f)
+    assert sorted(results['results']) == [
+        'encode[1KB]', 'parse[albums]', 'parse[upload]', 'sniff'
+    ]
+    assert results['results']['encode[1KB]']['bytes'] == 1024
+
+    # A much faster baseline is a regression
+    for result in results['results'].values():
+        result['min'] /= 100.0
+    baseline = str(tmpdir.join('baseline.json'))
+    with open(baseline, 'w') as f:
+        json.dump(results, f)
+    assert benchmark.main(args + ['--baseline', baseline]) == 1
+    assert 'sniff: ' in capsys.readouterr()[0]
@@ -0,0 +1,162 @@
+from __future__ import unicode_literals
+
+import os
+import socket
+
+import mock
+import pytest
+
+from imgurup import CLIImgur
+from imgurup import ImgurConnectionError
+from imgurup import ImgurError
+from imgurup.breaker import BROKEN
+from imgurup.breaker import CLOSED
+from imgurup.breaker import OPEN
+from imgurup.breaker import CircuitBreaker
+from imgurup.breaker import CircuitOpenError
+from imgurup.breaker import is_outage
+from imgurup.engine import UploadEngine
+from imgurup.testing import FakeImgur
+
+IMAGE_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), 'images', 'test.jpg'
+)
+
+
+def test_is_outage():
+    error = ImgurError('Error')
+    assert is_outage(None, ImgurConnectionError('Error'))
+    assert is_outage(None, socket.timeout())
+    assert is_outage(503, error)
+    assert not is_outage(400, error)
+    assert not is_outage(None, None)
+    # Local errors, no request was sent
+    assert not is_outage(None, IOError('No such file'))
+    assert not is_outage(None, error)
+
+
+def test_open_and_close():
+    breaker = CircuitBreaker(threshold=2, cooldown=0)
+    assert breaker.before() is False
+    breaker.record(True)
+    breaker.record(False)
+    breaker.record(True)
+    assert breaker.state == CLOSED
+    breaker.record(True)
+    assert breaker.state == OPEN
+    assert breaker.before() is True
+    breaker.record(False, probe=True)
+    assert breaker.state == CLOSED
+    assert breaker.before() is False
+
+
+def test_probe_fail():
+    breaker = CircuitBreaker(threshold=1, cooldown=0)
+    breaker.record(True)
+    assert breaker.before() is True
+    breaker.record(True, probe=True)
+    assert breaker.state == BROKEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before()
+
+
+def test_disabled():
+    breaker = CircuitBreaker(threshold=0)
+    for _ in range(10):
+        breaker.record(True)
+    assert breaker.before() is False
+
+
+def test_engine_outage():
+    imgur = mock.Mock()
+    imgur.last_status = None
+    imgur.upload_image.side_effect = ImgurConnectionError('Error in request')
+    engine = UploadEngine(
+        imgur, workers=1, breaker=CircuitBreaker(threshold=3, cooldown=0)
+    )
+    records = []
+    jobs = [{'path': '{i}.jpg'.format(i=i)} for i in range(10)]
+    assert engine.run(jobs, records.append) == (0, 10)
+    # 3 failures, then the probe
+    assert imgur.upload_image.call_count == 4
+    assert [r['status'] for r in records].count('not_sent') == 6
+    assert 'circuit open' in records[-1]['error']
+
+
+def test_probe_fail_without_give_up(monkeypatch):
+    clock = mock.Mock(return_value=100)
+    monkeypatch.setattr('imgurup.breaker.time.time', clock)
+    breaker = CircuitBreaker(threshold=1, cooldown=10, give_up=False)
+    breaker.record(True)
+    clock.return_value = 110
+    assert breaker.before() is True
+    breaker.record(True, probe=True)
+    # Open again with a doubled cooldown
+    assert breaker.state == OPEN
+    clock.return_value = 129
+    with mock.patch.object(breaker._condition, 'wait') as wait:
+        # The wait lasts until the end of the 20s cooldown
+        wait.side_effect = lambda seconds: setattr(clock, 'return_value', 130)
+        assert breaker.before() is True
+    wait.assert_called_once_with(1)
+    breaker.record(False, probe=True)
+    assert breaker.state == CLOSED
+    assert breaker._cooldown == 10
+
+
+def test_engine_outage_ends():
+    # A long running engine uploads the files after the outage
+    imgur = mock.Mock()
+    imgur.last_status = None
+    imgur.upload_image.side_effect = [
+        ImgurConnectionError('Error in request')
+    ] * 3 + [{'id': 'x', 'link': 'link', 'deletehash': 'd'}] * 2
+    engine = UploadEngine(
+        imgur, workers=1,
+        breaker=CircuitBreaker(threshold=2, cooldown=0, give_up=False)
+    )
+    records = []
+    jobs = [{'path': '{i}.jpg'.format(i=i)} for i in range(4)]
+    assert engine.run(jobs, records.append) == (1, 3)
+    assert engine.breaker.state == CLOSED
+    # 2 failures, a failed probe, then the probe of the last file succeeds
+    assert [r['status'] for r in records] == [
+        'failed', 'failed', 'failed', 'uploaded'
+    ]
+
+
+def test_engine_local_errors():
+    # Unreadable files don't open the circuit
+    imgur = mock.Mock()
+    imgur.last_status = None
+    imgur.upload_image.side_effect = IOError('Permission denied')
+    engine = UploadEngine(
+        imgur, workers=1, breaker=CircuitBreaker(threshold=3, cooldown=0)
+    )
+    jobs = [{'path': '{i}.jpg'.format(i=i)} for i in range(10)]
+    assert engine.run(jobs) == (0, 10)
+    assert imgur.upload_image.call_count == 10
+    assert engine.breaker.state == CLOSED
+
+
+@pytest.mark.parametrize('anonymous', [True, False])
+def test_engine_server_errors(monkeypatch, anonymous):
+    monkeypatch.setattr('imgurup.time.sleep', mock.Mock())
+    with FakeImgur() as server:
+        imgur = CLIImgur()
+        imgur.connect(server.url)
+        server.set_tokens(imgur)
+        server.inject('server_error', path='^/3/image$', times=None)
+        engine = UploadEngine(
+            imgur, workers=1, breaker=CircuitBreaker(threshold=2, cooldown=0)
+        )
+        records = []
+        jobs = [
+            {'path': IMAGE_PATH, 'anonymous': anonymous} for i in range(5)
+        ]
+        assert engine.run(jobs, records.append) == (0, 5)
+        # 2 failures, then the failed probe, each tried twice
+        assert len(server.requests) == 6
+    assert [r['http_status'] for r in records[:3]] == [503] * 3
+    assert [r['status'] for r in records].count('not_sent') == 2
+    assert engine.breaker.state == BROKEN
@@ -0,0 +1,256 @@
+from __future__ import unicode_literals
+
+import os
+
+import mock
+import pytest
+
+from imgurup import CLIImgur
+from imgurup import ImgurError
+from imgurup.engine import AdaptiveLimit
+from imgurup.engine import UploadEngine
+from imgurup.engine import get_percentile
+from imgurup.engine import get_post_data
+from imgurup.engine import run_concurrently
+from imgurup.engine import run_stream
+from imgurup.testing import FakeImgur
+
+IMAGE_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), 'images', 'test.jpg'
+)
+
+
+def fake_upload_image(path, post_data, anonymous, content_type=None):
+    if path == 'bad.jpg':
+        raise ImgurError('Error in request_upload_image')
+    return {
+        'id': 'id-' + path,
+        'link': 'http://i.imgur.com/' + path,
+        'deletehash': 'hash-' + path,
+    }
+
+
+@pytest.fixture(scope='function')
+def imgur():
+    m = mock.Mock()
+    m.upload_image.side_effect = fake_upload_image
+    return m
+
+
+def test_get_post_data():
+    job = {
+        'path': 'a.jpg',
+        'title': 'a',
+        'description': '',
+        'album_ids': ['XXXXX', 'YYYYY'],
+    }
+    assert get_post_data(job) == {'title': 'a', 'album_id': 'XXXXX'}
+
+
+def test_run_concurrently():
+    def func(item):
+        if item == 3:
+            raise ValueError('bad item')
+        return item * 2
+
+    results = run_concurrently(func, [1, 2, 3, 4], workers=2)
+    assert [result for result, error in results] == [2, 4, None, 8]
+    assert isinstance(results[2][1], ValueError)
+    assert run_concurrently(func, []) == []
+
+
+def test_run_stream_lane():
+    import threading
+    release = threading.Event()
+    results = []
+
+    def func(item):
+        if item == 'big':
+            # Holds its lane until all the small items are done
+            assert release.wait(5)
+        return item
+
+    def on_result(item, result, error):
+        results.append(result)
+        if len(results) == 20:
+            release.set()
+
+    items = ['big'] + list(range(20))
+    assert run_stream(func, items, on_result, 1, lambda i: i == 'big') == 21
+    assert results == list(range(20)) + ['big']
+
+
+def test_run(imgur):
+    imgur.exit_on_error = True
+    engine = UploadEngine(imgur, workers=3)
+    exit_on_error = []
+    imgur.upload_image.side_effect = lambda *args, **kwargs: (
+        exit_on_error.append(imgur.exit_on_error) or
+        fake_upload_image(*args, **kwargs)
+    )
+    records = []
+    jobs = ({'path': '{i}.jpg'.format(i=i)} for i in range(20))
+    assert engine.run(jobs, records.append) == (20, 0)
+    # The errors raise during the run only
+    assert exit_on_error == [False] * 20
+    assert imgur.exit_on_error is True
+    assert sorted(r['index'] for r in records) == list(range(20))
+    for record in records:
+        assert record['id'] == 'id-' + record['path']
+        assert record['error'] is None
+
+
+def test_run_with_errors(imgur):
+    engine = UploadEngine(imgur, workers=2)
+    records = []
+    jobs = [
+        {'path': 'bad.jpg'},
+        {'path': 'invalid.jpg', 'error': 'File is empty'},
+        {'path': 'good.jpg', 'title': 'good', 'anonymous': True},
+    ]
+    assert engine.run(jobs, records.append) == (1, 2)
+    errors = dict((r['path'], r['error']) for r in records)
+    assert errors == {
+        'bad.jpg': 'Error in request_upload_image',
+        'invalid.jpg': 'File is empty',
+        'good.jpg': None,
+    }
+    imgur.upload_image.assert_any_call(
+        'good.jpg', {'title': 'good'}, True, content_type=None
+    )
+    assert imgur.upload_image.call_count == 2
+
+
+def test_run_keeps_index(imgur):
+    engine = UploadEngine(imgur, workers=2)
+    records = []
+    jobs = [{'path': 'b.jpg', 'index': 1}, {'path': 'a.jpg', 'index': 0},
+            {'path': 'big.mp4', 'index': 2, 'large': True}]
+    assert engine.run(jobs, records.append) == (3, 0)
+    assert sorted((r['index'], r['path']) for r in records) == [
+        (0, 'a.jpg'), (1, 'b.jpg'), (2, 'big.mp4')
+    ]
+
+
+def test_run_reraises_job_error(imgur):
+    def jobs():
+        yield {'path': 'a.jpg'}
+        raise ValueError('broken manifest')
+
+    engine = UploadEngine(imgur)
+    with pytest.raises(ValueError):
+        engine.run(jobs())
+
+
+def test_run_with_several_albums(imgur):
+    imgur.request_album_add_images.side_effect = [True, ImgurError()]
+    engine = UploadEngine(imgur)
+    records = []
+    jobs = [{'path': 'a.jpg', 'album_ids': ['A', 'B', 'C']}]
+    assert engine.run(jobs, records.append) == (0, 1)
+    imgur.upload_image.assert_called_once_with(
+        'a.jpg', {'album_id': 'A'}, False, content_type=None
+    )
+    assert imgur.request_album_add_images.call_count == 2
+    assert records[0]['id'] == 'id-a.jpg'
+    assert records[0]['error'].startswith('Add to album fail: ')
+
+
+def test_get_percentile():
+    samples = list(range(1, 101))
+    assert get_percentile(samples, 95) == 95
+    assert get_percentile(samples, 50) == 50
+    assert get_percentile([3], 95) == 3
+
+
+@pytest.fixture(scope='function')
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('imgurup.engine.time.time', lambda: now[0])
+    return now
+
+
+def test_adaptive_limit_increase_and_decrease(clock):
+    limit = AdaptiveLimit(1, 4)
+    assert limit.limit == 1
+    # +1 after `limit` healthy uploads
+    for expected in (2, 2, 3, 3, 3, 4, 4):
+        limit.record(limit.acquire())
+        limit.release()
+        assert limit.limit == expected
+
+    started = limit.acquire()
+    limit.release()
+    clock[0] += 1
+    limit.record(started, overloaded=True)
+    assert limit.limit == 2
+    # Started before the decrease, sent at the old limit
+    limit.record(started, overloaded=True)
+    assert limit.limit == 2
+    clock[0] += 1
+    limit.record(limit.acquire(), overloaded=True)
+    limit.release()
+    assert limit.limit == 1
+    clock[0] += 1
+    limit.record(limit.acquire(), overloaded=True)
+    limit.release()
+    assert limit.limit == 1
+
+
+def test_adaptive_limit_latency(clock):
+    limit = AdaptiveLimit(1, 8, initial=8)
+
+    def upload(seconds, size=0):
+        started = limit.acquire()
+        clock[0] += seconds
+        limit.release()
+        limit.record(started, size)
+
+    for _ in range(20):
+        upload(0.1)
+    assert limit.limit == 8
+    # Slow because big, not because overloaded
+    for _ in range(10):
+        upload(1.0, 10 * 1024 * 1024)
+    assert limit.limit == 8
+    for _ in range(10):
+        upload(1.0)
+    assert limit.limit == 4
+
+
+def test_run_adaptive(imgur):
+    engine = UploadEngine(imgur, workers=4, min_workers=1)
+    assert engine.limit.limit == 1
+    imgur.last_status = 200
+    assert engine.run([{'path': '{i}.jpg'.format(i=i)} for i in range(10)]) \
+        == (10, 0)
+    assert engine.limit.limit == 4
+
+
+def test_run_records(imgur, tmpdir):
+    image = tmpdir.join('a.jpg')
+    image.write_binary(b'abc')
+    imgur.last_upload_stats = {'attempts': 2, 'timings': {'send': 0.5}}
+    engine = UploadEngine(imgur, hash_files=True)
+    records = []
+    engine.run([{'path': str(image)}], records.append)
+    record = records[0]
+    assert record['status'] == 'uploaded'
+    assert record['size'] == 3
+    assert record['sha1'] == 'a9993e364706816aba3e25717850c26c9cd0d89d'
+    assert record['attempts'] == 2
+    assert sorted(record['timings']) == ['hash', 'send']
+
+
+def test_run_server_errors(monkeypatch):
+    monkeypatch.setattr('imgurup.time.sleep', mock.Mock())
+    with FakeImgur() as server:
+        imgur = CLIImgur()
+        imgur.connect(server.url)
+        server.set_tokens(imgur)
+        engine = UploadEngine(imgur, workers=4, min_workers=1)
+        engine.limit = AdaptiveLimit(1, 4, initial=4)
+        server.inject('server_error', path='^/3/image$', times=None)
+        assert engine.run([{'path': IMAGE_PATH}]) == (0, 1)
+    # The 5xx is not hidden by another request
+    assert engine.limit.limit == 2
@@ -11,6 +11,7 @@ import pytest_httpretty
 import io
 import sys
 import os
+import socket
 
 import imgurup
 from imgurup import CLIImgur
@@ -328,6 +329,27 @@ class TestCLIImgur:
             with pytest.raises(SystemExit):
                 self.imgur.request_new_tokens_and_update()
 
+    def test_refresh_tokens_once(self, monkeypatch):
+        request_new_tokens = mock.Mock(return_value={
+            'access_token': 'a', 'refresh_token': 'r'
+        })
+        monkeypatch.setattr(
+            self.imgur, 'request_new_tokens', request_new_tokens
+        )
+        write_tokens_to_config = mock.Mock()
+        monkeypatch.setattr(
+            self.imgur, 'write_tokens_to_config', write_tokens_to_config
+        )
+        self.imgur._refresh_token = 'r'
+        generation = self.imgur._token_generation
+        self.imgur.refresh_tokens(generation)
+        # Another worker which failed with the old tokens
+        self.imgur.refresh_tokens(generation)
+        assert request_new_tokens.call_count == 1
+        assert write_tokens_to_config.call_count == 1
+        self.imgur.refresh_tokens()
+        assert request_new_tokens.call_count == 2
+
     @pytest.fixture(scope='function')
     def mock_raw_input(self, request):
         m = mock.patch('imgurup.input')
@@ -399,6 +421,27 @@ class TestCLIImgur:
         with patch('imgurup.input', return_value=1):
             assert self.imgur.ask_album_id(self._albums) == '1'
 
+    def test_ask_album_id_not_interactive(self, capsys):
+        self.imgur.interactive = False
+        with patch('imgurup.input', return_value=1) as mock_input:
+            with pytest.raises(SystemExit):
+                self.imgur.ask_album_id(self._albums)
+            with pytest.raises(SystemExit):
+                self.imgur.ask_image_path()
+        assert not mock_input.called
+        assert capsys.readouterr()[0] == ''
+
+    def test_ndjson_ask_each_album(self, monkeypatch):
+        monkeypatch.setattr(
+            imgurup.sys, 'argv',
+            ['imgurup', '--output', 'ndjson', '-q', '-f', 'a.jpg']
+        )
+        monkeypatch.setattr(imgurup, 'run_command', mock.Mock())
+        with pytest.raises(SystemExit) as e:
+            imgurup.main()
+        assert e.value.code == 1
+        assert not imgurup.run_command.called
+
     def test_get_show_link_dialog_args(self):
         with pytest.raises(NotImplementedError):
             self.imgur.get_show_link_dialog_args({})
@@ -484,6 +527,323 @@ class TestCLIImgur:
                 headers={}
             )
 
+    @pytest.mark.httpretty
+    def test_request_album_create(self):
+        httpretty.register_uri(
+            httpretty.POST,
+            'https://api.imgur.com/3/album',
+            body='{"data":{"id":"XXXXX","deletehash":"000"},'
+                 '"success":true,"status":200}',
+            status=200
+        )
+        with patch(get_builtin_name('open'), return_value=io.StringIO(self._token_config)):
+            data = self.imgur.request_album_create(
+                ['c', 'a', 'b'], title='temp', cover='a'
+            )
+        assert data == {'id': 'XXXXX', 'deletehash': '000'}
+        request = httpretty.last_request()
+        assert request.headers['Authorization'] == (
+            'Bearer 0000000000000000000000000000000000000000'
+        )
+        assert request.body == (
+            b'ids%5B%5D=c&ids%5B%5D=a&ids%5B%5D=b&title=temp&cover=a'
+        )
+
+    @pytest.mark.httpretty
+    def test_request_album_add_images_anonymous(self):
+        httpretty.register_uri(
+            httpretty.POST,
+            'https://api.imgur.com/3/album/000/add',
+            body='{"data":true,"success":true,"status":200}',
+            status=200
+        )
+        assert self.imgur.request_album_add_images(
+            '000', ['h1', 'h2'], anonymous=True
+        ) is True
+        request = httpretty.last_request()
+        assert request.headers['Authorization'] == (
+            'Client-ID ' + self.imgur._client_id
+        )
+        assert request.body == b'deletehashes%5B%5D=h1&deletehashes%5B%5D=h2'
+
+    def test_upload_batch_new_album(self, monkeypatch):
+        from argparse import Namespace
+        args = Namespace(
+            f=['1.jpg', '2.jpg', '3.jpg'], d=None, n=False, t=False,
+            workers=3, min_workers=1, order='smallest', large_size=10,
+            breaker_threshold=5, breaker_cooldown=30,
+            new_album='temp', cover='./2.jpg'
+        )
+
+        def upload_image(path, post_data, anonymous, content_type=None):
+            # Finish the uploads in the reverse order
+            imgurup.time.sleep(0.01 * (3 - int(path[0])))
+            return {'id': 'id' + path[0], 'link': path, 'deletehash': 'h'}
+
+        monkeypatch.setattr(self.imgur, 'ensure_tokens', mock.Mock())
+        monkeypatch.setattr(self.imgur, 'upload_image', upload_image)
+        monkeypatch.setattr(self.imgur, 'show_link', mock.Mock())
+        request_album_create = mock.Mock(
+            return_value={'id': 'XXXXX', 'deletehash': '000'}
+        )
+        monkeypatch.setattr(
+            self.imgur, 'request_album_create', request_album_create
+        )
+        imgurup.upload_batch(self.imgur, args)
+        request_album_create.assert_called_once_with(
+            ['id1', 'id2', 'id3'], 'temp', 'id2', False
+        )
+        assert self.imgur.show_link.call_count == 3
+
+    def test_upload_batch_unknown_cover(self, monkeypatch):
+        from argparse import Namespace
+        args = Namespace(
+            f=['1.jpg', '2.jpg'], d=None, n=False, t=False,
+            new_album='temp', cover='3.jpg'
+        )
+        monkeypatch.setattr(self.imgur, 'upload_image', mock.Mock())
+        with pytest.raises(SystemExit):
+            imgurup.upload_batch(self.imgur, args)
+        assert not self.imgur.upload_image.called
+
+    def test_new_album_and_album(self, monkeypatch):
+        monkeypatch.setattr(
+            imgurup.sys, 'argv', ['imgurup', '-d', 'XXXXX', '--new-album', 't']
+        )
+        with pytest.raises(SystemExit) as e:
+            imgurup.main()
+        assert e.value.code == 2
+
+    def test_upload_batch_several_albums(self, monkeypatch):
+        from argparse import Namespace
+        args = Namespace(
+            f=['1.jpg', '2.jpg'], d='A, B', n=False, t=False,
+            workers=2, min_workers=2, order='fifo', large_size=0,
+            breaker_threshold=0, breaker_cooldown=30,
+            new_album=None, cover=None
+        )
+        monkeypatch.setattr(self.imgur, 'ensure_tokens', mock.Mock())
+        monkeypatch.setattr(
+            self.imgur,
+            'upload_image',
+            lambda path, post_data, anonymous, content_type=None: {
+                'id': 'id' + path[0], 'link': path, 'deletehash': 'h'
+            }
+        )
+        monkeypatch.setattr(self.imgur, 'show_link', mock.Mock())
+        request_album_add_images = mock.Mock(return_value=True)
+        monkeypatch.setattr(
+            self.imgur, 'request_album_add_images', request_album_add_images
+        )
+        imgurup.upload_batch(self.imgur, args)
+        request_album_add_images.assert_has_calls(
+            [
+                call('A', ['id1', 'id2'], False),
+                call('B', ['id1', 'id2'], False),
+            ],
+            any_order=True
+        )
+        assert request_album_add_images.call_count == 2
+
+    def test_upload_manifest_album_pages(self, monkeypatch, tmpdir):
+        from argparse import Namespace
+        manifest = tmpdir.join('manifest.jsonl')
+        manifest.write('{"url": "http://example.com/a.jpg", "album": "old"}\n')
+        args = Namespace(
+            manifest=str(manifest), n=False, t=False,
+            workers=1, min_workers=1, order='fifo', large_size=0,
+            breaker_threshold=0, breaker_cooldown=30
+        )
+        pages = [[{'id': 'A', 'title': 'new'}], [{'id': 'B', 'title': 'old'}]]
+        monkeypatch.setattr(self.imgur, 'ensure_tokens', mock.Mock())
+        monkeypatch.setattr(
+            self.imgur, 'request_album_list',
+            lambda page: pages[page] if page < len(pages) else []
+        )
+        upload_image = mock.Mock(
+            return_value={'id': 'x', 'link': 'l', 'deletehash': 'h'}
+        )
+        monkeypatch.setattr(self.imgur, 'upload_image', upload_image)
+        monkeypatch.setattr(self.imgur, 'show_link', mock.Mock())
+        imgurup.upload_manifest(self.imgur, args)
+        # The album is found on the second page
+        assert upload_image.call_args[0][1] == {'album_id': 'B'}
+
+    def test_upload_manifest_anonymous_album(self, monkeypatch, tmpdir):
+        from argparse import Namespace
+        manifest = tmpdir.join('manifest.jsonl')
+        manifest.write('{"url": "http://example.com/a.jpg", "album": "old"}\n')
+        args = Namespace(
+            manifest=str(manifest), n=True, t=False,
+            workers=1, min_workers=1, order='fifo', large_size=0,
+            breaker_threshold=0, breaker_cooldown=30
+        )
+        monkeypatch.setattr(self.imgur, 'upload_image', mock.Mock())
+        with pytest.raises(SystemExit):
+            imgurup.upload_manifest(self.imgur, args)
+        assert not self.imgur.upload_image.called
+
+    @pytest.mark.httpretty
+    def test_request_image_delete(self):
+        httpretty.register_uri(
+            httpretty.DELETE,
+            'https://api.imgur.com/3/image/xxxxxxx',
+            body='{"data":true,"success":true,"status":200}',
+            status=200
+        )
+        with patch(get_builtin_name('open'), return_value=io.StringIO(self._token_config)):
+            assert self.imgur.request_image_delete('xxxxxxx') is True
+        assert httpretty.last_request().method == 'DELETE'
+
+    def test_request_upload_image_lost_response(self, monkeypatch):
+        monkeypatch.setattr(imgurup.time, 'sleep', mock.Mock())
+        monkeypatch.setattr(self.imgur, 'reset_connection', mock.Mock())
+        request = mock.Mock()
+        monkeypatch.setattr(
+            imgurup.Imgur, '_request', property(lambda imgur: request)
+        )
+        monkeypatch.setattr(
+            self.imgur,
+            '_get_json_response',
+            mock.Mock(side_effect=imgurup.httplib.BadStatusLine(''))
+        )
+        image = {'id': 'xxxxxxx', 'description': 'a\n\n[imgurup:0000]'}
+        monkeypatch.setattr(
+            self.imgur,
+            'request_account_images',
+            mock.Mock(return_value=[{'id': 'yyyyyyy'}, image])
+        )
+        assert self.imgur.request_upload_image(
+            '/3/image', b'', {}, fingerprint='0000'
+        ) == image
+        assert request.call_count == 1
+        assert self.imgur.reset_connection.call_count == 1
+
+        # Not found, so the image is sent again
+        request.reset_mock()
+        self.imgur._get_json_response.side_effect = [
+            imgurup.httplib.BadStatusLine(''),
+            {'success': True, 'data': {'id': 'zzzzzzz'}},
+        ]
+        assert self.imgur.request_upload_image(
+            '/3/image', b'', {}, fingerprint='1111'
+        ) == {'id': 'zzzzzzz'}
+        assert request.call_count == 2
+
+    def test_retry_connection_error(self, monkeypatch):
+        monkeypatch.setattr(imgurup.time, 'sleep', mock.Mock())
+        monkeypatch.setattr(self.imgur, 'reset_connection', mock.Mock())
+        monkeypatch.setattr(self.imgur, 'get_auth_header', mock.Mock())
+        request = mock.Mock(side_effect=socket.error('Connection refused'))
+        monkeypatch.setattr(
+            imgurup.Imgur, '_request', property(lambda imgur: request)
+        )
+        self.imgur.exit_on_error = False
+        # Told apart from the errors of Imgur
+        with pytest.raises(imgurup.ImgurConnectionError):
+            self.imgur.request_upload_image('/3/image', b'', {})
+        request.side_effect = imgurup.ImgurError
+        monkeypatch.setattr(self.imgur, 'refresh_tokens', mock.Mock())
+        with pytest.raises(imgurup.ImgurError) as e:
+            self.imgur.request_upload_image('/3/image', b'', {})
+        assert not isinstance(e.value, imgurup.ImgurConnectionError)
+
+    def test_find_uploaded_image_error(self, monkeypatch):
+        monkeypatch.setattr(imgurup.time, 'sleep', mock.Mock())
+        monkeypatch.setattr(self.imgur, 'refresh_tokens', mock.Mock())
+        monkeypatch.setattr(self.imgur, 'get_auth_header', mock.Mock())
+        exit_on_error = []
+
+        def request(*args):
+            # Shared by the other threads, so left alone
+            exit_on_error.append(self.imgur.exit_on_error)
+            raise imgurup.ImgurError
+
+        monkeypatch.setattr(
+            imgurup.Imgur, '_request', property(lambda imgur: request)
+        )
+        # A failed check doesn't exit, the image is uploaded again
+        assert self.imgur.find_uploaded_image(
+            '/3/image', b'', {}, fingerprint='0000'
+        ) is None
+        assert exit_on_error == [True, True]
+        assert not self.imgur._raises_errors()
+
+    def test_upload_image_fingerprint(self, monkeypatch):
+        monkeypatch.setattr(self.imgur, 'get_auth_header', mock.Mock())
+        request_upload_image = mock.Mock()
+        monkeypatch.setattr(
+            self.imgur, 'request_upload_image', request_upload_image
+        )
+        encode = mock.Mock(return_value=(b'', {}))
+        monkeypatch.setattr(self.imgur, '_encode_multipart_data', encode)
+        # The description is left alone unless asked
+        self.imgur.upload_image('a.jpg', {'description': 'desc'})
+        assert request_upload_image.call_args[1]['fingerprint'] is None
+        assert encode.call_args[0][0]['description'] == 'desc'
+
+        self.imgur.fingerprint_uploads = True
+        self.imgur.upload_image('a.jpg', {'description': 'desc'})
+        fingerprint = request_upload_image.call_args[1]['fingerprint']
+        assert encode.call_args[0][0]['description'] == (
+            'desc\n\n[imgurup:{f}]'.format(f=fingerprint)
+        )
+
+        self.imgur.upload_image('a.jpg', anonymous=True)
+        assert request_upload_image.call_args[1]['fingerprint'] is None
+        assert 'description' not in encode.call_args[0][0]
+
+    def test_upload_image_content_type(self, monkeypatch):
+        monkeypatch.setattr(self.imgur, 'request_upload_image', mock.Mock())
+        encode = mock.Mock(return_value=(b'', {}))
+        monkeypatch.setattr(self.imgur, '_encode_multipart_data', encode)
+        # The type sniffed by the preflight is not sniffed again
+        self.imgur.upload_image(
+            'a.png', anonymous=True, content_type='image/png'
+        )
+        assert encode.call_args[0][2] == {'image': 'image/png'}
+        self.imgur.upload_image('a.png', anonymous=True)
+        assert encode.call_args[0][2] is None
+
+    def test_upload_image_stats(self, monkeypatch):
+        from imgurup.trace import TimingReport
+        monkeypatch.setattr(imgurup.time, 'sleep', mock.Mock())
+        monkeypatch.setattr(self.imgur, 'reset_connection', mock.Mock())
+        monkeypatch.setattr(self.imgur, 'get_auth_header', mock.Mock())
+        connection = mock.Mock(sock=None)
+        connection.getresponse.side_effect = [
+            imgurup.httplib.BadStatusLine(''),
+            mock.Mock(status=200, read=mock.Mock(
+                return_value=b'{"success": true, "data": {"id": "zzzzzzz"}}'
+            )),
+        ]
+        monkeypatch.setattr(
+            imgurup.Imgur, '_connect', property(lambda imgur: connection)
+        )
+        tracer = mock.Mock()
+        report = TimingReport()
+        self.imgur.add_tracer(tracer)
+        self.imgur.add_tracer(report)
+        assert self.imgur.last_upload_stats is None
+        self.imgur.upload_image('http://example.com/a.jpg', anonymous=True)
+        stats = self.imgur.last_upload_stats
+        assert stats['attempts'] == 2
+        assert sorted(stats['timings']) == [
+            'connect', 'encode', 'parse', 'read', 'send', 'ttfb'
+        ]
+        phases = [c[0][0] for c in tracer.on_phase_end.call_args_list]
+        assert phases == [
+            'encode', 'connect', 'send', 'ttfb',
+            'connect', 'send', 'ttfb', 'read', 'parse'
+        ]
+        tags = tracer.on_phase_end.call_args[0][2]
+        assert tags == {
+            'path': 'http://example.com/a.jpg', 'size': 0, 'attempt': 2
+        }
+        assert [line.split(':')[0] for line in report.format_summary()] == [
+            'connect', 'encode', 'send', 'ttfb', 'read', 'parse'
+        ]
+
 
 class TestZenityImgur:
 
@@ -696,6 +1056,44 @@ class TestZenityImgur:
             ]
         )
 
+    def test_upload_batch(self, monkeypatch):
+        from argparse import Namespace
+        args = Namespace(
+            f=['1.jpg', '2.jpg', 'bad.jpg'], d=None, n=True, t=False,
+            workers=2, min_workers=2, order='fifo', large_size=0,
+            breaker_threshold=0, breaker_cooldown=30,
+            new_album=None, cover=None
+        )
+
+        def upload_image(path, post_data, anonymous, content_type=None):
+            if path == 'bad.jpg':
+                raise imgurup.ImgurError('Error in request_upload_image')
+            return {'id': 'id' + path[0], 'link': path, 'deletehash': 'h'}
+
+        progress = mock.Mock()
+        monkeypatch.setattr(self.imgur, 'upload_image', upload_image)
+        monkeypatch.setattr(self.imgur, 'show_link', mock.Mock())
+        monkeypatch.setattr(self.imgur, 'show_summary', mock.Mock())
+        monkeypatch.setattr(
+            self.imgur, 'open_progress_dialog', mock.Mock(return_value=progress)
+        )
+        with pytest.raises(SystemExit):
+            imgurup.upload_batch(self.imgur, args)
+        assert not self.imgur.show_link.called
+        assert progress.update.call_count == 3
+        assert progress.close.call_count == 1
+        records = self.imgur.show_summary.call_args[0][0]
+        assert [r['path'] for r in records] == ['1.jpg', '2.jpg', 'bad.jpg']
+        summary = self.imgur.get_summary(records, ['http://imgur.com/a/XX'])
+        assert summary == (
+            'Link: 1.jpg\n'
+            'Delete link: http://imgur.com/delete/h\n'
+            'Link: 2.jpg\n'
+            'Delete link: http://imgur.com/delete/h\n'
+            'Album link: http://imgur.com/a/XX\n'
+            'Failed: bad.jpg: Error in request_upload_image'
+        )
+
 
 class TestKDEImgur:
     def setup(self):
@@ -0,0 +1,24 @@
+from __future__ import unicode_literals
+
+import json
+
+from imgurup.journal import Journal
+
+
+def test_write(tmpdir):
+    path = tmpdir.join('journal.jsonl')
+    journal = Journal(str(path))
+    journal.write({'path': 'a.jpg', 'id': 'XXXXX', 'error': None})
+    # Flushed without closing
+    assert json.loads(path.read()) == {
+        'path': 'a.jpg', 'id': 'XXXXX', 'error': None
+    }
+    journal.write({'path': 'b.jpg', 'id': None, 'error': 'Error'})
+    journal.close()
+    journal = Journal(str(path))
+    journal.write({'path': 'c.jpg'})
+    journal.close()
+    lines = path.read().splitlines()
+    assert [json.loads(line)['path'] for line in lines] == [
+        'a.jpg', 'b.jpg', 'c.jpg'
+    ]
@@ -0,0 +1,63 @@
+from __future__ import unicode_literals
+
+import os
+import json
+
+import pytest
+
+from imgurup import loadtest
+from imgurup.loadtest import JPEG_HEADER
+from imgurup.loadtest import make_workload
+from imgurup.loadtest import parse_size
+from imgurup.loadtest import parse_sizes
+
+
+def test_parse_size():
+    assert parse_size('10') == 10
+    assert parse_size('50KB') == 50 * 1024
+    assert parse_size('1.5mb') == 1572864
+    assert parse_size('2GB') == 2 * 1024 ** 3
+    with pytest.raises(ValueError):
+        parse_size('10TB')
+
+
+def test_parse_sizes():
+    assert parse_sizes('1KB:80,2KB:20') == [(1024, 80), (2048, 20)]
+    assert parse_sizes('1KB') == [(1024, 1)]
+    with pytest.raises(ValueError):
+        parse_sizes('1KB:x')
+    with pytest.raises(ValueError):
+        parse_sizes('1KB:0')
+
+
+def test_make_workload(tmpdir):
+    paths = make_workload(str(tmpdir), 20, [(1024, 1), (4096, 1)], seed=1)
+    assert len(paths) == 20
+    sizes = set(os.path.getsize(path) for path in paths)
+    assert sizes == set([1024, 4096])
+    with open(paths[0], 'rb') as f:
+        assert f.read(len(JPEG_HEADER)) == JPEG_HEADER
+    # The same seed draws the same sizes
+    again = make_workload(str(tmpdir.mkdir('again')), 20,
+                          [(1024, 1), (4096, 1)], seed=1)
+    assert [os.path.getsize(p) for p in again] == [
+        os.path.getsize(p) for p in paths
+    ]
+
+
+def test_main(tmpdir, capsys):
+    output = str(tmpdir.join('report.json'))
+    status = loadtest.main([
+        '--files', '8', '--sizes', '1KB:1,20KB:1', '--workers', '2',
+        '-o', output,
+    ])
+    assert status == 0
+    with open(output) as f:
+        report = json.load(f)
+    assert report['files'] == report['succeeded'] == 8
+    assert report['failed'] == 0
+    assert report['retries'] == 0
+    assert report['files_per_s'] > 0
+    assert 0 < report['time_to_link']['p50'] <= report['time_to_link']['p99']
+    out = capsys.readouterr()[0]
+    assert 'Time to link: p50' in out
@@ -0,0 +1,98 @@
+from __future__ import unicode_literals
+
+import mock
+import pytest
+
+from imgurup import ImgurError
+from imgurup.manage import delete_images
+from imgurup.manage import parse_target
+from imgurup.manage import read_targets
+from imgurup.manage import update_images
+
+
+def test_parse_target():
+    assert parse_target('  \n') is None
+    assert parse_target('# comment') is None
+    assert parse_target('xxxxxxx') == {'id': 'xxxxxxx'}
+    assert parse_target('xxxxxxxxxxxxxxx\n') == {
+        'deletehash': 'xxxxxxxxxxxxxxx'
+    }
+    assert parse_target(
+        '{"id": "xxxxxxx", "deletehash": null, "link": "l", "title": "t"}'
+    ) == {'id': 'xxxxxxx', 'title': 't'}
+    # A failed upload of a journal is skipped
+    assert parse_target(
+        '{"id": null, "deletehash": null, "error": "Error", "path": "a.jpg"}'
+    ) is None
+    assert parse_target('{"title": "t"}') is None
+    with pytest.raises(ValueError):
+        parse_target('{"id": ')
+
+
+def test_read_targets(tmpdir):
+    path = tmpdir.join('targets')
+    path.write('xxxxxxx\n\n{"deletehash": "yyyyyyyyyyyyyyy"}\n')
+    assert list(read_targets(str(path))) == [
+        {'id': 'xxxxxxx'},
+        {'deletehash': 'yyyyyyyyyyyyyyy'},
+    ]
+
+
+def test_delete_images():
+    imgur = mock.Mock()
+    imgur.exit_on_error = True
+
+    def request_image_delete(image_id, anonymous):
+        if image_id == 'bad':
+            raise ImgurError('Error in request_image_delete')
+        return True
+
+    imgur.request_image_delete.side_effect = request_image_delete
+    results = []
+    targets = [{'id': 'ok'}, {'id': 'bad'}, {'deletehash': 'hash'}]
+    assert delete_images(
+        imgur, iter(targets), lambda t, e: results.append((t, e)), 2
+    ) == 3
+    assert imgur.exit_on_error is True
+    errors = dict(
+        (t.get('id') or t.get('deletehash'), e) for t, e in results
+    )
+    assert errors['ok'] is None
+    assert errors['hash'] is None
+    assert isinstance(errors['bad'], ImgurError)
+    imgur.request_image_delete.assert_any_call('hash', True)
+    imgur.request_image_delete.assert_any_call('ok', False)
+
+
+def test_update_images():
+    imgur = mock.Mock()
+    results = []
+    targets = [{'id': 'a', 'title': 'A'}, {'id': 'b'}]
+    update_images(imgur, targets, lambda t, e: results.append((t, e)))
+    imgur.request_image_update.assert_called_once_with('a', 'A', None, False)
+    errors = dict((t['id'], e) for t, e in results)
+    assert errors['a'] is None
+    assert isinstance(errors['b'], ValueError)
+
+
+def test_rate_limited(monkeypatch):
+    sleep = mock.Mock()
+    monkeypatch.setattr('imgurup.manage.time.sleep', sleep)
+    imgur = mock.Mock()
+    calls = []
+
+    def request_image_delete(image_id, anonymous):
+        calls.append(image_id)
+        if len(calls) < 3:
+            imgur.last_status = 429
+            raise ImgurError('Error in request_image_delete')
+        imgur.last_status = 200
+        return True
+
+    imgur.request_image_delete.side_effect = request_image_delete
+    results = []
+    delete_images(imgur, [{'id': 'a'}], lambda t, e: results.append(e), 4)
+    # Sent again after a growing backoff
+    assert results == [None]
+    assert calls == ['a', 'a', 'a']
+    assert [c[0][0] for c in sleep.call_args_list] == [2, 4]
@@ -0,0 +1,120 @@
+from __future__ import unicode_literals
+
+import os
+
+import pytest
+
+from imgurup.manifest import ManifestError
+from imgurup.manifest import check_jobs
+from imgurup.manifest import read_manifest
+from imgurup.manifest import resolve_albums
+
+
+TEST_IMAGE = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)),
+    'images',
+    'test.jpg'
+)
+
+
+def test_read_json_lines(tmpdir):
+    manifest = tmpdir.join('job.jsonl')
+    manifest.write(
+        '{"path": "a.jpg", "title": "A", "album": "temp"}\n'
+        '\n'
+        '# comment\n'
+        '{"url": "http://example.com/b.png", "description": "B"}\n'
+    )
+    jobs = list(read_manifest(str(manifest)))
+    assert jobs == [
+        {
+            'path': str(tmpdir.join('a.jpg')),
+            'line': 1,
+            'title': 'A',
+            'album': 'temp',
+        },
+        {
+            'path': 'http://example.com/b.png',
+            'line': 4,
+            'description': 'B',
+        },
+    ]
+
+
+def test_read_csv(tmpdir):
+    manifest = tmpdir.join('job.csv')
+    manifest.write(
+        'path,title,description,album\n'
+        '/tmp/a.jpg,"A, with comma",,XXXXX | temp\n'
+    )
+    assert list(read_manifest(str(manifest))) == [
+        {
+            'path': '/tmp/a.jpg',
+            'line': 2,
+            'title': 'A, with comma',
+            'album': ['XXXXX', 'temp'],
+        },
+    ]
+
+
+def test_read_priority(tmpdir):
+    manifest = tmpdir.join('job.csv')
+    manifest.write(
+        'path,priority\n'
+        '/tmp/a.jpg,2\n'
+        '/tmp/b.jpg,\n'
+    )
+    jobs = list(read_manifest(str(manifest)))
+    assert jobs[0]['priority'] == 2
+    assert 'priority' not in jobs[1]
+    manifest = tmpdir.join('job.jsonl')
+    manifest.write('{"path": "a.jpg", "priority": "high"}\n')
+    with pytest.raises(ManifestError):
+        list(read_manifest(str(manifest)))
+
+
+def test_read_malformed(tmpdir):
+    manifest = tmpdir.join('job.jsonl')
+    manifest.write('{"title": "no path"}\n')
+    with pytest.raises(ManifestError):
+        list(read_manifest(str(manifest)))
+    manifest.write('{"path": \n')
+    with pytest.raises(ManifestError):
+        list(read_manifest(str(manifest)))
+
+
+def test_resolve_albums():
+    calls = []
+
+    def get_albums():
+        calls.append(1)
+        return [{'id': 'XXXXX', 'title': 'temp'}]
+
+    jobs = [
+        {'path': 'a.jpg'},
+        {'path': 'b.jpg', 'album': 'temp'},
+        {'path': 'c.jpg', 'album': 'XXXXX'},
+        {'path': 'd.jpg', 'album': 'unknown'},
+        {'path': 'e.jpg', 'album': ['temp', 'XXXXX']},
+    ]
+    jobs = list(resolve_albums(jobs, get_albums))
+    assert len(calls) == 1
+    assert 'album_ids' not in jobs[0]
+    assert jobs[1]['album_ids'] == ['XXXXX']
+    assert jobs[2]['album_ids'] == ['XXXXX']
+    assert jobs[3]['error'] == 'Album not found: unknown'
+    assert jobs[4]['album_ids'] == ['XXXXX', 'XXXXX']
+
+
+def test_check_jobs(tmpdir):
+    jobs = [
+        {'path': TEST_IMAGE},
+        {'path': str(tmpdir.join('missing.jpg'))},
+        {'path': 'https://example.com/a.jpg'},
+    ]
+    jobs = list(check_jobs(jobs))
+    assert 'error' not in jobs[0]
+    assert jobs[0]['size'] == os.path.getsize(TEST_IMAGE)
+    assert jobs[0]['content_type'] == 'image/jpeg'
+    assert jobs[1]['error']
+    assert 'error' not in jobs[2]
@@ -0,0 +1,80 @@
+"""Memory of the uploads: each run uploads sparse files with
+`imgurup-loadtest` in a new process, to a fake server in another process
+which drops the bodies, so the peak RSS is the one of the client only.
+"""
+from __future__ import unicode_literals
+
+import os
+import sys
+import json
+import subprocess
+
+import pytest
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+MB = 1024 * 1024
+SIZES = ('1MB', '100MB', '500MB')
+# Growth of the peak RSS allowed during the uploads
+MAX_RSS_GROWTH = 16 * MB
+# Difference allowed between the growths of the smallest and largest file
+MAX_RSS_SPREAD = 8 * MB
+MAX_TRACED_PEAK = 4 * MB
+
+pytestmark = pytest.mark.skipif(
+    resource is None, reason='Needs the resource module to get the peak RSS'
+)
+
+
+def run_load_test(tmpdir, *argv):
+    output = str(tmpdir.join('report.json'))
+    command = [sys.executable, '-m', 'imgurup.loadtest', '-o', output]
+    if tracemalloc is not None:
+        command.append('--trace-malloc')
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))] +
+        [p for p in [env.get('PYTHONPATH')] if p]
+    )
+    subprocess.check_call(
+        command + list(argv), env=env, stdout=subprocess.PIPE
+    )
+    with open(output) as f:
+        report = json.load(f)
+    assert report['failed'] == 0
+    return report
+
+
+def check_memory(report):
+    growth = report['peak_rss'] - report['baseline_rss']
+    assert growth < MAX_RSS_GROWTH
+    if report['traced_peak'] is not None:
+        assert report['traced_peak'] < MAX_TRACED_PEAK
+    return growth
+
+
+def test_memory_independent_of_file_size(tmpdir):
+    growths = []
+    for size in SIZES:
+        report = run_load_test(
+            tmpdir, '--files', '1', '--sizes', size, '--workers', '1'
+        )
+        growths.append(check_memory(report))
+    assert max(growths) - min(growths) < MAX_RSS_SPREAD
+
+
+def test_memory_batch(tmpdir):
+    report = run_load_test(
+        tmpdir, '--files', '40', '--sizes', '1MB:1,4MB:1,20MB:1',
+        '--workers', '4'
+    )
+    assert report['succeeded'] == 40
+    check_memory(report)
@@ -0,0 +1,100 @@
+from __future__ import unicode_literals
+
+import socket
+
+from imgurup.metrics import Metrics
+from imgurup.metrics import StatsdClient
+from imgurup.metrics import serve_metrics
+from imgurup.metrics import write_textfile
+
+try:
+    from urllib.request import urlopen
+except ImportError:
+    from urllib2 import urlopen
+
+
+class FakeEngine(object):
+
+    class limit(object):
+        limit = 3
+
+    pending = 7
+
+
+def get_metrics(keep_samples=False):
+    metrics = Metrics(keep_samples=keep_samples)
+    metrics.on_phase_end('send', 0.2, {})
+    metrics.on_phase_end('send', 100, {})
+    metrics.on_event('retry', {'function': 'upload', 'error': 'timeout'})
+    metrics.on_event('token_cache', {'hit': True})
+    metrics.on_event('rate_limit', {'user': 1200})
+    metrics.on_engine(FakeEngine())
+    metrics.on_result({'status': 'uploaded', 'error': None, 'size': 2048})
+    metrics.on_result({'status': 'failed', 'error': 'Error', 'size': 10})
+    return metrics
+
+
+def test_render():
+    lines = get_metrics().render().splitlines()
+    assert '# TYPE imgurup_uploads_total counter' in lines
+    assert 'imgurup_uploads_total{status="uploaded"} 1' in lines
+    assert 'imgurup_uploads_total{status="failed"} 1' in lines
+    assert 'imgurup_upload_bytes_total 2048' in lines
+    assert 'imgurup_retries_total{error="timeout"} 1' in lines
+    assert 'imgurup_token_cache_total{result="hit"} 1' in lines
+    assert 'imgurup_queue_depth 7' in lines
+    assert 'imgurup_concurrency_limit 3' in lines
+    assert 'imgurup_rate_limit_remaining{kind="user"} 1200' in lines
+    assert '# TYPE imgurup_phase_seconds histogram' in lines
+    assert 'imgurup_phase_seconds_bucket{phase="send",le="0.1"} 0' in lines
+    assert 'imgurup_phase_seconds_bucket{phase="send",le="0.25"} 1' in lines
+    assert 'imgurup_phase_seconds_bucket{phase="send",le="60"} 1' in lines
+    assert 'imgurup_phase_seconds_bucket{phase="send",le="+Inf"} 2' in lines
+    assert 'imgurup_phase_seconds_sum{phase="send"} 100.2' in lines
+    assert 'imgurup_phase_seconds_count{phase="send"} 2' in lines
+
+
+def test_write_textfile(tmpdir):
+    path = tmpdir.join('imgurup.prom')
+    write_textfile(get_metrics(), str(path))
+    assert 'imgurup_upload_bytes_total 2048' in path.read().splitlines()
+    assert not tmpdir.join('imgurup.prom.tmp').check()
+
+
+def test_serve_metrics():
+    server = serve_metrics(get_metrics(), 0)
+    try:
+        url = 'http://{0}:{1}/metrics'.format(*server.server_address[:2])
+        response = urlopen(url, timeout=5)
+        body = response.read().decode('utf-8')
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert 'imgurup_queue_depth 7' in body.splitlines()
+
+
+def test_statsd_flush():
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(('127.0.0.1', 0))
+    receiver.settimeout(5)
+    metrics = get_metrics(keep_samples=True)
+    client = StatsdClient(
+        metrics, '127.0.0.1:{0}'.format(receiver.getsockname()[1])
+    )
+    try:
+        client.flush()
+        lines = receiver.recv(4096).decode('utf-8').splitlines()
+        assert 'imgurup.uploads_total.uploaded:1|c' in lines
+        assert 'imgurup.upload_bytes_total:2048|c' in lines
+        assert 'imgurup.queue_depth:7|g' in lines
+        assert 'imgurup.phase_seconds.send:200.000|ms' in lines
+        # Only the increase is sent
+        metrics.on_result({'status': 'uploaded', 'error': None, 'size': 1})
+        client.flush()
+        lines = receiver.recv(4096).decode('utf-8').splitlines()
+        assert 'imgurup.uploads_total.uploaded:1|c' in lines
+        assert 'imgurup.upload_bytes_total:1|c' in lines
+        assert 'imgurup.uploads_total.failed:1|c' not in lines
+        assert not [line for line in lines if line.endswith('|ms')]
+    finally:
+        receiver.close()
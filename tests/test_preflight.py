@@ -0,0 +1,77 @@
+from __future__ import unicode_literals
+
+import os
+
+from imgurup.preflight import MAX_IMAGE_SIZE
+from imgurup.preflight import check_file
+from imgurup.preflight import get_content_type
+from imgurup.preflight import preflight
+from imgurup.preflight import sniff_content_type
+
+
+TEST_IMAGE = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)),
+    'images',
+    'test.jpg'
+)
+
+
+def test_sniff_content_type():
+    assert sniff_content_type(b'\xff\xd8\xff\xe0\x00\x10JFIF') == 'image/jpeg'
+    assert sniff_content_type(b'\x89PNG\r\n\x1a\n\x00') == 'image/png'
+    assert sniff_content_type(b'GIF89a\x01\x00') == 'image/gif'
+    assert sniff_content_type(b'RIFF\x00\x00\x00\x00WEBPVP8 ') == 'image/webp'
+    assert sniff_content_type(b'\x00\x00\x00\x18ftypmp42') == 'video/mp4'
+    assert sniff_content_type(b'\x00\x00\x00\x14ftypqt  ') == 'video/quicktime'
+    assert sniff_content_type(b'\x00\x00\x00\x18ftypheic') is None
+    assert sniff_content_type(b'\x00\x00\x00\x1cftypavif') is None
+    assert sniff_content_type(b'\x00\x00\x00\x20ftypM4A ') is None
+    assert sniff_content_type(b'hello world') is None
+    assert sniff_content_type(b'') is None
+
+
+def test_get_content_type_without_extension(tmpdir):
+    path = tmpdir.join('noext')
+    with open(TEST_IMAGE, 'rb') as f:
+        path.write_binary(f.read())
+    assert get_content_type(str(path)) == 'image/jpeg'
+
+
+def test_get_content_type_fallback(tmpdir):
+    path = tmpdir.join('notes.txt')
+    path.write('hello')
+    assert get_content_type(str(path)) == 'text/plain'
+    assert get_content_type(str(tmpdir.join('missing'))) == (
+        'application/octet-stream'
+    )
+
+
+def test_check_file(tmpdir):
+    assert check_file(TEST_IMAGE) == (
+        'image/jpeg', os.path.getsize(TEST_IMAGE)
+    )
+
+    empty = tmpdir.join('empty.jpg')
+    empty.write('')
+    assert check_file(str(empty)) == (None, 'File is empty')
+
+    large = tmpdir.join('large.jpg')
+    with open(str(large), 'wb') as f:
+        f.write(b'\xff\xd8\xff\xe0')
+        f.truncate(MAX_IMAGE_SIZE + 1)
+    content_type, msg = check_file(str(large))
+    assert content_type is None
+    assert 'larger than 20 MB' in msg
+
+
+def test_preflight_reports_every_problem(tmpdir):
+    text = tmpdir.join('fake.jpg')
+    text.write('not an image')
+    missing = str(tmpdir.join('missing.png'))
+
+    valid, problems = preflight([missing, TEST_IMAGE, str(text)])
+    assert valid == [
+        (TEST_IMAGE, 'image/jpeg', os.path.getsize(TEST_IMAGE))
+    ]
+    assert [path for path, msg in problems] == [missing, str(text)]
+    assert problems[1][1] == 'Not a supported image or video type'
@@ -0,0 +1,82 @@
+from __future__ import unicode_literals
+
+import os
+import signal
+import pstats
+import threading
+
+import pytest
+
+from imgurup import profiling
+from imgurup.profiling import MemoryReport
+from imgurup.profiling import Profiler
+from imgurup.profiling import dump_on_signal
+
+
+def work_in_thread():
+    return sum(range(1000))
+
+
+def work_in_main():
+    return sum(range(1000))
+
+
+def get_functions(path):
+    return [key[2] for key in pstats.Stats(path).stats]
+
+
+def test_profiler(tmpdir):
+    path = str(tmpdir.join('out.pstats'))
+    profiler = Profiler()
+    profiler.start()
+    try:
+        thread = threading.Thread(target=work_in_thread)
+        thread.start()
+        thread.join()
+        work_in_main()
+    finally:
+        profiler.stop()
+    profiler.dump(path)
+    functions = get_functions(path)
+    assert 'work_in_thread' in functions
+    assert 'work_in_main' in functions
+
+
+@pytest.mark.skipif(
+    profiling.tracemalloc is None, reason='tracemalloc not available'
+)
+def test_memory_report():
+    report = MemoryReport(limit=2)
+    report.start()
+    try:
+        blocks = [bytearray(100000) for i in range(10)]
+        lines = report.format_report()
+    finally:
+        report.stop()
+    assert len(blocks) == 10
+    assert lines[0].startswith('Traced memory: ')
+    assert len(lines) == 3
+    # The largest site is the list above
+    assert lines[1].startswith(__file__.replace('.pyc', '.py') + ':')
+
+
+@pytest.mark.skipif(
+    not hasattr(signal, 'SIGUSR1'), reason='SIGUSR1 not available'
+)
+def test_dump_on_signal(tmpdir):
+    path = str(tmpdir.join('out.pstats'))
+    profiler = Profiler()
+    previous = signal.getsignal(signal.SIGUSR1)
+    profiler.start()
+    try:
+        assert dump_on_signal(profiler, path) is True
+        work_in_main()
+        os.kill(os.getpid(), signal.SIGUSR1)
+        # Still profiling after the snapshot
+        work_in_thread()
+    finally:
+        profiler.stop()
+        signal.signal(signal.SIGUSR1, previous)
+    functions = get_functions(path)
+    assert 'work_in_main' in functions
+    assert 'work_in_thread' not in functions
@@ -0,0 +1,58 @@
+from __future__ import unicode_literals
+
+import io
+
+import mock
+
+from imgurup.progress import DBusProgressDialog
+from imgurup.progress import PipeProgressDialog
+from imgurup.progress import ProgressBar
+
+
+def test_pipe_progress_dialog():
+    dialog = PipeProgressDialog(['cat'], 4)
+    dialog.update(1, 'a.jpg')
+    dialog.update(4, 'b.jpg')
+    dialog.close()
+    assert dialog._process.stdout.read().decode('utf-8') == (
+        '25\n# a.jpg\n100\n# b.jpg\n'
+    )
+    # Closed dialog
+    dialog.update(4, 'c.jpg')
+
+
+def test_dbus_progress_dialog():
+    dialog = DBusProgressDialog(
+        ['echo', 'org.kde.kdialog-1', '/ProgressDialog'], 4
+    )
+    with mock.patch('imgurup.progress.subprocess.call') as call:
+        dialog.update(1, 'a.jpg')
+        dialog.close()
+    target = ['qdbus', 'org.kde.kdialog-1', '/ProgressDialog']
+    assert [c[0][0] for c in call.call_args_list] == [
+        target + ['Set', '', 'value', '1'],
+        target + ['setLabelText', 'a.jpg'],
+        target + ['close'],
+    ]
+
+
+def test_progress_bar():
+    stream = io.StringIO()
+    bar = ProgressBar(stream=stream, width=10)
+    a = mock.Mock(sent=512 * 1024, total=2 * 1024 * 1024, rate=512 * 1024,
+                  done=False)
+    bar.on_progress(a, {'path': 'dir/a.jpg'})
+    assert stream.getvalue() == (
+        '\ra.jpg [##        ] 25% 512.0KB/2.0MB 512.0KB/s ETA 3s'
+    )
+    b = mock.Mock(sent=0, total=2 * 1024 * 1024, rate=None, done=False)
+    bar.on_progress(b, {'path': 'b.jpg'})
+    assert bar.format_line() == (
+        '2 files [#         ] 12% 512.0KB/4.0MB 512.0KB/s ETA 7s'
+    )
+    a.done = b.done = True
+    bar.on_progress(a, {'path': 'dir/a.jpg'})
+    bar.on_progress(b, {'path': 'b.jpg'})
+    # The line is cleared when all are sent
+    line = stream.getvalue().split('\r')[-2]
+    assert line == ' ' * len(line)
@@ -0,0 +1,48 @@
+from __future__ import unicode_literals
+
+import pytest
+
+from imgurup.schedule import schedule_jobs
+
+
+@pytest.fixture(scope='function')
+def jobs(tmpdir):
+    jobs = []
+    for name, size in (('a.mp4', 300), ('b.png', 10), ('c.jpg', 100)):
+        path = tmpdir.join(name)
+        path.write_binary(b'\0' * size)
+        jobs.append({'path': str(path)})
+    jobs[2]['priority'] = 1
+    return jobs
+
+
+def get_names(jobs):
+    return [job['path'][-5:] for job in jobs]
+
+
+def test_fifo(jobs):
+    scheduled = schedule_jobs(iter(jobs), 'fifo', 200)
+    assert not isinstance(scheduled, list)
+    scheduled = list(scheduled)
+    assert get_names(scheduled) == ['a.mp4', 'b.png', 'c.jpg']
+    assert [job['size'] for job in scheduled] == [300, 10, 100]
+    assert [job['large'] for job in scheduled] == [True, False, False]
+
+
+def test_smallest(jobs):
+    jobs[1]['size'] = 1000
+    scheduled = schedule_jobs(jobs, 'smallest', None)
+    # The given size is kept, the file isn't stat again
+    assert get_names(scheduled) == ['c.jpg', 'a.mp4', 'b.png']
+    assert [job['index'] for job in scheduled] == [2, 0, 1]
+    assert 'large' not in scheduled[0]
+
+
+def test_priority(jobs):
+    scheduled = schedule_jobs(jobs, 'priority')
+    assert get_names(scheduled) == ['c.jpg', 'a.mp4', 'b.png']
+
+
+def test_unknown_policy(jobs):
+    with pytest.raises(ValueError):
+        schedule_jobs(jobs, 'random')
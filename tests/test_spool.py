@@ -0,0 +1,309 @@
+from __future__ import unicode_literals
+
+import os
+import json
+import threading
+from argparse import Namespace
+
+import mock
+import pytest
+
+import imgurup
+from imgurup.spool import Spool
+from imgurup.spool import run_worker
+from imgurup.testing import FakeImgur
+
+IMAGE_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), 'images', 'test.jpg'
+)
+
+
+def test_put_and_claim(tmpdir):
+    image = tmpdir.join('a.jpg')
+    image.write('a')
+    spool = Spool(str(tmpdir.join('spool')))
+    first = spool.put({'path': str(image), 'title': 'A'})
+    second = spool.put({'path': str(image)}, copy=True)
+    assert spool.pending() == [first, second]
+
+    job = spool.claim(first, 'host-1')
+    assert job['title'] == 'A'
+    assert job['path'] == str(image)
+    assert job['spool_claim'].endswith('.job.claimed-host-1')
+    # Already claimed
+    assert spool.claim(first) is None
+    assert spool.pending() == [second]
+
+    spool.release(job)
+    assert spool.pending() == [first, second]
+
+    jobs = list(spool.claim_all())
+    assert spool.pending() == []
+    copy = jobs[1]['path']
+    assert copy != str(image)
+    assert open(copy).read() == 'a'
+    for job in jobs:
+        spool.done(job)
+    assert os.listdir(spool.directory) == []
+
+
+def get_flush_args(tmpdir, paths, copy=False):
+    return Namespace(
+        f=paths, d=None, n=True, t=False, copy=copy,
+        spool=str(tmpdir.join('spool')), workers=1, min_workers=1,
+        breaker_threshold=5, breaker_cooldown=30, stale_timeout=600,
+        output='text'
+    )
+
+
+def get_flush_imgur():
+    imgur = mock.Mock()
+    imgur.journal = None
+    imgur.quiet = False
+    imgur.tracers = []
+    return imgur
+
+
+def test_queue_uploads_ndjson(tmpdir, capsys):
+    image = tmpdir.join('a.jpg')
+    image.write('a')
+    args = get_flush_args(tmpdir, [str(image)])
+    args.output = 'ndjson'
+    imgurup.queue_uploads(args)
+    out, err = capsys.readouterr()
+    # stdout is kept for the records
+    assert out == ''
+    assert 'Queued: ' in err
+
+
+def test_flush_spool(tmpdir, monkeypatch):
+    with open(os.path.join(os.path.dirname(__file__), 'images', 'test.jpg'),
+              'rb') as f:
+        data = f.read()
+    paths = []
+    for name in ('good', 'bad', 'rejected', 'missing'):
+        image = tmpdir.join(name + '.jpg')
+        image.write_binary(data)
+        paths.append(str(image))
+    args = get_flush_args(tmpdir, paths)
+    imgurup.queue_uploads(args)
+    spool = Spool(args.spool)
+    assert len(spool.pending()) == 4
+
+    imgur = get_flush_imgur()
+    imgur.is_reachable.return_value = False
+    with pytest.raises(SystemExit):
+        imgurup.flush_spool(imgur, args)
+    assert not imgur.upload_image.called
+
+    def upload_image(path, post_data, anonymous, content_type=None):
+        if path.endswith('bad.jpg'):
+            raise imgurup.ImgurError('Error in request_upload_image')
+        if path.endswith('rejected.jpg'):
+            imgur.last_status = 400
+            raise imgurup.ImgurError('Error in request_upload_image')
+        return {'id': 'xxxxxxx', 'link': 'link', 'deletehash': 'hash'}
+
+    os.remove(paths[3])
+    imgur.is_reachable.return_value = True
+    imgur.upload_image.side_effect = upload_image
+    with pytest.raises(SystemExit):
+        imgurup.flush_spool(imgur, args)
+    imgur.show_link.assert_called_once_with('link', 'hash')
+    # The connection error is kept for the next flush
+    assert len(spool.pending()) == 1
+    # The others never succeed
+    failed = sorted(
+        name for name in os.listdir(args.spool) if name.endswith('.failed')
+    )
+    assert len(failed) == 2
+    with open(os.path.join(args.spool, failed[1])) as f:
+        assert json.load(f)['path'] == paths[3]
+
+
+def test_flush_spool_server_error(tmpdir, monkeypatch):
+    monkeypatch.setattr('imgurup.time.sleep', mock.Mock())
+    args = get_flush_args(tmpdir, [IMAGE_PATH])
+    imgurup.queue_uploads(args)
+    with FakeImgur() as server:
+        imgur = imgurup.CLIImgur()
+        imgur.connect(server.url)
+        server.inject('server_error', path='^/3/image$', times=None)
+        with pytest.raises(SystemExit):
+            imgurup.flush_spool(imgur, args)
+    # Kept for the next flush
+    assert len(Spool(args.spool).pending()) == 1
+    assert not [
+        name for name in os.listdir(args.spool) if name.endswith('.failed')
+    ]
+
+
+def test_flush_spool_copy(tmpdir):
+    image = tmpdir.join('a.jpg')
+    with open(os.path.join(os.path.dirname(__file__), 'images', 'test.jpg'),
+              'rb') as f:
+        image.write_binary(f.read())
+    args = get_flush_args(tmpdir, [str(image)], copy=True)
+    imgurup.queue_uploads(args)
+    imgur = get_flush_imgur()
+    imgur.journal = mock.Mock()
+    imgur.upload_image.return_value = {
+        'id': 'xxxxxxx', 'link': 'link', 'deletehash': 'hash'
+    }
+    imgurup.flush_spool(imgur, args)
+    assert imgur.upload_image.call_args[0][0].startswith(args.spool)
+    # The file of the user is reported
+    assert imgur.journal.write.call_args[0][0]['path'] == str(image)
+    assert os.listdir(args.spool) == []
+
+
+def test_flush_spool_stale(tmpdir):
+    args = get_flush_args(tmpdir, [])
+    spool = Spool(args.spool)
+    name = spool.put({'path': 'http://example.com/a.jpg'})
+    job = spool.claim(name)
+    # Claimed by a flush which died
+    os.utime(job['spool_claim'], (0, 0))
+    imgur = get_flush_imgur()
+    imgur.upload_image.return_value = {
+        'id': 'xxxxxxx', 'link': 'link', 'deletehash': 'hash'
+    }
+    imgurup.flush_spool(imgur, args)
+    assert imgur.upload_image.called
+    assert os.listdir(args.spool) == []
+
+
+def test_recover_stale(tmpdir):
+    spool = Spool(str(tmpdir))
+    name = spool.put({'path': 'http://example.com/a.jpg'})
+    job = spool.claim(name, 'host-1')
+    assert spool.recover_stale(timeout=60) == 0
+    os.utime(job['spool_claim'], (0, 0))
+    assert spool.recover_stale(timeout=60) == 1
+    assert spool.pending() == [name]
+
+
+def test_claim_old_job(tmpdir):
+    spool = Spool(str(tmpdir))
+    name = spool.put({'path': 'http://example.com/a.jpg'})
+    os.utime(str(tmpdir.join(name + '.job')), (0, 0))
+    assert spool.claim(name, 'host-1') is not None
+    # Queued long ago, but just claimed
+    assert spool.recover_stale(timeout=60) == 0
+
+
+def test_claim_invalid_job(tmpdir):
+    spool = Spool(str(tmpdir))
+    name = spool.put({'path': 'http://example.com/a.jpg'})
+    tmpdir.join(name + '.job').write('{"path": ')
+    assert list(spool.claim_all('host-1')) == []
+    assert spool.pending() == []
+    assert os.listdir(str(tmpdir)) == [name + '.invalid']
+
+
+def test_claim_all_smallest(tmpdir):
+    spool = Spool(str(tmpdir.join('spool')))
+    names = []
+    for size in (3, 1, 2):
+        image = tmpdir.join('{size}.jpg'.format(size=size))
+        image.write('a' * size)
+        names.append(spool.put({'path': str(image)}))
+    jobs = spool.claim_all('host-1', True, 'smallest')
+    assert [job['spool_name'] for job in jobs] == [
+        names[1], names[2], names[0]
+    ]
+
+
+def test_run_worker(tmpdir):
+    spool = Spool(str(tmpdir))
+    names = [
+        spool.put({'path': 'http://example.com/{i}.jpg'.format(i=i)})
+        for i in range(10)
+    ]
+    imgur = mock.Mock()
+    imgur.tracers = []
+    imgur.upload_image.return_value = {
+        'id': 'xxxxxxx', 'link': 'link', 'deletehash': 'hash'
+    }
+    stop = threading.Event()
+    records = []
+
+    def on_result(record):
+        records.append(record)
+        if len(records) == len(names):
+            stop.set()
+
+    assert run_worker(
+        imgur, spool, 3, poll_interval=0.1, on_result=on_result, stop=stop
+    ) == (10, 0)
+    assert sorted(os.listdir(str(tmpdir))) == sorted(
+        name + '.result' for name in names
+    )
+    with open(str(tmpdir.join(names[0] + '.result'))) as f:
+        assert json.load(f)['id'] == 'xxxxxxx'
+
+
+def test_run_worker_engine(tmpdir):
+    spool = Spool(str(tmpdir))
+    spool.put({'path': 'http://example.com/a.jpg'})
+    engine = mock.Mock()
+    engine.run.return_value = (1, 0)
+    imgur = mock.Mock()
+    imgur.tracers = [mock.Mock()]
+    assert run_worker(imgur, spool, engine=engine) == (1, 0)
+    assert engine.run.called
+    # Already set up by its maker
+    assert not imgur.tracers[0].on_engine.called
+
+
+def run_failing_worker(spool, error, status=None):
+    imgur = mock.Mock()
+    imgur.tracers = []
+    stop = threading.Event()
+
+    def upload_image(path, post_data, anonymous, content_type=None):
+        imgur.last_status = status
+        stop.set()
+        raise error
+
+    imgur.upload_image.side_effect = upload_image
+    return run_worker(imgur, spool, 1, poll_interval=0.1, stop=stop)
+
+
+def test_run_worker_connection_error(tmpdir):
+    spool = Spool(str(tmpdir))
+    name = spool.put({'path': 'http://example.com/a.jpg'})
+    assert run_failing_worker(
+        spool, imgurup.ImgurConnectionError('Error in request_upload_image')
+    ) == (0, 1)
+    # Put back for a later try
+    assert spool.pending() == [name]
+    assert os.listdir(str(tmpdir)) == [name + '.job']
+
+
+def test_run_worker_rejected(tmpdir):
+    spool = Spool(str(tmpdir))
+    name = spool.put({'path': 'http://example.com/a.jpg'})
+    assert run_failing_worker(
+        spool, imgurup.ImgurError('Error in request_upload_image'), 400
+    ) == (0, 1)
+    assert os.listdir(str(tmpdir)) == [name + '.failed']
+    with open(str(tmpdir.join(name + '.failed'))) as f:
+        assert json.load(f)['http_status'] == 400
+
+
+def test_run_worker_missing_file(tmpdir):
+    image = tmpdir.join('a.jpg')
+    image.write('a')
+    spool = Spool(str(tmpdir.join('spool')))
+    name = spool.put({'path': str(image)})
+    image.remove()
+    imgur = mock.Mock()
+    imgur.tracers = []
+    stop = threading.Event()
+    assert run_worker(
+        imgur, spool, 1, poll_interval=0.1,
+        on_result=lambda record: stop.set(), stop=stop
+    ) == (0, 1)
+    assert not imgur.upload_image.called
+    assert os.listdir(spool.directory) == [name + '.failed']
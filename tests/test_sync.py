@@ -0,0 +1,116 @@
+from __future__ import unicode_literals
+
+import os
+
+import mock
+import pytest
+
+from imgurup.sync import INDEX_NAME
+from imgurup.sync import load_index
+from imgurup.sync import scan_directory
+from imgurup.sync import sync_directory
+
+JPEG = b'\xff\xd8\xff\xe0\x00\x10JFIF'
+
+
+@pytest.fixture(scope='function')
+def imgur():
+    m = mock.Mock()
+    counter = {'n': 0}
+
+    def upload_image(path, post_data, anonymous, content_type=None):
+        counter['n'] += 1
+        return {
+            'id': 'id{n}'.format(n=counter['n']),
+            'link': path,
+            'deletehash': 'hash',
+        }
+
+    m.upload_image.side_effect = upload_image
+    return m
+
+
+def test_scan_directory(tmpdir):
+    tmpdir.join('a.jpg').write('a')
+    tmpdir.join('notes.txt').write('notes')
+    tmpdir.join('.hidden.png').write('hidden')
+    tmpdir.mkdir('sub').join('b.png').write('b')
+    files = scan_directory(str(tmpdir))
+    assert sorted(files) == ['a.jpg', 'notes.txt', 'sub/b.png']
+    assert files['a.jpg'][0] == 1
+
+
+def test_sync_directory(tmpdir, imgur):
+    directory = str(tmpdir)
+    tmpdir.join('b.jpg').write_binary(JPEG + b'b')
+    tmpdir.join('a.jpg').write_binary(JPEG + b'a')
+    # Picked by their content, not by their name
+    tmpdir.join('fake.jpg').write('not an image')
+
+    assert sync_directory(
+        imgur, directory, 'XXXXX', workers=1
+    ) == (2, 0, 0)
+    assert imgur.upload_image.call_count == 2
+    ids = imgur.request_album_set_images.call_args[0][1]
+    index = load_index(directory)
+    assert index['album'] == 'XXXXX'
+    assert ids == ['id1', 'id2']
+
+    # Nothing changed: no read, no network
+    imgur.reset_mock()
+    with mock.patch('imgurup.sync.get_file_hash') as get_file_hash:
+        assert sync_directory(imgur, directory, 'XXXXX') == (0, 0, 0)
+        assert not get_file_hash.called
+    assert not imgur.method_calls
+
+    # Touched only: read but not uploaded
+    os.utime(str(tmpdir.join('a.jpg')), (1, 1))
+    assert sync_directory(imgur, directory, 'XXXXX') == (0, 0, 0)
+    assert not imgur.method_calls
+    assert load_index(directory)['files']['a.jpg']['mtime'] == 1
+
+    # Changed and removed files
+    tmpdir.join('a.jpg').remove()
+    tmpdir.join('b.jpg').write_binary(JPEG + b'bb')
+    assert sync_directory(
+        imgur, directory, 'XXXXX', delete_remote=True
+    ) == (1, 1, 0)
+    index = load_index(directory)
+    assert sorted(index['files']) == ['b.jpg']
+    imgur.request_album_set_images.assert_called_once_with(
+        'XXXXX', [index['files']['b.jpg']['id']]
+    )
+    deleted = [c[0][0] for c in imgur.request_image_delete.call_args_list]
+    assert sorted(deleted) == ['id1', 'id2']
+    assert os.path.exists(str(tmpdir.join(INDEX_NAME)))
+
+
+def test_sync_directory_upload_fail(tmpdir, imgur):
+    imgur.upload_image.side_effect = IOError('broken')
+    tmpdir.join('a.jpg').write_binary(JPEG + b'a')
+    assert sync_directory(imgur, str(tmpdir), 'XXXXX') == (0, 0, 1)
+    assert load_index(str(tmpdir))['files'] == {}
+    # No image in the album
+    assert not imgur.request_album_set_images.called
+
+
+def test_sync_directory_engine(tmpdir, imgur):
+    tmpdir.join('a.jpg').write_binary(JPEG + b'a')
+    jobs = []
+
+    def run(checked_jobs, on_result):
+        for index, job in enumerate(checked_jobs):
+            jobs.append(job)
+            on_result({
+                'index': index, 'error': None, 'id': 'id1',
+                'deletehash': 'hash'
+            })
+
+    engine = mock.Mock()
+    engine.run.side_effect = run
+    assert sync_directory(imgur, str(tmpdir), 'XXXXX', engine=engine) == (
+        1, 0, 0
+    )
+    # Checked by the preflight before the engine
+    assert jobs[0]['content_type'] == 'image/jpeg'
+    imgur.request_album_set_images.assert_called_once_with('XXXXX', ['id1'])
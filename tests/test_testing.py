@@ -0,0 +1,266 @@
+from __future__ import unicode_literals
+
+import os
+import time
+
+import mock
+import pytest
+
+from imgurup import CLIImgur
+from imgurup import ImgurError
+from imgurup.testing import FakeImgur
+from imgurup.testing import Fault
+from imgurup.testing import parse_multipart
+
+IMAGE_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), 'images', 'test.jpg'
+)
+
+
+@pytest.fixture(scope='function')
+def server(request):
+    server = FakeImgur(keep_content=True).start()
+    request.addfinalizer(server.stop)
+    return server
+
+
+def get_imgur(server):
+    imgur = CLIImgur()
+    imgur.connect(server.url)
+    imgur.exit_on_error = False
+    imgur.write_tokens_to_config = mock.Mock()
+    server.set_tokens(imgur)
+    return imgur
+
+
+def test_parse_multipart():
+    body = (
+        b'--xyz\r\nContent-Disposition: form-data; name="title"\r\n\r\n'
+        b'T\r\n--xyz\r\nContent-Disposition: form-data; name="image"; '
+        b'filename="a.png"\r\nContent-Type: image/png\r\n\r\n\x89PNG\r\n'
+        b'--xyz--\r\n'
+    )
+    assert parse_multipart(body, 'multipart/form-data; boundary=xyz') == {
+        'title': ('T', None, None),
+        'image': (b'\x89PNG', 'a.png', 'image/png'),
+    }
+
+
+def test_connect():
+    imgur = CLIImgur()
+    imgur.connect('http://127.0.0.1:8080')
+    assert imgur._connect.__class__.__name__ == 'HTTPConnection'
+    assert (imgur._connect.host, imgur._connect.port) == ('127.0.0.1', 8080)
+    imgur.connect()
+    assert imgur._connect.__class__.__name__ == 'HTTPSConnection'
+    assert (imgur._connect.host, imgur._connect.port) == (
+        'api.imgur.com', 443
+    )
+
+
+def test_upload_image(server):
+    imgur = get_imgur(server)
+    data = imgur.upload_image(IMAGE_PATH, {'title': 'Title'})
+    image = server.images[data['id']]
+    assert image['title'] == 'Title'
+    with open(IMAGE_PATH, 'rb') as f:
+        assert image['content'] == f.read()
+    assert data['deletehash'] == image['deletehash']
+    assert data['link'] == server.url + '/' + data['id'] + '.jpg'
+    anonymous = imgur.upload_image(IMAGE_PATH, anonymous=True)
+    assert server.images[anonymous['id']]['account_id'] is None
+    # The connection is kept alive
+    assert server.counters['connections'] == 1
+    assert server.requests == [('POST', '/3/image')] * 2
+    assert imgur.is_reachable()
+
+
+def test_albums(server):
+    imgur = get_imgur(server)
+    ids = [imgur.upload_image(IMAGE_PATH)['id'] for i in range(3)]
+    album = imgur.request_album_create(ids[:1], title='Album')
+    imgur.request_album_add_images(album['id'], ids[1:])
+    assert [i['id'] for i in imgur.request_album_images(album['id'])] == ids
+    albums = imgur.request_album_list()
+    assert [(a['id'], a['title'], a['images_count']) for a in albums] == [
+        (album['id'], 'Album', 3)
+    ]
+    imgur.request_image_delete(ids[0])
+    assert len(imgur.request_album_images(album['id'])) == 2
+    assert len(imgur.request_account_images()) == 2
+    assert server.remove_album(album['id'])
+    assert imgur.request_album_list() == []
+
+
+def test_token_refresh(server, monkeypatch):
+    monkeypatch.setattr('imgurup.time.sleep', mock.Mock())
+    imgur = get_imgur(server)
+    server.expire_tokens()
+    assert imgur.request_album_list() == []
+    assert imgur._access_token == server.access_token
+    assert imgur.write_tokens_to_config.call_count == 1
+    assert [path for method, path in server.requests] == [
+        '/3/account/me/albums', '/oauth2/token', '/3/account/me/albums'
+    ]
+
+
+def test_rate_limit(monkeypatch):
+    monkeypatch.setattr('imgurup.time.sleep', mock.Mock())
+    tracer = mock.Mock()
+    with FakeImgur(rate_limits={'post': 1}) as server:
+        imgur = get_imgur(server)
+        imgur.add_tracer(tracer)
+        imgur.upload_image(IMAGE_PATH)
+        events = [
+            c[0] for c in tracer.on_event.call_args_list
+            if c[0][0] == 'rate_limit'
+        ]
+        assert events[-1][1] == {'client': 12499, 'user': 1999, 'post': 0}
+        with pytest.raises(ImgurError):
+            imgur.upload_image(IMAGE_PATH)
+        # Refused, then refused again without a token refresh
+        assert server.requests.count(('POST', '/3/image')) == 3
+        assert ('POST', '/oauth2/token') not in server.requests
+        assert len(server.images) == 1
+
+
+def test_latency():
+    with FakeImgur(latency=0.1) as server:
+        imgur = get_imgur(server)
+        started = time.time()
+        imgur.request_album_list()
+        assert time.time() - started >= 0.1
+
+
+def test_max_body(tmpdir):
+    path = str(tmpdir.join('large.jpg'))
+    with open(path, 'wb') as f:
+        f.write(b'\xff\xd8\xff\xe0' + b'\x00' * 200000 + b'end')
+    with FakeImgur(keep_content=True, max_body=4096) as server:
+        imgur = get_imgur(server)
+        data = imgur.upload_image(path, {'title': 'Title'})
+        image = server.images[data['id']]
+        # The middle of the image is dropped
+        assert image['title'] == 'Title'
+        assert image['content'].startswith(b'\xff\xd8\xff\xe0')
+        assert image['content'].endswith(b'end')
+        assert len(image['content']) < 50000
+        assert server.counters['bytes_received'] > 200000
+
+
+@pytest.fixture(scope='function')
+def no_sleep(monkeypatch):
+    # The server waits with time.sleep too, so no latency with this fixture
+    monkeypatch.setattr('imgurup.time.sleep', mock.Mock())
+
+
+def test_fault():
+    with pytest.raises(ValueError):
+        Fault('unknown')
+    with pytest.raises(ValueError):
+        Fault('server_error', interval=1)
+    fault = Fault('server_error', method='POST', path=r'^/3/image$')
+    assert fault.matches('POST', '/3/image')
+    assert not fault.matches('GET', '/3/image')
+    assert not fault.matches('POST', '/3/image/xxxxxxx')
+
+
+def test_inject(server, no_sleep):
+    imgur = get_imgur(server)
+    server.inject('server_error', path='/3/album', times=2, status=502)
+    server.inject('unauthorized')
+    server.inject('server_error', path='/3/album', times=None)
+    assert server.take_fault('GET', '/3/account/me/albums').mode == (
+        'unauthorized'
+    )
+    for i in range(2):
+        assert server.take_fault('POST', '/3/album').options == {
+            'status': 502
+        }
+    for i in range(3):
+        assert server.take_fault('POST', '/3/album').options == {}
+    assert server.take_fault('GET', '/3/account/me/albums') is None
+    assert server.counters['fault:server_error'] == 5
+    assert server.counters['fault:unauthorized'] == 1
+    server.faults = []
+    assert imgur.request_album_list() == []
+
+
+def test_server_error_burst(server, no_sleep):
+    imgur = get_imgur(server)
+    server.inject('server_error', path='/3/image', times=1)
+    assert imgur.upload_image(IMAGE_PATH)['id'] in server.images
+    assert server.requests.count(('POST', '/3/image')) == 2
+    server.inject('server_error', path='/3/image', times=2)
+    with pytest.raises(ImgurError):
+        imgur.upload_image(IMAGE_PATH)
+    assert len(server.images) == 1
+
+
+@pytest.mark.parametrize('mode', ['drop_request', 'garbage'])
+def test_connection_fault(server, no_sleep, mode):
+    imgur = get_imgur(server)
+    server.inject(mode, path='/3/image')
+    assert imgur.upload_image(IMAGE_PATH)['id'] in server.images
+    assert len(server.images) == 1
+    assert server.counters['connections'] == 2
+
+
+def test_drop_response(server, no_sleep):
+    imgur = get_imgur(server)
+    imgur.fingerprint_uploads = True
+    server.inject('drop_response', path='/3/image')
+    data = imgur.upload_image(IMAGE_PATH)
+    # Found by its fingerprint instead of being uploaded again
+    assert list(server.images) == [data['id']]
+    assert server.requests == [
+        ('POST', '/3/image'), ('GET', '/3/account/me/images/0')
+    ]
+
+
+def test_unauthorized(server, no_sleep):
+    imgur = get_imgur(server)
+    token = server.access_token
+    server.inject('unauthorized')
+    assert imgur.request_album_list() == []
+    assert imgur._access_token != token
+    assert [path for method, path in server.requests] == [
+        '/3/account/me/albums', '/oauth2/token', '/3/account/me/albums'
+    ]
+
+
+def test_rate_limit_fault(server, no_sleep):
+    imgur = get_imgur(server)
+    tracer = mock.Mock()
+    imgur.add_tracer(tracer)
+    server.inject('rate_limit', path='/3/image', reset=30)
+    imgur.upload_image(IMAGE_PATH)
+    events = [
+        c[0][1] for c in tracer.on_event.call_args_list
+        if c[0][0] == 'rate_limit'
+    ]
+    assert events[0] == {'user': 0, 'post': 0}
+    assert len(server.images) == 1
+
+
+def test_trickle(server):
+    imgur = get_imgur(server)
+    server.inject('trickle', interval=0.002)
+    started = time.time()
+    assert imgur.request_album_list() == []
+    # The bytes of the response one by one
+    size = len(b'{"data": [], "success": true, "status": 200}')
+    assert server.counters['bytes_sent'] == size
+    assert time.time() - started >= size * 0.002
+
+
+def test_half_open(server, no_sleep):
+    imgur = get_imgur(server)
+    imgur.timeout = 0.2
+    imgur.connect(server.url)
+    server.inject('half_open', path='/3/image')
+    started = time.time()
+    assert imgur.upload_image(IMAGE_PATH)['id'] in server.images
+    assert time.time() - started >= 0.2
+    # The half open request did not reach the API
+    assert len(server.images) == 1
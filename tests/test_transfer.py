@@ -0,0 +1,52 @@
+from __future__ import unicode_literals
+
+from imgurup import transfer
+from imgurup.transfer import MultipartBody
+from imgurup.transfer import TransferProgress
+
+
+def test_multipart_body(tmpdir, monkeypatch):
+    monkeypatch.setattr(transfer, 'BLOCK_SIZE', 4)
+    image = tmpdir.join('a.jpg')
+    image.write_binary(b'0123456789')
+    body = MultipartBody([b'--b\r\n', ('file', str(image)), b'\r\n--b--'])
+    assert len(body) == 22
+    assert body.getvalue() == b'--b\r\n0123456789\r\n--b--'
+
+    sent = []
+    body.rewind(sent.append)
+    blocks = []
+    while True:
+        block = body.read(4)
+        if not block:
+            break
+        blocks.append(block)
+    assert blocks == [b'--b\r\n', b'0123', b'4567', b'89\r\n--b--']
+    assert sent == [5, 9, 13, 22]
+
+    # Sent again after a retry
+    body.rewind()
+    assert body.read() == b'--b\r\n0123456789\r\n--b--'
+
+
+def test_transfer_progress():
+    now = [100.0]
+    progress = TransferProgress(1000, clock=lambda: now[0])
+    assert progress.eta is None
+    assert progress.average is None
+    # Too soon to report
+    assert progress.update(10) is False
+    now[0] += 1
+    assert progress.update(100) is True
+    assert progress.rate == 100
+    assert progress.average == 100
+    assert progress.eta == 9
+    now[0] += 1
+    assert progress.update(400) is True
+    assert progress.rate == 100 + transfer.RATE_SMOOTHING * 200
+    assert progress.average == 200
+    assert not progress.done
+    # The end is always reported
+    assert progress.update(1000) is True
+    assert progress.done
+    assert progress.eta == 0
@@ -0,0 +1,62 @@
+from __future__ import unicode_literals
+
+import time
+import threading
+
+import pytest
+
+from imgurup.watch import DirectoryWatcher
+from imgurup.watch import is_ignored
+
+
+def collect(watcher, count, timeout=10):
+    paths = []
+
+    def consume():
+        for path in watcher:
+            paths.append(path)
+            if len(paths) == count:
+                return
+
+    thread = threading.Thread(target=consume)
+    thread.daemon = True
+    thread.start()
+    thread.join(timeout)
+    watcher.close()
+    return paths
+
+
+def test_is_ignored():
+    assert is_ignored('.hidden.png')
+    assert is_ignored('download.jpg.part')
+    assert is_ignored('a.jpg~')
+    assert not is_ignored('screenshot.png')
+
+
+@pytest.mark.parametrize('use_inotify', [True, False])
+def test_watch_new_files(tmpdir, use_inotify):
+    tmpdir.join('old.jpg').write('old')
+    watcher = DirectoryWatcher(
+        str(tmpdir), debounce=0.1, interval=0.05, use_inotify=use_inotify
+    )
+    names = ['{i}.png'.format(i=i) for i in range(200)]
+    for name in names:
+        tmpdir.join(name).write('data')
+    tmpdir.join('skip.tmp').write('data')
+
+    paths = collect(watcher, len(names))
+    assert sorted(paths) == sorted(str(tmpdir.join(n)) for n in names)
+
+
+def test_watch_waits_until_written(tmpdir):
+    watcher = DirectoryWatcher(
+        str(tmpdir), debounce=0.3, interval=0.05, use_inotify=False
+    )
+    path = str(tmpdir.join('big.png'))
+    with open(path, 'wb') as f:
+        f.write(b'part')
+        f.flush()
+        time.sleep(0.2)
+        assert watcher._ready.empty()
+        f.write(b'rest')
+    assert collect(watcher, 1) == [path]